@@ -0,0 +1,210 @@
+"""
+Utilidades de línea de comandos: `python -m app.cli <comando>`
+
+  export   vuelca la hoja de datos del maestro a CSV o JSONL (streaming)
+  audit    celdas fuera de los enums del maestro, con sugerencias (JSONL)
+  backfill carga masiva de un directorio de fichas DOCX en un Excel (pool de procesos)
+  compact  reescribe un xlsx sin peso muerto
+  rollover cambio de año: archiva las fichas viejas y deja la hoja del año nuevo
+"""
+import argparse
+import json
+import os
+import sys
+
+from app.config import settings
+
+
+def _open_output(path: str):
+    return sys.stdout.buffer if path == "-" else open(path, "wb")
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp = path + ".part"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _set_env(path: str, key: str, value: str):
+    """Escribe KEY="valor" en el .env (sustituye la línea si ya estaba)."""
+    lines = []
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    entry = f'{key}="{value}"'
+    lines = [entry if ln.split("=", 1)[0].strip() == key else ln for ln in lines]
+    if entry not in lines:
+        lines.append(entry)
+    _write_atomic(path, ("\n".join(lines) + "\n").encode("utf-8"))
+    if key in os.environ:
+        print(f"[rollover] {key} está definida en el entorno y manda sobre {path}", file=sys.stderr)
+
+
+def cmd_export(args) -> int:
+    from app.services import exporter
+    out = _open_output(args.output)
+    try:
+        for chunk in exporter.iter_export(args.input, args.format, args.sheet, args.header_row):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    return 0
+
+
+def cmd_audit(args) -> int:
+    from app.services import audit
+    with open(args.enums_from or args.input, "rb") as f:
+        excel_bytes = f.read()
+    out = _open_output(args.output)
+    try:
+        for chunk in audit.iter_audit_jsonl(args.input, excel_bytes, sheet=args.sheet, header_row=args.header_row):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    return 0
+
+
+def cmd_backfill(args) -> int:
+    from app.services import backfill
+
+    def progress(n: int, total: int):
+        if n == total or n % 50 == 0:
+            print(f"[backfill] {n}/{total} fichas procesadas", file=sys.stderr)
+
+    checkpoint = args.checkpoint or os.path.join(args.directory, ".backfill.jsonl")
+    summary = backfill.run_backfill(
+        args.directory, args.target, checkpoint, args.sheet,
+        output_path=args.output, jobs=args.jobs, recursive=not args.no_recursive,
+        retry_failed=args.retry_failed, extract_only=args.extract_only, on_progress=progress,
+    )
+    json.dump(summary, sys.stdout, ensure_ascii=False, indent=2)
+    print()
+    return 1 if summary["failures"] else 0
+
+
+def cmd_compact(args) -> int:
+    from app.services import compactor
+
+    with open(args.input, "rb") as f:
+        excel_bytes = f.read()
+    try:
+        compacted, report = compactor.compact_with_report(excel_bytes, args.spare_rows)
+    except compactor.CompactionError as e:
+        print(f"[compact] {e}; no se escribe nada", file=sys.stderr)
+        return 1
+    if not args.dry_run:
+        out_path = args.output or args.input
+        _write_atomic(out_path, compacted)
+        report["output"] = out_path
+    json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+    print()
+    return 0
+
+
+def cmd_rollover(args) -> int:
+    from app.services import rollover
+    from app.services.workbook_loader import resolve_data_sheet
+    from app.utils.dates import parse_date
+
+    cutoff = parse_date(args.cutoff) if args.cutoff else None
+    if args.cutoff and cutoff is None:
+        print(f"[rollover] fecha de corte no reconocida: {args.cutoff}", file=sys.stderr)
+        return 2
+    if args.year is None and cutoff is None:
+        print("[rollover] indica --year, --cutoff o ambos", file=sys.stderr)
+        return 2
+    new_sheet = settings.ROLLOVER_SHEET_TEMPLATE.format(year=args.year) if args.year else None
+
+    with open(args.input, "rb") as f:
+        excel_bytes = f.read()
+    archive_path = args.archive or rollover.archive_path(resolve_data_sheet(excel_bytes), cutoff)
+    if os.path.exists(archive_path) and not args.dry_run:
+        print(f"[rollover] {archive_path} ya existe; no se sobrescribe (usa --archive)", file=sys.stderr)
+        return 1
+    try:
+        active, archive, report = rollover.rollover_with_report(excel_bytes, new_sheet, cutoff, args.spare_rows)
+    except rollover.RolloverError as e:
+        print(f"[rollover] {e}; no se escribe nada", file=sys.stderr)
+        return 1
+    if not args.dry_run:
+        # primero el archivo: si algo falla después, las fichas siguen en el maestro
+        if report["archived"]:
+            os.makedirs(os.path.dirname(os.path.abspath(archive_path)), exist_ok=True)
+            _write_atomic(archive_path, archive)
+        out_path = args.output or args.input
+        _write_atomic(out_path, active)
+        report.update(archive=archive_path if report["archived"] else None, output=out_path)
+        if report["sheet_to"] != report["sheet_from"] and not args.no_env:
+            _set_env(args.env_file, "MASTER_DATA_SHEET", report["sheet_to"])
+            report["env"] = args.env_file
+        if os.path.abspath(out_path) == os.path.abspath(settings.MASTER_EXCEL_PATH):
+            report["fichas_db"] = rollover.refresh_caches(out_path)
+    json.dump(report, sys.stdout, ensure_ascii=False, indent=2, default=str)
+    print()
+    return 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m app.cli", description="Utilidades de FichaSync")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("export", help="exporta la hoja de datos a CSV/JSONL")
+    p.add_argument("--input", default=settings.MASTER_EXCEL_PATH, help="xlsx (por defecto el maestro)")
+    p.add_argument("--sheet", default=None, help="hoja de datos (por defecto la del libro)")
+    p.add_argument("--header-row", type=int, default=settings.MASTER_HEADER_ROW)
+    p.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+    p.add_argument("-o", "--output", default="-", help="fichero de salida ('-' = stdout)")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("audit", help="comprueba las celdas contra los enums del maestro")
+    p.add_argument("--input", default=settings.MASTER_EXCEL_PATH, help="xlsx a auditar (por defecto el maestro)")
+    p.add_argument("--enums-from", default=None, help="xlsx del que sacar los enums (por defecto --input)")
+    p.add_argument("--sheet", default=None, help="hoja de datos (por defecto la del libro)")
+    p.add_argument("--header-row", type=int, default=settings.MASTER_HEADER_ROW)
+    p.add_argument("-o", "--output", default="-", help="fichero de salida ('-' = stdout)")
+    p.set_defaults(func=cmd_audit)
+
+    p = sub.add_parser("backfill", help="carga masiva de fichas DOCX en un Excel")
+    p.add_argument("directory", help="directorio con los .docx")
+    p.add_argument("--target", default=settings.MASTER_EXCEL_PATH, help="xlsx destino (por defecto el maestro)")
+    p.add_argument("-o", "--output", default=None, help="xlsx de salida (por defecto se reescribe --target)")
+    p.add_argument("--sheet", default=None, help="hoja de datos (por defecto la del libro)")
+    p.add_argument("--checkpoint", default=None, help="JSONL de progreso (por defecto <directorio>/.backfill.jsonl)")
+    p.add_argument("-j", "--jobs", type=int, default=None, help="procesos del pool (por defecto nº de CPUs)")
+    p.add_argument("--no-recursive", action="store_true", help="no entrar en subdirectorios")
+    p.add_argument("--retry-failed", action="store_true", help="reintenta los ficheros que fallaron")
+    p.add_argument("--extract-only", action="store_true", help="solo rellena el checkpoint, no escribe el Excel")
+    p.set_defaults(func=cmd_backfill)
+
+    p = sub.add_parser("compact", help="reescribe un xlsx sin peso muerto (filas, estilos, rangos...)")
+    p.add_argument("--input", default=settings.MASTER_EXCEL_PATH, help="xlsx a compactar (por defecto el maestro)")
+    p.add_argument("-o", "--output", default=None, help="xlsx de salida (por defecto se reescribe --input)")
+    p.add_argument("--spare-rows", type=int, default=None,
+                   help=f"filas vacías con formato a conservar bajo los datos (por defecto {settings.WORKBOOK_COMPACT_SPARE_ROWS})")
+    p.add_argument("--dry-run", action="store_true", help="solo informa, no escribe")
+    p.set_defaults(func=cmd_compact)
+
+    p = sub.add_parser("rollover", help="cambio de año: archiva las fichas viejas y deja la hoja del año nuevo")
+    p.add_argument("--input", default=settings.MASTER_EXCEL_PATH, help="xlsx activo (por defecto el maestro)")
+    p.add_argument("--year", type=int, default=None,
+                   help=f"año nuevo: la hoja de datos pasa a '{settings.ROLLOVER_SHEET_TEMPLATE}'")
+    p.add_argument("--cutoff", default=None,
+                   help=f"solo se archivan las fichas con {settings.ROLLOVER_DATE_COLUMN} anterior (AAAA-MM-DD o DD/MM/AAAA)")
+    p.add_argument("--archive", default=None, help=f"xlsx de archivo (por defecto en {settings.ROLLOVER_ARCHIVE_DIR})")
+    p.add_argument("-o", "--output", default=None, help="xlsx activo de salida (por defecto se reescribe --input)")
+    p.add_argument("--spare-rows", type=int, default=None,
+                   help=f"filas vacías con formato bajo las fichas que se quedan (por defecto {settings.WORKBOOK_COMPACT_SPARE_ROWS})")
+    p.add_argument("--env-file", default=".env", help="dónde se guarda MASTER_DATA_SHEET con la hoja nueva")
+    p.add_argument("--no-env", action="store_true", help="no tocar el .env")
+    p.add_argument("--dry-run", action="store_true", help="solo informa, no escribe")
+    p.set_defaults(func=cmd_rollover)
+
+    args = ap.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
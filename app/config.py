@@ -1,5 +1,6 @@
 # app/config/settings.py
 import os
+import tempfile
 from typing import List
 from pydantic_settings import BaseSettings
 from pydantic import AnyHttpUrl
@@ -19,11 +20,107 @@ class Settings(BaseSettings):
     MAX_EXCEL_MB: int = 25
     MAX_MULTIPART_MB: int = 60
 
+    # Admisión de subidas: límites sobre el zip descomprimido (protección frente a zip bombs)
+    UPLOAD_MAX_UNCOMPRESSED_MB: int = 512     # todas las entradas del zip
+    UPLOAD_MAX_COST_MB: int = 256             # XML que se parsea (hojas, sharedStrings, document.xml)
+    UPLOAD_MAX_COMPRESSION_RATIO: int = 100   # por parte (> 1 MB); un xlsx normal ronda x5-x20
+    UPLOAD_MAX_ZIP_ENTRIES: int = 5000
+    # Carril de baja concurrencia para peticiones pesadas y límite por cliente (por proceso)
+    ADMISSION_HEAVY_COST_MB: int = 32
+    ADMISSION_HEAVY_CONCURRENCY: int = 1
+    ADMISSION_PER_CLIENT: int = 2
+    ADMISSION_WAIT_SECONDS: float = 10.0
+    # Proxies de confianza (IPs o CIDR): solo a ellos se les cree X-Forwarded-For/Forwarded
+    ADMISSION_TRUSTED_PROXIES: List[str] = []
+
     # 👇 AÑADIR ESTO
     MASTER_EXCEL_PATH: str = os.path.join(BASE_DIR, "data", "excel_maestro.xlsx")
     MASTER_DATA_SHEET: str = "Fichas 2025"
     MASTER_HEADER_ROW: int = 2
 
+    # Logs JSON en stdout a través de una cola (no bloquean las peticiones)
+    LOG_LEVEL: str = "INFO"
+    LOG_JSON: bool = True
+
+    # Perfil de memoria por etapa (tracemalloc + RSS) en preview/process/finalize
+    MEMPROFILE_ENABLED: bool = False          # todas las peticiones
+    MEMPROFILE_ALLOW_HEADER: bool = True      # o solo las que traen `X-Memory-Profile: 1` + `X-Admin-Token`
+    MEMPROFILE_DUMP_THRESHOLD_MB: int = 200   # por encima se vuelcan al log las líneas con más memoria
+    MEMPROFILE_TOP_N: int = 15
+    MEMPROFILE_FRAMES: int = 1
+
+    # Perfil de CPU bajo demanda (`X-Profile: 1` + `X-Admin-Token`); sin token queda desactivado
+    PROFILE_ADMIN_TOKEN: str = ""
+    PROFILE_DIR: str = os.path.join(tempfile.gettempdir(), "fichasync-profiles")
+    PROFILE_SAMPLE_INTERVAL_MS: float = 5.0   # muestreo de pilas para el flamegraph
+
+    # Caché de campos extraídos del DOCX (hash del DOCX + versión del parser)
+    DOCX_CACHE_MAX_ENTRIES: int = 256         # LRU en memoria; 0 = sin caché
+    DOCX_CACHE_DISK: bool = True              # segundo nivel en SHARED_CACHE_DIR (compartido entre workers)
+
+    # DOCX con varias fichas (?multi=true): procesos para parsear los tramos en paralelo
+    DOCX_SPLIT_WORKERS: int = 4               # tope (nunca más que CPUs); 0/1 = en el propio hilo
+    DOCX_SPLIT_PARALLEL_MIN: int = 16         # por debajo de estos tramos no compensa repartir
+
+    # Compactación del maestro (python -m app.cli compact / POST /sync/compact)
+    WORKBOOK_COMPACT_SPARE_ROWS: int = 500    # filas vacías con formato que se conservan bajo los datos
+
+    # Cambio de año (python -m app.cli rollover): hoja nueva por año y archivo de las filas viejas
+    ROLLOVER_SHEET_TEMPLATE: str = "Fichas {year}"   # también sirve para encontrar la hoja de datos de un libro
+    ROLLOVER_DATE_COLUMN: str = "VENCIMIENTO"        # con --cutoff, pasan al archivo las filas anteriores
+    ROLLOVER_ARCHIVE_DIR: str = os.path.join(BASE_DIR, "data", "archivo")
+
+    # "Tipo de ayuda" -> TEMÁTICAS: sinónimos extra (JSON {"frase": "Temática" | [...]}) y umbral
+    TEMATICAS_SYNONYMS_PATH: str = ""
+    TEMATICAS_MIN_SCORE: float = 0.5
+
+    # Vigilante del maestro: recarga enums al cambiar y los publica por SSE (/sync/enums/stream)
+    ENUMS_WATCH_ENABLED: bool = True
+    ENUMS_WATCH_BACKEND: str = "auto"        # auto | inotify (watchfiles) | poll
+    ENUMS_WATCH_POLL_SECONDS: float = 2.0    # intervalo de sondeo / debounce de inotify
+    ENUMS_WATCH_HISTORY: int = 32            # diffs guardados para reconectar con Last-Event-ID
+    ENUMS_SSE_HEARTBEAT_SECONDS: float = 15.0
+
+    # Arranque: el warm-up importa openpyxl/python-docx y (opcional) parsea el maestro
+    WARMUP_PARSE_MASTER: bool = True
+
+    # Jobs asíncronos (/sync/jobs): pool de workers, cola y spool de resultados
+    JOBS_MAX_CONCURRENT: int = 2
+    JOBS_MAX_PENDING: int = 8
+    JOBS_SPOOL_DIR: str = os.path.join(tempfile.gettempdir(), "fichasync-jobs")
+    JOBS_TTL_SECONDS: int = 3600
+
+    # Producción multi-worker (python -m app.serve). WORKERS=0 -> nº de CPUs
+    WORKERS: int = 0
+    WORKERS_MAX: int = 8
+    WORKER_TIMEOUT: int = 300
+
+    # Caché compartida en disco entre workers (enums, índices de cabeceras/filas)
+    SHARED_CACHE_ENABLED: bool = True
+    SHARED_CACHE_DIR: str = os.path.join(BASE_DIR, "data", "cache")   # pickles: directorio propio 0700
+    SHARED_CACHE_MAX_MB: int = 256
+
+    # Single-flight: peticiones simultáneas con el mismo libro/DOCX esperan a un único parseo
+    SINGLEFLIGHT_LOCK_TIMEOUT_SECONDS: float = 30.0   # espera máx. al candado entre workers
+
+    # Caché de respuestas idempotentes (preview/process/finalize) en disco
+    RESPONSE_CACHE_ENABLED: bool = True
+    RESPONSE_CACHE_DIR: str = os.path.join(tempfile.gettempdir(), "fichasync-responses")
+    RESPONSE_CACHE_MAX_MB: int = 512
+
+    # Sesiones con log de cambios (el xlsx solo se genera al descargar)
+    SESSIONS_DIR: str = os.path.join(tempfile.gettempdir(), "fichasync-sessions")
+    SESSIONS_TTL_SECONDS: int = 4 * 3600
+    SESSIONS_PARSED_MAX: int = 4   # libros parseados que se mantienen en memoria por worker
+
+    # Réplica SQLite de la hoja de datos del maestro (búsquedas en /fichas)
+    FICHAS_DB_PATH: str = os.path.join(tempfile.gettempdir(), "fichasync-fichas.sqlite3")
+
+    @property
+    def worker_count(self) -> int:
+        n = self.WORKERS or (os.cpu_count() or 1)
+        return max(1, min(n, self.WORKERS_MAX))
+
     class Config:
         env_file = ".env"
 
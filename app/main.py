@@ -1,9 +1,37 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from app.routers.sync import router as sync_router
+from app.routers.health import router as health_router
+from app.routers.fichas import router as fichas_router
+from app.services import enums_watch, jobs
+from app.services.docx_reader import shutdown_split_pool
+from app.services.warmup import start_background_warm_up
+from app.config import settings
+from app.utils.logging import RequestContextMiddleware, setup_logging, shutdown_logging
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    setup_logging(settings.LOG_LEVEL, settings.LOG_JSON)
+    # openpyxl/python-docx se cargan en segundo plano; /readyz indica cuándo acaba
+    start_background_warm_up()
+    # jobs que quedaron en cola/en curso en un worker que ya no existe -> fallidos
+    jobs.recover_orphans()
+    # recarga de enums al cambiar el maestro (push por SSE)
+    enums_watch.start()
+    yield
+    enums_watch.stop()
+    shutdown_split_pool()
+    shutdown_logging()
+
 
-app = FastAPI(title="FichaSync Service")
+app = FastAPI(title="FichaSync Service", lifespan=lifespan)
+app.add_middleware(RequestContextMiddleware)
 
 app.include_router(sync_router)
+app.include_router(health_router)
+app.include_router(fichas_router)
 
 # opcional: health
 @app.get("/health")
@@ -0,0 +1,37 @@
+from datetime import date
+
+from fastapi import APIRouter, HTTPException, Query
+
+from app.services import fichas_db
+
+router = APIRouter(prefix="/fichas", tags=["fichas"])
+
+
+@router.get("")
+def search_fichas(
+    q: str | None = Query(None, description="texto en el nombre de la ficha"),
+    tematica: str | None = Query(None, description="TEMÁTICA 1, 2 o 3"),
+    ambito: str | None = Query(None, description="texto en cualquiera de las columnas de ámbito"),
+    portal: str | None = Query(None, description="Mayores|Discapacidad|Familia|Mujer|Salud"),
+    vence_desde: date | None = None,
+    vence_hasta: date | None = None,
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+):
+    """Busca en la réplica SQLite del maestro (se refresca sola si el fichero ha cambiado)."""
+    try:
+        fichas_db.refresh()
+    except FileNotFoundError:
+        raise HTTPException(503, detail="Excel maestro no disponible")
+    try:
+        return fichas_db.search(q, tematica, ambito, portal, vence_desde, vence_hasta, limit, offset)
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+
+
+@router.post("/refresh")
+def refresh_fichas(force: bool = False):
+    try:
+        return fichas_db.refresh(force=force)
+    except FileNotFoundError:
+        raise HTTPException(503, detail="Excel maestro no disponible")
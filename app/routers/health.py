@@ -1,6 +1,22 @@
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from app.services import warmup
+from app.utils import metrics
+
 router = APIRouter(tags=["health"])
 
 @router.get("/healthz")
 def healthz():
     return {"ok": True}
+
+@router.get("/readyz")
+def readyz():
+    """Solo responde 200 cuando el warm-up ha terminado (para el balanceador/autoscaler)."""
+    st = warmup.status()
+    return JSONResponse(st, status_code=200 if st["ready"] else 503)
+
+@router.get("/metrics")
+def metrics_snapshot():
+    """Contadores y observaciones del worker que atiende (memoria por etapa, cachés...)."""
+    return metrics.snapshot()
@@ -1,22 +1,23 @@
 # app/routers/sync.py
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import APIRouter, UploadFile, File, HTTPException, Header, Query, Request
+from fastapi.responses import StreamingResponse, JSONResponse, FileResponse, Response
 from pydantic import BaseModel
-from typing import Any, Dict
-from io import BytesIO
+from typing import Any, Dict, BinaryIO, Iterator
+from contextlib import contextmanager
+from datetime import date, timedelta
+import asyncio
 import json
 
-from app.schema.enums import from_excel_bytes
-from app.services.transformer import transform_from_docx
-from app.services.excel_writer import write_auto_fields, update_row_in_excel
-from app.services.docx_reader import extract_fields_from_docx
+from app.services.excel_writer import update_row_in_excel
+from app.services.pipeline import run_multi_pipeline, run_sync_pipeline
+from app.services import admission, audit, compactor, enums_watch, exporter, jobs, response_cache, sessions, vencimientos
 from app.config import settings
-from app.services.enums_loader import load_enums_from_bytes
+from app.utils import memprofile, profiling
+from app.utils.logging import log_stage
 
-from fastapi import Query
-from app.config import settings
 from app.services.enums_loader import load_enums_from_bytes
 from app.services.enums_grouping import group_enums
+from app.services.workbook_loader import resolve_data_sheet
 
 
 
@@ -24,6 +25,8 @@ router = APIRouter(prefix="/sync", tags=["sync"])
 
 ALLOWED_DOCX = (".docx",)
 ALLOWED_XLSX = (".xlsx", ".xlsm")
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+STREAM_CHUNK_BYTES = 64 * 1024
 
 def _check_size(name: str, blob: bytes, max_mb: int):
     if len(blob) > max_mb * 1024 * 1024:
@@ -36,14 +39,100 @@ def _ext_ok(filename: str, allowed: tuple[str, ...]) -> bool:
     fn = (filename or "").lower()
     return any(fn.endswith(e) for e in allowed)
 
-# =========================
-# 1) PREVIEW (JSON)
-# =========================
-@router.post("/preview")
-async def preview(
-    docx: UploadFile = File(...),
-    excel: UploadFile = File(...),
-):
+def _iter_file(f: BinaryIO, chunk_size: int = STREAM_CHUNK_BYTES) -> Iterator[bytes]:
+    """Lee el fichero por bloques y lo cierra al terminar (o si el cliente corta)."""
+    try:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        f.close()
+
+def _xlsx_response(
+    written: Dict[str, Any],
+    fname: str,
+    cache: tuple[str, str, str | None] | None = None,
+) -> StreamingResponse:
+    """
+    Respuesta .xlsx en streaming desde el fichero temporal del writer, con Content-Length exacto.
+    Con `cache=(clave, endpoint, idempotency_key)` el cuerpo se copia a la caché de respuestas.
+    """
+    headers = {
+        "Content-Disposition": f'attachment; filename="{fname}"',
+        "X-Excel-Sheet": written["sheet"],
+        "X-Excel-Mode": written.get("mode", "update"),
+    }
+    if written["row"] is not None:  # sesión sin pasos: no hay fila que indicar
+        headers["X-Excel-Row"] = str(written["row"])  # base-0
+    if "rows" in written:  # DOCX con varias fichas: todas las filas escritas
+        headers["X-Excel-Rows"] = ",".join(str(r["row"]) for r in written["rows"])
+    body = _iter_file(written["updated_excel"])
+    if cache:
+        key, endpoint, idem = cache
+        body = response_cache.tee_file(key, endpoint, body, XLSX_MEDIA_TYPE, headers, idem)
+    return StreamingResponse(
+        body,
+        media_type=XLSX_MEDIA_TYPE,
+        headers={**headers, "Content-Length": str(written["size"]), "X-Cache": "MISS"},
+    )
+
+def _cache_lookup(key: str, endpoint: str, idempotency_key: str | None) -> Response | None:
+    """Respuesta guardada para una petición idéntica (o con la misma Idempotency-Key)."""
+    try:
+        meta = response_cache.lookup(key, endpoint, idempotency_key)
+    except response_cache.IdempotencyConflict as e:
+        raise HTTPException(422, detail=str(e))
+    if not meta:
+        return None
+    headers = {**meta.get("headers", {}), "X-Cache": "HIT"}
+    if meta["kind"] == "file":
+        return FileResponse(meta["path"], media_type=meta["media_type"], headers=headers)
+    return JSONResponse(meta["body"], headers=headers)
+
+def _profile_wanted(x_profile: str | None, x_admin_token: str | None) -> bool:
+    """`X-Profile: 1` solo con el token de admin (perfil de CPU de esta petición)."""
+    if (x_profile or "").strip() not in ("1", "true", "on"):
+        return False
+    if not profiling.token_ok(x_admin_token):
+        raise HTTPException(403, detail="X-Profile requiere un X-Admin-Token válido")
+    return True
+
+def _memprofile_wanted(x_memory_profile: str | None, x_admin_token: str | None) -> bool:
+    """`X-Memory-Profile: 1` también exige el token de admin: tracemalloc frena todo el worker."""
+    if settings.MEMPROFILE_ENABLED:
+        return True
+    if not memprofile.wanted(x_memory_profile):
+        return False
+    if not profiling.token_ok(x_admin_token):
+        raise HTTPException(403, detail="X-Memory-Profile requiere un X-Admin-Token válido")
+    return True
+
+def _inspect(blob: bytes, kind: str, label: str) -> float:
+    """Inspecciona el zip sin descomprimirlo; devuelve el coste estimado (MB de XML)."""
+    try:
+        return admission.inspect_zip(blob, kind, label).cost_mb
+    except admission.InvalidUpload as e:
+        raise HTTPException(400, detail=str(e))
+    except admission.UploadTooExpensive as e:
+        raise HTTPException(413, detail=str(e))
+
+@contextmanager
+def _admit(request: Request, cost_mb: float, wait: bool = True):
+    """
+    Hueco en el carril que corresponda al coste y límite por cliente (429 si no hay).
+    Solo desde endpoints sync def (threadpool): la espera al carril pesado bloquea el hilo.
+    """
+    client = admission.client_key(request.client.host if request.client else None, request.headers)
+    try:
+        with admission.admit(client, cost_mb, wait=wait) as lane:
+            yield lane
+    except admission.AdmissionBusy as e:
+        raise HTTPException(429, detail=str(e), headers={"Retry-After": str(int(settings.ADMISSION_WAIT_SECONDS))})
+
+def _read_sync_uploads(docx: UploadFile, excel: UploadFile) -> tuple[bytes, bytes, float]:
+    """Valida extensión, tamaño y contenido del par DOCX + Excel; devuelve sus bytes y el coste (MB)."""
     if not _ext_ok(docx.filename, ALLOWED_DOCX):
         raise HTTPException(400, detail="DOCX inválido")
     if not _ext_ok(excel.filename, ALLOWED_XLSX):
@@ -53,51 +142,156 @@ async def preview(
     excel_bytes = _read_bytes(excel)
     _check_size("DOCX", docx_bytes, settings.MAX_DOCX_MB)
     _check_size("Excel", excel_bytes, settings.MAX_EXCEL_MB)
+    cost_mb = _inspect(docx_bytes, "docx", "DOCX") + _inspect(excel_bytes, "xlsx", "Excel")
+    return docx_bytes, excel_bytes, cost_mb
 
-    enums = from_excel_bytes(excel_bytes)
-    fields = extract_fields_from_docx(docx_bytes)
-    auto_fields = transform_from_docx(fields, enums)
-    written = write_auto_fields(excel_bytes, auto_fields)  # {sheet,row,updated_excel_bytes}
+# preview/process/finalize son sync def: el pipeline (CPU) corre en el threadpool y no
+# bloquea el bucle de eventos (/readyz, SSE, /metrics); así también se solapan peticiones
+# y pueden esperar turno en el carril pesado.
 
-    return JSONResponse({
-        "sheet": written["sheet"],
-        "row": written["row"],  # base-0
-        "detected_fields": fields,
-        "auto_fields": auto_fields,
+# =========================
+# 1) PREVIEW (JSON)
+# =========================
+@router.post("/preview")
+def preview(
+    request: Request,
+    docx: UploadFile = File(...),
+    excel: UploadFile = File(...),
+    multi: bool = Query(False, description="DOCX con varias fichas: una fila por cada 'Nombre de la ayuda'"),
+    idempotency_key: str | None = Header(None, alias="Idempotency-Key"),
+    x_memory_profile: str | None = Header(None, alias="X-Memory-Profile"),
+    x_profile: str | None = Header(None, alias="X-Profile"),
+    x_admin_token: str | None = Header(None, alias="X-Admin-Token"),
+):
+    want_mem = _memprofile_wanted(x_memory_profile, x_admin_token)
+    want_cpu = _profile_wanted(x_profile, x_admin_token)
+    with memprofile.request("preview", want_mem) as prof, profiling.request("preview", want_cpu) as cpu:
+        with memprofile.stage("read"):
+            docx_bytes, excel_bytes, cost_mb = _read_sync_uploads(docx, excel)
+        key = response_cache.request_key("preview", {"multi": multi}, docx_bytes, excel_bytes)
+        cached = _cache_lookup(key, "preview", idempotency_key)
+        if cached:
+            return cached
+
+        # preview no descarga nada: no se serializa el xlsx
+        with _admit(request, cost_mb):
+            if multi:
+                res = run_multi_pipeline(docx_bytes, excel_bytes, save=False)
+            else:
+                res = run_sync_pipeline(docx_bytes, excel_bytes, save=False)
+    written = res["written"]  # {sheet,row,...}
+
+    if multi:
+        body = {
+            "sheet": written["sheet"],
+            "fichas": [
+                {
+                    **row,  # row (base-0), mode, changed
+                    "detected_fields": f["fields"],
+                    "tematicas": f["tematicas"],
+                    "auto_fields": f["auto_fields"],
+                }
+                for row, f in zip(written["rows"], res["fichas"])
+            ],
+        }
+    else:
+        body = {
+            "sheet": written["sheet"],
+            "row": written["row"],  # base-0
+            "mode": written["mode"],  # append | update (re-envío de una ficha existente)
+            "changed": written["changed"],
+            "detected_fields": res["fields"],
+            "tematicas": res["tematicas"],  # top 3 candidatas con score (0..1)
+            "auto_fields": res["auto_fields"],
+        }
+    response_cache.store_json(key, "preview", body, idempotency_key)
+    return JSONResponse(body, headers={
+        "X-Cache": "MISS",
+        **memprofile.response_headers(want_mem, prof),
+        **profiling.response_headers(want_cpu, cpu),
     })
 
 # =========================
 # 2) PROCESS (descarga .xlsx temporal)
 # =========================
 @router.post("/process")
-async def process(
+def process(
+    request: Request,
     docx: UploadFile = File(...),
     excel: UploadFile = File(...),
-    filename: str | None = None
+    filename: str | None = None,
+    multi: bool = Query(False, description="DOCX con varias fichas: una fila por cada 'Nombre de la ayuda'"),
+    idempotency_key: str | None = Header(None, alias="Idempotency-Key"),
+    x_memory_profile: str | None = Header(None, alias="X-Memory-Profile"),
+    x_profile: str | None = Header(None, alias="X-Profile"),
+    x_admin_token: str | None = Header(None, alias="X-Admin-Token"),
 ):
-    if not _ext_ok(docx.filename, ALLOWED_DOCX):
-        raise HTTPException(400, detail="DOCX inválido")
-    if not _ext_ok(excel.filename, ALLOWED_XLSX):
-        raise HTTPException(400, detail="Excel inválido")
-
-    docx_bytes = _read_bytes(docx)
-    excel_bytes = _read_bytes(excel)
-    _check_size("DOCX", docx_bytes, settings.MAX_DOCX_MB)
-    _check_size("Excel", excel_bytes, settings.MAX_EXCEL_MB)
+    want_mem = _memprofile_wanted(x_memory_profile, x_admin_token)
+    want_cpu = _profile_wanted(x_profile, x_admin_token)
+    with memprofile.request("process", want_mem) as prof, profiling.request("process", want_cpu) as cpu:
+        with memprofile.stage("read"):
+            docx_bytes, excel_bytes, cost_mb = _read_sync_uploads(docx, excel)
+        fname = filename or "temporal.xlsx"
+        key = response_cache.request_key("process", {"filename": fname, "multi": multi}, docx_bytes, excel_bytes)
+        cached = _cache_lookup(key, "process", idempotency_key)
+        if cached:
+            return cached
+
+        with _admit(request, cost_mb):
+            if multi:
+                written = run_multi_pipeline(docx_bytes, excel_bytes)["written"]
+                # X-Excel-Row/Mode: la primera ficha; X-Excel-Rows: todas
+                written.update(row=written["rows"][0]["row"], mode="multi")
+            else:
+                written = run_sync_pipeline(docx_bytes, excel_bytes)["written"]
+
+    response = _xlsx_response(written, fname, cache=(key, "process", idempotency_key))
+    response.headers.update(memprofile.response_headers(want_mem, prof))
+    response.headers.update(profiling.response_headers(want_cpu, cpu))
+    return response
 
-    enums = from_excel_bytes(excel_bytes)
-    fields = extract_fields_from_docx(docx_bytes)
-    auto_fields = transform_from_docx(fields, enums)
-    written = write_auto_fields(excel_bytes, auto_fields)
-
-    fname = filename or "temporal.xlsx"
-    return StreamingResponse(
-        BytesIO(written["updated_excel_bytes"]),
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+# =========================
+# 2b) JOBS (process asíncrono: POST -> job_id, polling y descarga)
+# =========================
+@router.post("/jobs", status_code=202)
+async def create_job(
+    docx: UploadFile = File(...),
+    excel: UploadFile = File(...),
+    filename: str | None = None
+):
+    docx_bytes, excel_bytes, cost_mb = _read_sync_uploads(docx, excel)
+    try:
+        job_id = jobs.submit_job(docx_bytes, excel_bytes, filename, heavy=admission.is_heavy(cost_mb))
+    except jobs.JobQueueFull as e:
+        raise HTTPException(429, detail=str(e))
+    return {
+        "job_id": job_id,
+        "status_url": f"{router.prefix}/jobs/{job_id}",
+        "result_url": f"{router.prefix}/jobs/{job_id}/result",
+    }
+
+@router.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = jobs.get_job(job_id)
+    if not job:
+        raise HTTPException(404, detail="Job no encontrado o caducado")
+    return job
+
+@router.get("/jobs/{job_id}/result")
+async def job_result(job_id: str):
+    job = jobs.get_job(job_id)
+    if not job:
+        raise HTTPException(404, detail="Job no encontrado o caducado")
+    path = jobs.get_result_path(job_id)
+    if not path:
+        raise HTTPException(409, detail=f"Job en estado '{job['status']}'")
+    return FileResponse(
+        path,
+        media_type=XLSX_MEDIA_TYPE,
+        filename=job["filename"],
         headers={
-            "Content-Disposition": f'attachment; filename="{fname}"',
-            "X-Excel-Sheet": written["sheet"],
-            "X-Excel-Row": str(written["row"]),  # base-0
+            "X-Excel-Sheet": job["sheet"],
+            "X-Excel-Row": str(job["row"]),  # base-0
         },
     )
 
@@ -111,38 +305,113 @@ class FinalizePayload(BaseModel):
     updates: Dict[str, Any] = {}
 
 @router.put("/finalize")
-async def finalize(
+def finalize(
+    request: Request,
     excel: UploadFile = File(...),
     payload: UploadFile = File(..., description='JSON con {"sheet","row_index","filename","updates"}'),
+    idempotency_key: str | None = Header(None, alias="Idempotency-Key"),
+    x_memory_profile: str | None = Header(None, alias="X-Memory-Profile"),
+    x_profile: str | None = Header(None, alias="X-Profile"),
+    x_admin_token: str | None = Header(None, alias="X-Admin-Token"),
 ):
     if not _ext_ok(excel.filename, ALLOWED_XLSX):
         raise HTTPException(400, detail="Excel inválido")
 
-    excel_bytes = _read_bytes(excel)
-    _check_size("Excel", excel_bytes, settings.MAX_MULTIPART_MB)
+    want_mem = _memprofile_wanted(x_memory_profile, x_admin_token)
+    want_cpu = _profile_wanted(x_profile, x_admin_token)
+    with memprofile.request("finalize", want_mem) as prof, profiling.request("finalize", want_cpu) as cpu:
+        with memprofile.stage("read"):
+            excel_bytes = _read_bytes(excel)
+            _check_size("Excel", excel_bytes, settings.MAX_MULTIPART_MB)
+            cost_mb = _inspect(excel_bytes, "xlsx", "Excel")
+            payload_bytes = payload.file.read()
+        try:
+            data = FinalizePayload(**json.loads(payload_bytes.decode("utf-8")))
+        except Exception as e:
+            raise HTTPException(400, detail=f"Payload inválido: {e}")
+
+        key = response_cache.request_key("finalize", {}, excel_bytes, payload_bytes)
+        cached = _cache_lookup(key, "finalize", idempotency_key)
+        if cached:
+            return cached
+
+        with _admit(request, cost_mb), log_stage("write"), memprofile.stage("write"):
+            result = update_row_in_excel(
+                excel_bytes=excel_bytes,
+                sheet=data.sheet,
+                row_index_base0=data.row_index,
+                updates=data.updates,
+            )
+
+    fname = data.filename or "salida.xlsx"
+    response = _xlsx_response(result, fname, cache=(key, "finalize", idempotency_key))
+    response.headers.update(memprofile.response_headers(want_mem, prof))
+    response.headers.update(profiling.response_headers(want_cpu, cpu))
+    return response
+
+
+# =========================
+# 4) SESIONES (varios pasos sobre el mismo Excel; el xlsx se genera al descargar)
+# =========================
+class SessionUpdates(BaseModel):
+    row_index: int  # base-0
+    updates: Dict[str, Any] = {}
 
+def _session_call(fn, *args):
     try:
-        data = FinalizePayload(**json.loads(payload.file.read().decode("utf-8")))
-    except Exception as e:
-        raise HTTPException(400, detail=f"Payload inválido: {e}")
-
-    result = update_row_in_excel(
-        excel_bytes=excel_bytes,
-        sheet=data.sheet,
-        row_index_base0=data.row_index,
-        updates=data.updates,
-    )
+        return fn(*args)
+    except sessions.SessionNotFound:
+        raise HTTPException(404, detail="Sesión no encontrada o caducada")
 
-    fname = data.filename or "salida.xlsx"
-    return StreamingResponse(
-        BytesIO(result["updated_excel_bytes"]),
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={
-            "Content-Disposition": f'attachment; filename="{fname}"',
-            "X-Excel-Sheet": result["sheet"],
-            "X-Excel-Row": str(result["row"]),  # base-0
-        },
-    )
+def _read_session_docx(docx: UploadFile) -> tuple[bytes, float]:
+    if not _ext_ok(docx.filename, ALLOWED_DOCX):
+        raise HTTPException(400, detail="DOCX inválido")
+    docx_bytes = _read_bytes(docx)
+    _check_size("DOCX", docx_bytes, settings.MAX_DOCX_MB)
+    return docx_bytes, _inspect(docx_bytes, "docx", "DOCX")
+
+@router.post("/sessions", status_code=201)
+async def create_session(excel: UploadFile = File(...)):
+    if not _ext_ok(excel.filename, ALLOWED_XLSX):
+        raise HTTPException(400, detail="Excel inválido")
+    excel_bytes = _read_bytes(excel)
+    _check_size("Excel", excel_bytes, settings.MAX_EXCEL_MB)
+    _inspect(excel_bytes, "xlsx", "Excel")
+    meta = sessions.create_session(excel_bytes)
+    return {**meta, "download_url": f"{router.prefix}/sessions/{meta['session_id']}/download"}
+
+@router.get("/sessions/{session_id}")
+async def session_status(session_id: str):
+    return _session_call(sessions.get_session, session_id)
+
+@router.post("/sessions/{session_id}/preview")
+def session_preview(request: Request, session_id: str, docx: UploadFile = File(...)):
+    docx_bytes, cost_mb = _read_session_docx(docx)
+    with _admit(request, cost_mb):
+        return _session_call(sessions.run_docx, session_id, docx_bytes, False)
+
+@router.post("/sessions/{session_id}/process")
+def session_process(request: Request, session_id: str, docx: UploadFile = File(...)):
+    docx_bytes, cost_mb = _read_session_docx(docx)
+    with _admit(request, cost_mb):
+        return _session_call(sessions.run_docx, session_id, docx_bytes, True)
+
+@router.put("/sessions/{session_id}/finalize")
+def session_finalize(session_id: str, data: SessionUpdates):
+    return _session_call(sessions.update_row, session_id, data.row_index, data.updates)
+
+@router.get("/sessions/{session_id}/download")
+def session_download(session_id: str, filename: str | None = None):
+    meta = _session_call(sessions.get_session, session_id)
+    out, size = _session_call(sessions.materialize, session_id)
+    written = {"sheet": meta["sheet"], "row": meta["last_row"], "mode": "session",
+               "updated_excel": out, "size": size}
+    return _xlsx_response(written, filename or "salida.xlsx")
+
+@router.delete("/sessions/{session_id}", status_code=204)
+async def delete_session(session_id: str):
+    _session_call(sessions.delete_session, session_id)
+    return Response(status_code=204)
 
 
 @router.get("/enums")
@@ -150,19 +419,23 @@ async def enums_maestro(
     section: str | None = Query(None, description="apartado opcional: usuarios|portales|tematicas|ambito|otros"),
     raw: bool = Query(False, description="si true, devuelve el diccionario crudo sin agrupar")
 ):
-    with open(settings.MASTER_EXCEL_PATH, "rb") as f:
-        excel_bytes = f.read()
-
-    enums_raw = load_enums_from_bytes(
-        excel_bytes,
-        data_sheet=getattr(settings, "MASTER_DATA_SHEET", "Fichas 2025"),
-        header_row=getattr(settings, "MASTER_HEADER_ROW", 2),
-    )
+    watched = enums_watch.current()  # ya cargados por el vigilante: sin leer el fichero
+    if watched:
+        enums_raw, grouped = watched["raw"], watched["grouped"]
+    else:
+        with open(settings.MASTER_EXCEL_PATH, "rb") as f:
+            excel_bytes = f.read()
+
+        enums_raw = load_enums_from_bytes(
+            excel_bytes,
+            header_row=getattr(settings, "MASTER_HEADER_ROW", 2),
+        )
+        grouped = None
 
     if raw:
         return enums_raw
 
-    grouped = group_enums(enums_raw)
+    grouped = grouped or group_enums(enums_raw)
 
     if section:
         sec = section.lower()
@@ -174,3 +447,136 @@ async def enums_maestro(
     return grouped
 
 
+def _sse(event: Dict[str, Any]) -> str:
+    return f"id: {event['version']}\nevent: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+@router.get("/enums/stream")
+async def enums_stream(
+    last_event_id: str | None = Header(None, alias="Last-Event-ID"),
+):
+    """
+    Server-Sent Events con los cambios de enums del maestro.
+    Al conectar: snapshot (o los diffs pendientes si se reconecta con Last-Event-ID);
+    después un evento `diff` por cada nueva versión y un comentario de latido.
+    """
+    if not settings.ENUMS_WATCH_ENABLED:
+        raise HTTPException(404, detail="Vigilante de enums desactivado (ENUMS_WATCH_ENABLED)")
+    sub = enums_watch.subscribe(asyncio.get_running_loop())
+
+    async def events():
+        try:
+            pending = None
+            if last_event_id:
+                pending = enums_watch.events_since(last_event_id.strip())
+            for ev in pending if pending is not None else [enums_watch.snapshot()]:
+                yield _sse(ev)
+            # al desconectar el cliente StreamingResponse cancela el generador (-> finally)
+            while True:
+                try:
+                    ev = await asyncio.wait_for(sub.queue.get(), settings.ENUMS_SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if sub.overflowed:
+                    # se perdieron diffs: se vacía la cola y se manda el estado completo
+                    sub.overflowed = False
+                    while not sub.queue.empty():
+                        sub.queue.get_nowait()
+                    ev = enums_watch.snapshot()
+                yield _sse(ev)
+        finally:
+            enums_watch.unsubscribe(sub)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/vencimientos")
+def vencimientos_maestro(
+    desde: date | None = Query(None, alias="from", description="fecha inicial (por defecto hoy)"),
+    hasta: date | None = Query(None, alias="to", description="fecha final (incluida)"),
+    days: int | None = Query(None, ge=0, description="alternativa a `to`: hoy/from + N días"),
+):
+    """Fichas del maestro cuyo VENCIMIENTO cae en [from, to]."""
+    desde = desde or date.today()
+    if hasta is None and days is not None:
+        hasta = desde + timedelta(days=days)
+    if hasta and hasta < desde:
+        raise HTTPException(400, detail="`to` anterior a `from`")
+
+    with open(settings.MASTER_EXCEL_PATH, "rb") as f:
+        excel_bytes = f.read()
+    items = vencimientos.query(excel_bytes, resolve_data_sheet(excel_bytes), desde, hasta)
+    return {
+        "from": desde.isoformat(),
+        "to": hasta.isoformat() if hasta else None,
+        "total": len(items),
+        "items": items,
+    }
+
+
+@router.get("/export")
+def export_maestro(
+    format: str = Query("csv", description="csv | jsonl"),
+):
+    """Hoja de datos del maestro en CSV/JSONL, en streaming (fila a fila, memoria constante)."""
+    if format not in exporter.FORMATS:
+        raise HTTPException(400, detail=f"Formato no soportado: {format}")
+    fname = f"{resolve_data_sheet(settings.MASTER_EXCEL_PATH)}.{format}"
+    return StreamingResponse(
+        exporter.iter_export(settings.MASTER_EXCEL_PATH, format),
+        media_type=exporter.FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{fname}"'},
+    )
+
+
+@router.post("/compact")
+def compact_excel(
+    request: Request,
+    excel: UploadFile = File(...),
+    spare_rows: int | None = Query(None, ge=0, description="filas vacías con formato a conservar bajo los datos"),
+    filename: str | None = None,
+):
+    """
+    Devuelve el Excel sin peso muerto (filas vacías sobrantes, estilos y sharedStrings
+    sin usar, validaciones/tablas estiradas, nombres rotos, calcChain) y el ahorro en cabeceras.
+    """
+    if not _ext_ok(excel.filename, ALLOWED_XLSX):
+        raise HTTPException(400, detail="Excel inválido")
+    excel_bytes = _read_bytes(excel)
+    _check_size("Excel", excel_bytes, settings.MAX_EXCEL_MB)
+    cost_mb = _inspect(excel_bytes, "xlsx", "Excel")
+    with _admit(request, cost_mb):
+        try:
+            # sin compact_with_report: medir el parseo antes/después duplica el coste; eso queda para la CLI
+            compacted, report = compactor.compact(excel_bytes, spare_rows)
+        except compactor.CompactionError as e:
+            raise HTTPException(422, detail=str(e))
+    fname = filename or excel.filename or "compactado.xlsx"
+    return Response(
+        compacted,
+        media_type=XLSX_MEDIA_TYPE,
+        headers={
+            "Content-Disposition": f'attachment; filename="{fname}"',
+            "X-Compact-Size-Before": str(report["size_before"]),
+            "X-Compact-Size-After": str(report["size_after"]),
+            "X-Compact-Removed": json.dumps(report["removed"]),
+        },
+    )
+
+
+@router.get("/audit")
+def audit_maestro():
+    """
+    Celdas del maestro fuera de los enums (TEMÁTICAS, CCAA, usuarios...), con sugerencias.
+    JSONL en streaming: una incidencia por línea y un resumen final.
+    """
+    with open(settings.MASTER_EXCEL_PATH, "rb") as f:
+        excel_bytes = f.read()
+    return StreamingResponse(
+        audit.iter_audit_jsonl(settings.MASTER_EXCEL_PATH, excel_bytes),
+        media_type="application/x-ndjson",
+    )
@@ -0,0 +1,53 @@
+"""
+Lanzador de producción: `python -m app.serve`
+
+- ENV=prod (o --workers > 1): varios workers dimensionados por CPU (Settings.worker_count).
+  Usa gunicorn con UvicornWorker si está instalado; si no, `uvicorn --workers`.
+- En otro caso: un único proceso uvicorn (desarrollo).
+
+Los workers comparten enums e índices de filas mediante la caché en disco
+(SHARED_CACHE_DIR), de modo que el maestro solo se parsea en frío una vez.
+"""
+import argparse
+import importlib.util
+import logging
+import os
+import sys
+
+from app.config import settings
+from app.utils import disk_cache
+
+logger = logging.getLogger("fichasync.serve")
+
+APP = "app.main:app"
+
+
+def main(argv: list[str] | None = None):
+    ap = argparse.ArgumentParser(description="Arranca FichaSync Service")
+    ap.add_argument("--host", default=settings.HOST)
+    ap.add_argument("--port", type=int, default=settings.PORT)
+    ap.add_argument("--workers", type=int, default=None, help="por defecto: Settings.worker_count en prod, 1 en dev")
+    args = ap.parse_args(argv)
+
+    workers = args.workers or (settings.worker_count if settings.ENV == "prod" else 1)
+    if settings.SHARED_CACHE_ENABLED:
+        disk_cache.ensure_private_dir(settings.SHARED_CACHE_DIR)
+    logger.warning("Arrancando %s con %d worker(s) en %s:%d", APP, workers, args.host, args.port)
+
+    if workers > 1 and importlib.util.find_spec("gunicorn") and os.name != "nt":
+        cmd = [
+            "gunicorn", APP,
+            "--worker-class", "uvicorn.workers.UvicornWorker",
+            "--workers", str(workers),
+            "--bind", f"{args.host}:{args.port}",
+            "--timeout", str(settings.WORKER_TIMEOUT),
+            "--graceful-timeout", "30",
+        ]
+        os.execvp(sys.executable, [sys.executable, "-m", *cmd])
+
+    import uvicorn
+    uvicorn.run(APP, host=args.host, port=args.port, workers=workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+# app/services/admission.py
+"""
+Control de admisión de subidas (.xlsx/.docx son zips).
+
+Antes de parsear se lee solo el directorio central del zip y se estima el trabajo
+por el tamaño descomprimido de las partes que se parsean de verdad:
+xl/worksheets/*.xml, xl/sharedStrings.xml y word/document.xml.
+zipfile no entrega más bytes de los declarados en el directorio central, así que
+un tamaño declarado falso no permite descomprimir más de lo estimado.
+
+- Por encima de los límites (tamaño, ratio de compresión, nº de entradas) se rechaza.
+- Las peticiones pesadas (coste >= ADMISSION_HEAVY_COST_MB) pasan por un carril de
+  baja concurrencia (ADMISSION_HEAVY_CONCURRENCY), el resto por el normal.
+- Cada cliente tiene como mucho ADMISSION_PER_CLIENT peticiones en curso. El cliente
+  es la IP del par o, si el par es un proxy de ADMISSION_TRUSTED_PROXIES, la que
+  indica X-Forwarded-For/Forwarded (la primera por la derecha que no sea un proxy).
+Los límites son por proceso (cada worker lleva su cuenta).
+"""
+import ipaddress
+import logging
+import re
+import threading
+import zipfile
+from contextlib import contextmanager
+from io import BytesIO
+from typing import Dict, Iterator, List, Mapping
+
+from app.config import settings
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# partes que cuestan CPU/memoria al parsear, por tipo de fichero
+_COSTLY_PARTS = {
+    "xlsx": lambda n: (n.startswith("xl/worksheets/") and n.endswith(".xml")) or n == "xl/sharedStrings.xml",
+    "docx": lambda n: n == "word/document.xml",
+}
+
+
+class InvalidUpload(Exception):
+    """El fichero no es un zip OOXML legible."""
+
+
+class UploadTooExpensive(Exception):
+    """El fichero supera los límites de tamaño descomprimido o de ratio (posible zip bomb)."""
+
+
+class AdmissionBusy(Exception):
+    """No hay hueco para la petición (carril pesado lleno o demasiadas peticiones del cliente)."""
+
+
+class UploadCost:
+    def __init__(self, kind: str, compressed: int):
+        self.kind = kind
+        self.compressed = compressed
+        self.uncompressed = 0                 # todas las entradas
+        self.costly = 0                       # solo las partes que se parsean
+        self.parts: Dict[str, int] = {}
+
+    @property
+    def cost_mb(self) -> float:
+        return self.costly / MB
+
+
+def inspect_zip(blob: bytes, kind: str, label: str | None = None) -> UploadCost:
+    """Lee el directorio central de `blob` (kind "xlsx" | "docx") y aplica los límites."""
+    label = label or kind.upper()
+    try:
+        infos = zipfile.ZipFile(BytesIO(blob)).infolist()
+    except (zipfile.BadZipFile, ValueError):
+        raise InvalidUpload(f"{label} no es un fichero {kind} válido")
+    if len(infos) > settings.UPLOAD_MAX_ZIP_ENTRIES:
+        raise UploadTooExpensive(f"{label} tiene {len(infos)} entradas (máx {settings.UPLOAD_MAX_ZIP_ENTRIES})")
+
+    costly = _COSTLY_PARTS[kind]
+    cost = UploadCost(kind=kind, compressed=len(blob))
+    for info in infos:
+        cost.uncompressed += info.file_size
+        if not costly(info.filename):
+            continue
+        cost.costly += info.file_size
+        cost.parts[info.filename] = info.file_size
+        ratio = info.file_size / max(1, info.compress_size)
+        if info.file_size > MB and ratio > settings.UPLOAD_MAX_COMPRESSION_RATIO:
+            raise UploadTooExpensive(
+                f"{label}: {info.filename} se expande x{ratio:.0f} (máx x{settings.UPLOAD_MAX_COMPRESSION_RATIO})"
+            )
+
+    if cost.uncompressed > settings.UPLOAD_MAX_UNCOMPRESSED_MB * MB:
+        raise UploadTooExpensive(
+            f"{label} ocupa {cost.uncompressed / MB:.0f} MB descomprimido (máx {settings.UPLOAD_MAX_UNCOMPRESSED_MB} MB)"
+        )
+    if cost.costly > settings.UPLOAD_MAX_COST_MB * MB:
+        raise UploadTooExpensive(
+            f"{label} tiene {cost.cost_mb:.0f} MB de XML a procesar (máx {settings.UPLOAD_MAX_COST_MB} MB)"
+        )
+    return cost
+
+
+_FORWARDED_FOR_RE = re.compile(r'for="?\[?([^\]";,]+)', re.IGNORECASE)
+
+
+def _ip(value: str):
+    value = value.strip()
+    if value.count(":") == 1:  # "1.2.3.4:5678"
+        value = value.split(":", 1)[0]
+    try:
+        return ipaddress.ip_address(value)
+    except ValueError:
+        return None
+
+
+def _trusted(addr) -> bool:
+    for net in settings.ADMISSION_TRUSTED_PROXIES:
+        try:
+            if addr in ipaddress.ip_network(net, strict=False):
+                return True
+        except ValueError:
+            logger.warning("ADMISSION_TRUSTED_PROXIES: entrada no válida %r", net)
+    return False
+
+
+def client_key(peer: str | None, headers: Mapping[str, str]) -> str:
+    """
+    Clave del cliente para el límite por cliente. Detrás de un proxy de confianza se recorre
+    la cadena de Forwarded/X-Forwarded-For de derecha a izquierda saltando los proxies de
+    confianza; sin proxy de confianza delante, las cabeceras se ignoran (las pone el cliente).
+    """
+    addr = _ip(peer or "")
+    if addr is None or not _trusted(addr):
+        return peer or "-"
+    hops: List[str] = []
+    if headers.get("forwarded"):
+        hops = _FORWARDED_FOR_RE.findall(headers["forwarded"])
+    elif headers.get("x-forwarded-for"):
+        hops = headers["x-forwarded-for"].split(",")
+    for hop in reversed(hops):
+        hop_addr = _ip(hop)
+        if hop_addr is None:
+            break  # "unknown" u ofuscado: no se puede seguir la cadena
+        if not _trusted(hop_addr):
+            return str(hop_addr)
+    return peer
+
+
+def is_heavy(cost_mb: float) -> bool:
+    return cost_mb >= settings.ADMISSION_HEAVY_COST_MB
+
+
+# ---- carriles y límite por cliente ----
+_heavy_lane: threading.BoundedSemaphore | None = None
+_lane_lock = threading.Lock()
+_per_client: Dict[str, int] = {}
+
+
+def _get_heavy_lane() -> threading.BoundedSemaphore:
+    global _heavy_lane
+    with _lane_lock:
+        if _heavy_lane is None:
+            _heavy_lane = threading.BoundedSemaphore(max(1, settings.ADMISSION_HEAVY_CONCURRENCY))
+        return _heavy_lane
+
+
+@contextmanager
+def admit(client: str, cost_mb: float, wait: bool = True) -> Iterator[str]:
+    """
+    Reserva hueco para una petición de `client` con coste `cost_mb`.
+    Devuelve el carril ("light" | "heavy"); lanza AdmissionBusy si no hay hueco.
+    Con wait=False no se espera al carril pesado (endpoints async: no bloquear el bucle).
+    """
+    with _lane_lock:
+        active = _per_client.get(client, 0)
+        if active >= settings.ADMISSION_PER_CLIENT:
+            metrics.incr("admission.rejected.per_client")
+            raise AdmissionBusy(
+                f"Demasiadas peticiones en curso para este cliente ({active}, máx {settings.ADMISSION_PER_CLIENT})"
+            )
+        _per_client[client] = active + 1
+
+    lane = "heavy" if is_heavy(cost_mb) else "light"
+    try:
+        if lane == "heavy":
+            if not _get_heavy_lane().acquire(timeout=settings.ADMISSION_WAIT_SECONDS if wait else 0):
+                metrics.incr("admission.rejected.heavy_lane")
+                raise AdmissionBusy("El carril de ficheros pesados está ocupado; reintenta más tarde")
+            logger.info("Petición pesada (%.1f MB de XML) en el carril de baja concurrencia", cost_mb)
+        metrics.incr(f"admission.{lane}")
+        try:
+            yield lane
+        finally:
+            if lane == "heavy":
+                _get_heavy_lane().release()
+    finally:
+        with _lane_lock:
+            left = _per_client.get(client, 1) - 1
+            if left > 0:
+                _per_client[client] = left
+            else:
+                _per_client.pop(client, None)
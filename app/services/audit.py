@@ -0,0 +1,149 @@
+# app/services/audit.py
+"""
+Auditoría de conformidad de la hoja de datos contra los enums del maestro.
+
+Los enums se cargan una vez (load_enums_from_bytes, cacheado por hash) y se pasan
+a frozensets, de modo que comprobar una celda es una búsqueda O(1). Las filas se
+leen en streaming (read_only, ver exporter.iter_rows) y solo las celdas que no
+encajan pasan por el índice difuso, que memoriza las sugerencias de cada valor
+(las erratas se repiten mucho en hojas grandes).
+"""
+import json
+import logging
+import time
+from collections import Counter
+from typing import Any, BinaryIO, Dict, Iterator, List, Tuple
+
+from app.config import settings
+from app.services import exporter
+from app.services.enums_loader import load_enums_from_bytes
+from app.services.excel_writer import PORTAL_COLS, TEMATICA_COLS, norm_header
+from app.services.transformer import _norm, _ratio
+from app.services.workbook_loader import resolve_data_sheet
+
+logger = logging.getLogger(__name__)
+
+# cabecera de la hoja de datos -> clave de enums (load_enums_from_bytes)
+COLUMN_ENUMS: Dict[str, str] = {
+    "AMBITO UE/ESTADO": "ESTADO_UE",
+    "AMBITO CC AA": "CCAA",
+    "AMBITO PROVINCIAL": "PROVINCIAS",
+    **{col: "TEMATICAS" for col in TEMATICA_COLS},
+    "TRABAJADORA QUE HACE LA FICHA": "USUARIOS_HACE_FICHA",
+    "TRABAJADOR QUE SUBE LA FICHA": "USUARIOS_SUBE_FICHA",
+}
+MAX_SUGGESTIONS = 3
+MIN_SCORE = 0.3
+
+
+class FuzzyIndex:
+    """Sugerencias por similitud (misma métrica que transformer.fuzzy_match) con preselección por bigramas."""
+
+    def __init__(self, candidates: List[str]):
+        self.exact = frozenset(candidates)
+        self.by_norm = {_norm(c): c for c in candidates}
+        self.by_bigram: Dict[str, set] = {}
+        for c in candidates:
+            for g in self._bigrams(_norm(c)):
+                self.by_bigram.setdefault(g, set()).add(c)
+        self._memo: Dict[str, List[Tuple[str, float]]] = {}
+
+    @staticmethod
+    def _bigrams(s: str) -> set:
+        return {s[i:i + 2] for i in range(len(s) - 1)} if len(s) > 1 else {s}
+
+    def suggest(self, value: str) -> List[Tuple[str, float]]:
+        if value in self._memo:
+            return self._memo[value]
+        n = _norm(value)
+        if n in self.by_norm:  # solo cambian tildes/mayúsculas/puntuación
+            out = [(self.by_norm[n], 1.0)]
+        else:
+            pool = set()
+            for g in self._bigrams(n):
+                pool |= self.by_bigram.get(g, set())
+            scored = sorted(((c, round(_ratio(n, c), 3)) for c in pool), key=lambda x: (-x[1], x[0]))
+            out = [s for s in scored if s[1] >= MIN_SCORE][:MAX_SUGGESTIONS]
+        self._memo[value] = out
+        return out
+
+
+def _column_rules(names: List[str], enums: Dict[str, List[str]]) -> Dict[str, Tuple[str, FuzzyIndex]]:
+    """Cabecera real de la hoja -> (nombre del enum, índice)."""
+    wanted = {norm_header(h): key for h, key in COLUMN_ENUMS.items()}
+    indexes: Dict[str, FuzzyIndex] = {}
+    rules = {}
+    for name in names:
+        h = norm_header(name)
+        if h in wanted and enums.get(wanted[h]):
+            key = wanted[h]
+        elif name in enums and isinstance(enums[name], list) and enums[name]:
+            key = name  # validación de datos de esa misma columna
+        elif h in {norm_header(p) for p in PORTAL_COLS}:
+            key = f"PORTAL {name}"  # la celda solo admite el propio nombre del portal
+            indexes[key] = FuzzyIndex([name])
+        else:
+            continue
+        if key not in indexes:
+            indexes[key] = FuzzyIndex(enums[key])
+        rules[name] = (key, indexes[key])
+    return rules
+
+
+def iter_audit(
+    source: str | BinaryIO,
+    excel_bytes: bytes,
+    sheet: str | None = None,
+    header_row: int | None = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Genera una incidencia por celda fuera de enum y, al final, {"summary": {...}}.
+    `excel_bytes` se usa solo para cargar los enums (cacheados); las filas se leen de `source`.
+    """
+    sheet = sheet or resolve_data_sheet(source)
+    header_row = header_row or settings.MASTER_HEADER_ROW
+    t0 = time.perf_counter()
+    # el libro de los enums puede ser de otro año: su propia hoja de datos si no tiene `sheet`
+    enums = load_enums_from_bytes(excel_bytes, data_sheet=resolve_data_sheet(excel_bytes, sheet), header_row=header_row)
+
+    rules = None
+    rows = cells = 0
+    by_column: Counter = Counter()
+    for r, names, record in exporter.iter_rows(source, sheet, header_row):
+        if rules is None:
+            rules = _column_rules(names, enums)
+        rows += 1
+        for col, (key, index) in rules.items():
+            value = record.get(col)
+            if value is None:
+                continue
+            text = str(value).strip()
+            if not text:
+                continue
+            cells += 1
+            if text in index.exact:
+                continue
+            by_column[col] += 1
+            yield {
+                "row": r - 1,  # base-0
+                "column": col,
+                "value": value,
+                "enum": key,
+                "suggestions": [{"value": v, "score": s} for v, s in index.suggest(text)],
+            }
+
+    yield {"summary": {
+        "sheet": sheet,
+        "rows": rows,
+        "cells_checked": cells,
+        "issues": sum(by_column.values()),
+        "issues_by_column": dict(by_column),
+        "columns": {c: k for c, (k, _) in (rules or {}).items()},
+        "duration_ms": round((time.perf_counter() - t0) * 1000, 1),
+    }}
+
+
+def iter_audit_jsonl(source: str | BinaryIO, excel_bytes: bytes, **kwargs) -> Iterator[bytes]:
+    """La auditoría como JSONL en bloques (una incidencia por línea; la última es el resumen)."""
+    lines = (json.dumps(item, ensure_ascii=False, default=str) + "\n" for item in iter_audit(source, excel_bytes, **kwargs))
+    return exporter.chunked(lines)
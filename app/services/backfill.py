@@ -0,0 +1,214 @@
+# app/services/backfill.py
+"""
+Carga masiva de fichas históricas (DOCX) en un Excel maestro, sin pasar por la API.
+
+1) extract + transform de cada .docx del directorio en un pool de procesos; cada
+   resultado (o error) se añade en cuanto llega a un checkpoint JSONL.
+2) Todas las filas correctas del checkpoint se escriben en la hoja destino con una
+   sola carga y un solo guardado (apply_many + save_edits: solo se reescribe el XML
+   de esa hoja).
+
+Si se interrumpe, al relanzar con el mismo checkpoint se saltan los ficheros ya
+procesados (misma ruta, tamaño y mtime). La escritura es idempotente: una ficha que
+ya está en el libro (mismo nombre + vencimiento) actualiza su fila en vez de duplicarse.
+"""
+import json
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from app.config import settings
+from app.schema.enums import from_excel_bytes
+
+logger = logging.getLogger(__name__)
+
+OK, ERROR = "ok", "error"
+
+# enums del libro destino, cargados una vez por proceso del pool (initializer)
+_worker_enums: Dict[str, List[str]] | None = None
+
+
+def iter_docx(directory: str, recursive: bool = True) -> Iterator[str]:
+    """Rutas .docx bajo `directory`, ordenadas (se ignoran los ficheros de bloqueo ~$ de Word)."""
+    if recursive:
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            for fn in sorted(files):
+                if fn.lower().endswith(".docx") and not fn.startswith("~$"):
+                    yield os.path.join(root, fn)
+    else:
+        for fn in sorted(os.listdir(directory)):
+            path = os.path.join(directory, fn)
+            if fn.lower().endswith(".docx") and not fn.startswith("~$") and os.path.isfile(path):
+                yield path
+
+
+def _stamp(path: str) -> List[int]:
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def read_checkpoint(path: str) -> Dict[str, Dict[str, Any]]:
+    """Último registro por fichero del checkpoint (una línea truncada al final se ignora)."""
+    done: Dict[str, Dict[str, Any]] = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            done[rec["file"]] = rec
+    return done
+
+
+def _init_worker(enums: Dict[str, List[str]]):
+    global _worker_enums
+    _worker_enums = enums
+    # cada DOCX se lee una vez y el checkpoint ya evita re-parsear: sin caché en disco
+    settings.DOCX_CACHE_DISK = False
+    # ya estamos en un proceso del pool: las fichas de un DOCX múltiple se parsean aquí
+    settings.DOCX_SPLIT_WORKERS = 0
+
+
+def process_file(path: str) -> Dict[str, Any]:
+    """
+    extract + transform de un DOCX (se ejecuta en un proceso del pool).
+    Un DOCX con varias fichas da varias filas (rec["fichas"], una por ficha).
+    """
+    from app.services.docx_reader import extract_fichas_from_docx
+    from app.services.transformer import suggest_tematicas, transform_from_docx
+
+    t0 = time.perf_counter()
+    rec: Dict[str, Any] = {"file": path}
+    try:
+        rec["stamp"] = _stamp(path)
+        with open(path, "rb") as f:
+            all_fields = extract_fichas_from_docx(f.read())
+        fichas = []
+        for fields in all_fields:
+            tematicas = suggest_tematicas(fields, _worker_enums)
+            fichas.append(transform_from_docx(fields, _worker_enums, tematicas))
+        rec.update(status=OK, fichas=fichas)
+        missing = [n for n, af in enumerate(fichas, start=1) if not af.get("NOMBRE DE FICHA")]
+        if missing:
+            rec.update(status=ERROR, error=f"Ficha(s) {missing} sin 'Nombre de la ayuda'")
+    except Exception as e:
+        rec.update(status=ERROR, error=f"{type(e).__name__}: {e}")
+    rec["ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    return rec
+
+
+def extract_all(
+    files: List[str],
+    enums: Dict[str, List[str]],
+    checkpoint_path: str,
+    jobs: int | None = None,
+    retry_failed: bool = False,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Fase 1: procesa en el pool los ficheros que no estén ya en el checkpoint
+    (con retry_failed también los que fallaron) y va añadiendo los resultados.
+    """
+    done = read_checkpoint(checkpoint_path)
+    pending = []
+    for path in files:
+        rec = done.get(path)
+        try:
+            fresh = rec is not None and rec.get("stamp") == _stamp(path)
+        except OSError:
+            fresh = False
+        if fresh and (rec["status"] == OK or not retry_failed):
+            continue
+        pending.append(path)
+
+    stats = {"files": len(files), "skipped": len(files) - len(pending), "ok": 0, "failed": 0}
+    t0 = time.perf_counter()
+    os.makedirs(os.path.dirname(os.path.abspath(checkpoint_path)), exist_ok=True)
+    with open(checkpoint_path, "a", encoding="utf-8") as ckpt:
+        if pending:
+            with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(enums,)) as pool:
+                futures = [pool.submit(process_file, p) for p in pending]
+                for n, fut in enumerate(as_completed(futures), start=1):
+                    rec = fut.result()
+                    ckpt.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                    ckpt.flush()  # cada línea queda en disco aunque se corte el proceso
+                    stats["ok" if rec["status"] == OK else "failed"] += 1
+                    if on_progress:
+                        on_progress(n, len(pending))
+    elapsed = time.perf_counter() - t0
+    stats["extract_seconds"] = round(elapsed, 2)
+    stats["files_per_second"] = round(len(pending) / elapsed, 1) if pending and elapsed else 0.0
+    return stats
+
+
+def write_rows(
+    target_path: str,
+    records: List[Dict[str, Any]],
+    sheet: str | None,
+    output_path: str | None = None,
+) -> Dict[str, Any]:
+    """Fase 2: escribe las fichas en `sheet` con una sola carga y un solo guardado (atómico)."""
+    from app.services.excel_writer import apply_many, save_edits
+    from app.services.workbook_loader import load_sheets, resolve_data_sheet
+
+    t0 = time.perf_counter()
+    with open(target_path, "rb") as f:
+        excel_bytes = f.read()
+    sheet = sheet or resolve_data_sheet(excel_bytes)
+    ws = load_sheets(excel_bytes, [sheet])[sheet]
+    # los checkpoints anteriores guardaban una sola ficha en "auto_fields"
+    results = apply_many(ws, [af for r in records for af in r.get("fichas") or [r["auto_fields"]]])
+    edits: Dict[Any, Any] = {}
+    for res in results:
+        edits.update(res["edits"])
+
+    out_path = output_path or target_path
+    tmp = out_path + ".part"
+    body, _size = save_edits(excel_bytes, sheet, edits)
+    with body, open(tmp, "wb") as f:
+        shutil.copyfileobj(body, f)
+    os.replace(tmp, out_path)
+    return {
+        "appended": sum(1 for r in results if r["mode"] == "append"),
+        "updated": sum(1 for r in results if r["mode"] == "update" and r["changed"]),
+        "unchanged": sum(1 for r in results if r["mode"] == "update" and not r["changed"]),
+        "cells": len(edits),
+        "write_seconds": round(time.perf_counter() - t0, 2),
+        "output": out_path,
+    }
+
+
+def run_backfill(
+    directory: str,
+    target_path: str,
+    checkpoint_path: str,
+    sheet: str | None,
+    output_path: str | None = None,
+    jobs: int | None = None,
+    recursive: bool = True,
+    retry_failed: bool = False,
+    extract_only: bool = False,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+) -> Dict[str, Any]:
+    """Fase 1 + fase 2. Devuelve el resumen (throughput y fallos por fichero)."""
+    t0 = time.perf_counter()
+    with open(target_path, "rb") as f:
+        enums = from_excel_bytes(f.read())
+    files = list(iter_docx(directory, recursive))
+    summary: Dict[str, Any] = extract_all(files, enums, checkpoint_path, jobs, retry_failed, on_progress)
+
+    wanted = set(files)
+    records = [r for r in read_checkpoint(checkpoint_path).values() if r["file"] in wanted]
+    ok = sorted((r for r in records if r["status"] == OK), key=lambda r: r["file"])
+    summary["failures"] = [{"file": r["file"], "error": r.get("error")} for r in records if r["status"] != OK]
+    if not extract_only and ok:
+        summary["write"] = write_rows(target_path, ok, sheet, output_path)
+    summary["rows"] = sum(len(r.get("fichas") or [r["auto_fields"]]) for r in ok)
+    summary["total_seconds"] = round(time.perf_counter() - t0, 2)
+    return summary
@@ -1,13 +1,16 @@
 from __future__ import annotations
+import copy
 from typing import Dict, List, Optional, Tuple
-from io import BytesIO
-from openpyxl import load_workbook
-from openpyxl.utils.cell import range_boundaries, coordinate_from_string
-from openpyxl.worksheet.datavalidation import DataValidation
 
+from app.services.workbook_loader import enum_sheets, load_sheets, resolve_data_sheet
+from app.utils import disk_cache, singleflight
+from app.utils.hashing import content_hash
 
-DEFAULT_DATA_SHEET = "Fichas 2025"   
-DEFAULT_HEADER_ROW = 2                
+# openpyxl se importa dentro de cada función: cargarlo al importar el módulo
+# penaliza el arranque del servicio (ver app/services/warmup.py).
+
+
+DEFAULT_HEADER_ROW = 2
 
 
 TABLES: Dict[str, Tuple[str, str]] = {
@@ -36,6 +39,7 @@ def _dedup(seq: List[str]) -> List[str]:
 # ------------------------
 
 def _extract_from_table(wb, table_name: str, header_label: str) -> List[str]:
+    from openpyxl.utils.cell import range_boundaries
     for ws in wb.worksheets:
         tbl = ws.tables.get(table_name)
         if not tbl:
@@ -74,6 +78,7 @@ def _extract_from_table(wb, table_name: str, header_label: str) -> List[str]:
 
 def _read_range_values(wb, range_ref: str) -> List[str]:
     # Admite: 'Hoja'!$A$2:$A$40   |   $A$2:$A$40 (siempre requiere hoja)
+    from openpyxl.utils.cell import range_boundaries
     if "!" in range_ref:
         sheet_name, rng = range_ref.split("!", 1)
         sheet_name = sheet_name.strip().strip("'")
@@ -93,6 +98,7 @@ def _read_range_values(wb, range_ref: str) -> List[str]:
 
 
 def _header_by_cell(ws, header_row: int, coord: str) -> Optional[str]:
+    from openpyxl.utils.cell import coordinate_from_string
     col_letter, _ = coordinate_from_string(coord)
     # traer índice de columna desde letra
     from openpyxl.utils import column_index_from_string
@@ -102,6 +108,7 @@ def _header_by_cell(ws, header_row: int, coord: str) -> Optional[str]:
 
 
 def _collect_validations(wb, data_sheet: str, header_row: int) -> Dict[str, List[str]]:
+    from openpyxl.utils.cell import range_boundaries
     ws = wb[data_sheet]
     out: Dict[str, List[str]] = {}
     dvs = ws.data_validations
@@ -169,18 +176,48 @@ def _collect_validations(wb, data_sheet: str, header_row: int) -> Dict[str, List
 # 3) API pública
 # ------------------------
 
+_flight = singleflight.Group("enums")
+
+
 def load_enums_from_bytes(
     excel_bytes: bytes,
-    data_sheet: str = DEFAULT_DATA_SHEET,
+    data_sheet: str | None = None,
     header_row: int = DEFAULT_HEADER_ROW,
 ) -> Dict[str, List[str]]:
     """Carga enums de forma dinámica.
     1) Si existen Tablas con los nombres de TABLES, se añaden.
-    2) Se leen también los Data Validations (listas) de la hoja de datos indicada.
+    2) Se leen también los Data Validations (listas) de la hoja de datos indicada
+       (None = la del libro, ver resolve_data_sheet).
     El resultado es un dict con claves de cabecera EXACTAS tal como aparecen en la hoja de datos,
     más las claves de TABLES (si existen), sin duplicados.
+    El resultado se comparte entre workers vía caché en disco (clave: hash del libro), y
+    las peticiones simultáneas con el mismo libro esperan a un único parseo (single-flight).
     """
-    wb = load_workbook(BytesIO(excel_bytes), data_only=True)
+    data_sheet = data_sheet or resolve_data_sheet(excel_bytes)
+    cache_key = content_hash(f"{content_hash(excel_bytes)}|{data_sheet}|{header_row}".encode())
+    cached = disk_cache.get("enums", cache_key)
+    if cached is not None:
+        return cached
+
+    enums, shared = _flight.do(cache_key, lambda: _load_once(excel_bytes, data_sheet, header_row, cache_key))
+    return copy.deepcopy(enums) if shared else enums
+
+
+def _load_once(excel_bytes: bytes, data_sheet: str, header_row: int, cache_key: str) -> Dict[str, List[str]]:
+    # otro worker puede estar parseando el mismo libro: se espera y se reutiliza su resultado
+    with disk_cache.lock("enums", cache_key):
+        cached = disk_cache.get("enums", cache_key)
+        if cached is not None:
+            return cached
+        enums = _load_enums(excel_bytes, data_sheet, header_row)
+        disk_cache.put("enums", cache_key, enums)
+    return enums
+
+
+def _load_enums(excel_bytes: bytes, data_sheet: str, header_row: int) -> Dict[str, List[str]]:
+    # Solo la hoja de datos + las hojas de sus listas/TABLES (None -> todas)
+    sheets = enum_sheets(excel_bytes, data_sheet, [tbl for tbl, _ in TABLES.values()])
+    wb = load_sheets(excel_bytes, sheets, data_only=True)
 
     enums: Dict[str, List[str]] = {}
 
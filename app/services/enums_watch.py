@@ -0,0 +1,253 @@
+# app/services/enums_watch.py
+"""
+Vigila MASTER_EXCEL_PATH y publica los cambios de enums a los clientes (SSE).
+
+- Un hilo vigila el fichero: inotify vía `watchfiles` si está instalado, si no
+  sondeo por stat (mtime/tamaño) cada ENUMS_WATCH_POLL_SECONDS.
+- Al cambiar, reconstruye una sola vez los enums crudos y agrupados y calcula el
+  diff respecto a la versión anterior. La versión (id del evento SSE) es un hash
+  del contenido de los enums: la misma en todos los workers para los mismos enums.
+- Los suscriptores (una cola asyncio por conexión SSE) reciben el diff; quien
+  se queda atrás (cola llena o Last-Event-ID desconocido en este worker) recibe un snapshot.
+Con varios workers cada proceso tiene su vigilante, pero el parseo se comparte
+por la caché en disco de enums (misma huella de contenido).
+"""
+import asyncio
+import importlib.util
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.services.enums_grouping import group_enums
+from app.services.enums_loader import load_enums_from_bytes
+from app.utils import metrics
+from app.utils.hashing import content_hash
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIBER_QUEUE_SIZE = 16
+
+_lock = threading.Lock()
+_state: Dict[str, Any] = {"version": "", "stamp": None, "raw": {}, "grouped": {}, "updated_at": None}
+_history: Deque[Dict[str, Any]] = deque()       # diffs recientes (para Last-Event-ID)
+_subscribers: List["Subscriber"] = []
+_thread: Optional[threading.Thread] = None
+_stop = threading.Event()
+
+
+class Subscriber:
+    """Cola de eventos de una conexión SSE (vive en el bucle de eventos de la petición)."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+    def _offer(self, event: Dict[str, Any]):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # cliente lento: se descartan diffs y se le manda un snapshot al vaciar la cola
+            self.overflowed = True
+
+
+def _stamp(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _diff_raw(old: Dict[str, List[str]], new: Dict[str, List[str]]) -> Dict[str, Dict[str, List[str]]]:
+    """Valores añadidos/quitados por clave (solo las claves que cambian)."""
+    out = {}
+    for key in sorted(set(old) | set(new)):
+        before, after = old.get(key, []), new.get(key, [])
+        if before == after:
+            continue
+        before_set, after_set = set(before), set(after)
+        out[key] = {
+            "added": [v for v in after if v not in before_set],
+            "removed": [v for v in before if v not in after_set],
+        }
+    return out
+
+
+def _version(raw: Dict[str, List[str]]) -> str:
+    """Id de versión derivado del contenido (no un contador por proceso)."""
+    return content_hash(json.dumps(raw, sort_keys=True, ensure_ascii=False).encode())[:16]
+
+
+def _publish(event: Dict[str, Any]):
+    with _lock:
+        subs = list(_subscribers)
+    for sub in subs:
+        try:
+            sub.loop.call_soon_threadsafe(sub._offer, event)
+        except RuntimeError:  # bucle ya cerrado
+            unsubscribe(sub)
+
+
+def check(force: bool = False) -> bool:
+    """Reconstruye los enums si el maestro cambió (o con force). Devuelve True si hubo nueva versión."""
+    path = settings.MASTER_EXCEL_PATH
+    stamp = _stamp(path)
+    if stamp is None or (stamp == _state["stamp"] and not force):
+        return False
+    t0 = time.perf_counter()
+    try:
+        with open(path, "rb") as f:
+            excel_bytes = f.read()
+        # sin data_sheet: tras un cambio de año el maestro ya trae la hoja del año nuevo
+        raw = load_enums_from_bytes(excel_bytes, header_row=settings.MASTER_HEADER_ROW)
+    except Exception as e:
+        # p.ej. el fichero se está guardando a medias: el stamp no se actualiza y se reintenta
+        logger.warning("No se pudieron recargar los enums del maestro: %s", e)
+        return False
+    grouped = group_enums(raw)
+
+    with _lock:
+        _state["stamp"] = stamp
+        version = _version(raw)
+        if version == _state["version"]:
+            return False  # se tocó el fichero pero los enums no cambian
+        prev_version, prev_raw, prev_grouped = _state["version"], _state["raw"], _state["grouped"]
+        _state.update(version=version, raw=raw, grouped=grouped, updated_at=time.time())
+        event = {
+            "type": "diff",
+            "version": version,
+            "previous": prev_version,
+            "raw": _diff_raw(prev_raw, raw),
+            # secciones agrupadas que cambian, completas (el front las sustituye)
+            "grouped": {k: v for k, v in grouped.items() if prev_grouped.get(k) != v},
+        }
+        _history.append(event)
+        while len(_history) > settings.ENUMS_WATCH_HISTORY:
+            _history.popleft()
+
+    metrics.incr("enums_watch.rebuilds")
+    logger.info(
+        "Enums del maestro actualizados a %s en %.1f ms (%d claves cambian)",
+        version, (time.perf_counter() - t0) * 1000, len(event["raw"]),
+    )
+    _publish(event)
+    return True
+
+
+def snapshot() -> Dict[str, Any]:
+    with _lock:
+        return {
+            "type": "snapshot",
+            "version": _state["version"],
+            "raw": _state["raw"],
+            "grouped": _state["grouped"],
+            "updated_at": _state["updated_at"],
+        }
+
+
+def current() -> Optional[Dict[str, Any]]:
+    """Enums vigilados si el vigilante está activo y ya cargó el maestro (si no, None)."""
+    if _thread is None or not _thread.is_alive() or not _state["version"]:
+        return None
+    if _stamp(settings.MASTER_EXCEL_PATH) != _state["stamp"]:
+        return None  # cambio aún no procesado: que el llamante lea el fichero
+    return snapshot()
+
+
+def events_since(version: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    Diffs desde `version` hasta la actual, o None si este worker no la conoce
+    (fuera del histórico o nunca vista aquí): hace falta snapshot.
+    """
+    with _lock:
+        if version == _state["version"]:
+            return []
+        history = list(_history)
+    # la última vez que se partió de `version` (los enums pueden volver a un estado anterior)
+    for i in range(len(history) - 1, -1, -1):
+        if history[i]["previous"] == version:
+            return history[i:]
+    return None
+
+
+def subscribe(loop: asyncio.AbstractEventLoop) -> Subscriber:
+    sub = Subscriber(loop)
+    with _lock:
+        _subscribers.append(sub)
+    return sub
+
+
+def unsubscribe(sub: Subscriber):
+    with _lock:
+        if sub in _subscribers:
+            _subscribers.remove(sub)
+
+
+def _watch_inotify():
+    from watchfiles import watch
+
+    path = os.path.abspath(settings.MASTER_EXCEL_PATH)
+    # se vigila el directorio: al guardar, Excel/LibreOffice sustituyen el fichero
+    for _ in watch(
+        os.path.dirname(path),
+        watch_filter=lambda _change, p: os.path.abspath(p) == path,
+        stop_event=_stop,
+        debounce=int(settings.ENUMS_WATCH_POLL_SECONDS * 1000),
+        recursive=False,
+        # también despierta sin eventos: reintenta si la última lectura falló a medio guardar
+        rust_timeout=int(settings.ENUMS_WATCH_POLL_SECONDS * 1000),
+        yield_on_timeout=True,
+    ):
+        check()
+
+
+def _watch_poll():
+    while not _stop.wait(settings.ENUMS_WATCH_POLL_SECONDS):
+        check()
+
+
+def _run():
+    check()
+    backend = settings.ENUMS_WATCH_BACKEND
+    use_inotify = (
+        backend in ("auto", "inotify")
+        and importlib.util.find_spec("watchfiles") is not None
+        and os.path.isdir(os.path.dirname(os.path.abspath(settings.MASTER_EXCEL_PATH)))
+    )
+    logger.info("Vigilando %s (%s)", settings.MASTER_EXCEL_PATH, "inotify" if use_inotify else "sondeo")
+    try:
+        if use_inotify:
+            _watch_inotify()
+        else:
+            _watch_poll()
+    except Exception:
+        if _stop.is_set():
+            return
+        logger.exception("Vigilante de enums con errores; se pasa a sondeo")
+        _watch_poll()
+
+
+def start() -> Optional[threading.Thread]:
+    global _thread
+    if not settings.ENUMS_WATCH_ENABLED:
+        return None
+    if _thread is not None and _thread.is_alive():
+        return _thread
+    _stop.clear()
+    _thread = threading.Thread(target=_run, name="fichasync-enums-watch", daemon=True)
+    _thread.start()
+    return _thread
+
+
+def stop(timeout: float = 5.0):
+    global _thread
+    _stop.set()
+    if _thread is not None:
+        _thread.join(timeout)
+        _thread = None
@@ -1,14 +1,22 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Tuple
+from collections import OrderedDict
 from io import BytesIO
-from openpyxl import load_workbook
+from tempfile import SpooledTemporaryFile
+import threading
 import unicodedata
 import logging
 import re
 
+from app.config import settings
+from app.services.workbook_loader import load_sheets, patch_cells, resolve_data_sheet
+from app.utils import disk_cache, singleflight
+from app.utils.dates import cell_date, parse_date
+from app.utils.hashing import content_hash
+
 # Configuración de la hoja
 HEADER_ROW = 2       # cabeceras en fila 2
 DATA_START_ROW = 3   # datos empiezan en fila 3
-DEFAULT_SHEET = "Fichas 2025"
+DEFAULT_SHEET = settings.MASTER_DATA_SHEET   # cada libro resuelve la suya: resolve_data_sheet
 
 # Columnas especiales (si existen en el Excel)
 AMBITO_COLS = [
@@ -24,8 +32,23 @@ TEMATICA_COLS = ["TEMÁTICA 1", "TEMÁTICA 2", "TEMÁTICA 3"]
 # Puedes cambiarlas si tu plantilla se apoya en otras celdas clave.
 DEFAULT_REQUIRED_COLS = ["NOMBRE DE FICHA", "VENCIMIENTO"]
 
+# Columnas de fecha: los textos tipo "30/10/2025" se escriben como fecha real
+DATE_COLS = ["VENCIMIENTO", "FECHA DE REDACCIÓN", "Fecha de Subida a la  WEB"]
+
+# Columnas que identifican una ficha ya existente (re-envíos corregidos -> update)
+ROW_KEY_COLS = ["NOMBRE DE FICHA", "VENCIMIENTO"]
+ROW_INDEX_CACHE_SIZE = 16
+
+# El xlsx generado se guarda en memoria hasta este tamaño; por encima pasa a disco
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
 logger = logging.getLogger(__name__)
 
+# (hash_libro, hoja) -> {clave_ficha: fila_base1}
+_row_index_cache: "OrderedDict[Tuple[str, str], Dict[Tuple[str, str], int]]" = OrderedDict()
+_row_index_lock = threading.Lock()
+_row_index_flight = singleflight.Group("row_index")
+
 
 def norm_header(s: str) -> str:
     s = s.strip()
@@ -48,7 +71,8 @@ def _headers_index(ws) -> Dict[str, int]:
         v = ws.cell(row=HEADER_ROW, column=c).value
         if v and str(v).strip():
             idx[_norm(str(v))] = c
-    logger.info("Cabeceras detectadas (%d): %s", len(idx), list(idx.keys())[:10])
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Cabeceras detectadas (%d): %s", len(idx), list(idx.keys())[:10])
     return idx
 
 
@@ -56,9 +80,10 @@ def _first_empty_row(
     ws,
     headers: Dict[str, int],
     required_cols: List[str] | None = None,
+    start: int = DATA_START_ROW,
 ) -> int:
     """
-    Devuelve la primera fila "vacía de verdad" mirando únicamente columnas relevantes.
+    Devuelve la primera fila "vacía de verdad" (desde `start`) mirando únicamente columnas relevantes.
     Una fila se considera vacía si TODAS las columnas relevantes están vacías (None o "").
     """
     if not required_cols:
@@ -70,7 +95,7 @@ def _first_empty_row(
         # Fallback: usa todas las columnas conocidas del header
         required_indices = list(headers.values())
 
-    r = DATA_START_ROW
+    r = start
     while True:
         is_empty = True
         for c in required_indices:
@@ -79,17 +104,114 @@ def _first_empty_row(
                 is_empty = False
                 break
         if is_empty:
-            logger.info("Primera fila vacía detectada: %s", r)
+            logger.debug("Primera fila vacía detectada: %s", r)
             return r
         r += 1
 
 
+def _row_key(name, vencimiento) -> Tuple[str, str] | None:
+    """Clave normalizada de ficha: nombre sin acentos/espacios extra + vencimiento ISO."""
+    if name is None or not str(name).strip():
+        return None
+    d = cell_date(vencimiento)  # la celda puede traer el número de serie sin formato de fecha
+    venc = d.isoformat() if d else _norm(str(vencimiento or ""))
+    return norm_header(str(name)), venc
+
+
+def _build_row_index(ws, headers: Dict[str, int]) -> Dict[Tuple[str, str], int]:
+    """Una sola lectura por columnas (iter_rows sobre el rango mínimo) de las columnas clave."""
+    cols = [headers.get(_norm(h)) for h in ROW_KEY_COLS]
+    if not all(cols):
+        return {}
+    lo, hi = min(cols), max(cols)
+    idx: Dict[Tuple[str, str], int] = {}
+    rows = ws.iter_rows(min_row=DATA_START_ROW, min_col=lo, max_col=hi, values_only=True)
+    for r, values in enumerate(rows, start=DATA_START_ROW):
+        key = _row_key(values[cols[0] - lo], values[cols[1] - lo])
+        if key and key not in idx:
+            idx[key] = r
+    return idx
+
+
+def _load_row_index(ws, headers: Dict[str, int], workbook_hash: str) -> Dict[Tuple[str, str], int]:
+    disk_key = content_hash(f"{workbook_hash}|{ws.title}".encode())
+    idx = disk_cache.get("row_index", disk_key)
+    if idx is None:
+        with disk_cache.lock("row_index", disk_key):
+            idx = disk_cache.get("row_index", disk_key)
+            if idx is None:
+                idx = _build_row_index(ws, headers)
+                disk_cache.put("row_index", disk_key, idx)
+    return idx
+
+
+def _row_index(ws, headers: Dict[str, int], workbook_hash: str | None) -> Dict[Tuple[str, str], int]:
+    """
+    Índice de filas existentes, cacheado por (hash del libro, hoja):
+    primero en memoria del proceso y después en la caché de disco compartida entre workers.
+    Sin `workbook_hash` (hoja con cambios en memoria) se construye sin cachear.
+    """
+    if workbook_hash is None:
+        return _build_row_index(ws, headers)
+    cache_key = (workbook_hash, ws.title)
+    with _row_index_lock:
+        idx = _row_index_cache.get(cache_key)
+        if idx is not None:
+            _row_index_cache.move_to_end(cache_key)
+            return idx
+    # peticiones simultáneas con el mismo libro: un solo recorrido de la hoja (single-flight)
+    idx, _shared = _row_index_flight.do(cache_key, lambda: _load_row_index(ws, headers, workbook_hash))
+    with _row_index_lock:
+        _row_index_cache[cache_key] = idx
+        while len(_row_index_cache) > ROW_INDEX_CACHE_SIZE:
+            _row_index_cache.popitem(last=False)
+    return idx
+
+
+def _same_value(current, new) -> bool:
+    if current == new:
+        return True
+    if current in (None, "") or new in (None, ""):
+        return current in (None, "") and new in (None, "")
+    d_cur, d_new = parse_date(current, strict=True), parse_date(new, strict=True)
+    if d_cur and d_new:
+        return d_cur == d_new
+    return str(current).strip() == str(new).strip()
+
+
+def _diff_fields(ws, row: int, headers: Dict[str, int], fields: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Campos de `fields` que cambian respecto a la fila existente.
+    Los valores vacíos no cuentan: un re-envío no borra lo rellenado a mano.
+    """
+    changes: Dict[str, Any] = {}
+    for k, v in fields.items():
+        if v in (None, ""):
+            continue
+        col = headers.get(_norm(k))
+        if col and not _same_value(ws.cell(row=row, column=col).value, v):
+            changes[k] = v
+    return changes
+
+
+def _cell_value(header: str, value):
+    """
+    Convierte a `date` los textos que son solo una fecha en columnas de fecha; el resto
+    ("Hasta 30/10/2025 (ampliable)", "Del 01/09/2025 al 30/10/2025") se deja como texto.
+    """
+    if isinstance(value, str) and value.strip() and _norm(header) in {_norm(h) for h in DATE_COLS}:
+        return parse_date(value, strict=True) or value
+    return value
+
+
 def _set_if(header: str, value, ws, row: int, headers: Dict[str, int]):
     col = headers.get(_norm(header))
     if col:
+        value = _cell_value(header, value)
         ws.cell(row=row, column=col).value = value
-        logger.debug("Escrito [%s] en fila %d, col %d: %r", header, row, col, value)
-    else:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Escrito [%s] en fila %d, col %d: %r", header, row, col, value)
+    elif logger.isEnabledFor(logging.DEBUG):
         logger.debug("Header no encontrado, NO se escribe: %s", header)
 
 
@@ -109,27 +231,93 @@ def _apply_ambito_exclusive(ws, row: int, headers: Dict[str, int], payload: Dict
         if payload.get(col):
             _clear(headers, ws, row, AMBITO_COLS)
             _set_if(col, payload[col], ws, row, headers)
-            logger.info("Ámbito exclusivo aplicado: %s=%r", col, payload[col])
+            logger.debug("Ámbito exclusivo aplicado: %s=%r", col, payload[col])
             return
 
 
-def write_auto_fields(
-    excel_bytes: bytes,
+def _save_workbook(wb) -> tuple[SpooledTemporaryFile, int]:
+    """
+    Guarda el libro directamente en un SpooledTemporaryFile (sin BytesIO + getvalue()).
+    Devuelve (fichero posicionado al inicio, tamaño en bytes). Quien lo consuma debe cerrarlo.
+    """
+    out = SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES, mode="w+b")
+    wb.save(out)
+    size = out.tell()
+    out.seek(0)
+    return out, size
+
+
+def _row_values(ws, row: int, headers: Dict[str, int]) -> Dict[int, Any]:
+    """Foto de la fila (solo columnas con cabecera, que son las únicas que escribe _set_if)."""
+    return {c: ws.cell(row=row, column=c).value for c in set(headers.values())}
+
+
+def _row_edits(ws, row: int, before: Dict[int, Any]) -> Dict[Tuple[int, int], Any]:
+    """Celdas de la fila que han cambiado respecto a la foto `before`."""
+    edits = {}
+    for c, old in before.items():
+        new = ws.cell(row=row, column=c).value
+        if new != old and not (old in (None, "") and new in (None, "")):
+            edits[(row, c)] = new
+    return edits
+
+
+def save_edits(excel_bytes: bytes, sheet: str, edits: Dict[Tuple[int, int], Any]) -> tuple[SpooledTemporaryFile, int]:
+    """
+    Aplica `edits` sobre el libro original tocando solo el XML de `sheet`
+    (el resto de hojas pasan tal cual). Si el paquete no se puede parchear,
+    recurre a cargar el libro completo con openpyxl y guardarlo.
+    """
+    try:
+        return patch_cells(excel_bytes, sheet, edits)
+    except Exception:
+        logger.warning("Parche XML no aplicable; se guarda con openpyxl", exc_info=True)
+    from openpyxl import load_workbook
+    wb = load_workbook(BytesIO(excel_bytes))
+    ws = wb[sheet]
+    for (r, c), v in edits.items():
+        ws.cell(row=r, column=c).value = v
+    return _save_workbook(wb)
+
+
+def apply_auto_fields(
+    ws,
     auto_fields: Dict[str, Any],
-    sheet: str = DEFAULT_SHEET,
     required_cols: List[str] | None = None,
+    match_existing: bool = True,
+    workbook_hash: str | None = None,
 ) -> Dict[str, Any]:
     """
-    Escribe `auto_fields` en la primera fila libre detectada, sin generar ningún ID.
-    - Respeta el marco/estilos porque no inserta filas ni columnas.
-    - required_cols te permite definir qué columnas marcan que una fila está ocupada.
+    Escribe `auto_fields` sobre la hoja ya cargada `ws` (sin guardar).
+    Devuelve {"row" (base 1), "mode", "changed", "before", "edits"} donde `edits`
+    son las celdas {(fila, col): valor} que cambian y `before` la foto previa de la fila.
+    `workbook_hash` permite cachear el índice de filas (None = sin caché).
     """
-    wb = load_workbook(BytesIO(excel_bytes))
-    ws = wb[sheet]
     headers = _headers_index(ws)
 
-    row = _first_empty_row(ws, headers, required_cols)
+    existing = None
+    if match_existing:
+        key = _row_key(*(auto_fields.get(c) for c in ROW_KEY_COLS))
+        if key:
+            existing = _row_index(ws, headers, workbook_hash).get(key)
+
+    if existing:
+        return _update_existing(ws, existing, headers, auto_fields)
+    return _write_new_row(ws, _first_empty_row(ws, headers, required_cols), headers, auto_fields)
+
+
+def _update_existing(ws, row: int, headers: Dict[str, int], auto_fields: Dict[str, Any]) -> Dict[str, Any]:
+    changes = _diff_fields(ws, row, headers, auto_fields)
+    logger.info("Re-envío detectado en fila %d: %d celdas cambian", row, len(changes))
+    before = _row_values(ws, row, headers)
+    _apply_updates(ws, row, headers, changes)
+    return {"row": row, "mode": "update", "changed": list(changes),
+            "before": before, "edits": _row_edits(ws, row, before)}
+
+
+def _write_new_row(ws, row: int, headers: Dict[str, int], auto_fields: Dict[str, Any]) -> Dict[str, Any]:
     logger.info("Escritura en hoja '%s', fila %d (base 1)", ws.title, row)
+    before = _row_values(ws, row, headers)
 
     # 1) Portales (si existen en auto_fields)
     for col in PORTAL_COLS:
@@ -150,18 +338,140 @@ def write_auto_fields(
             continue
         _set_if(k, v, ws, row, headers)
 
-    out = BytesIO()
-    wb.save(out)
-    out.seek(0)
+    return {"row": row, "mode": "append", "changed": list(auto_fields),
+            "before": before, "edits": _row_edits(ws, row, before)}
 
-    base0 = row - 1
-    logger.info("Guardado. Hoja=%s, fila(base0)=%d", ws.title, base0)
 
-    return {
+def apply_many(
+    ws,
+    auto_fields_list: List[Dict[str, Any]],
+    required_cols: List[str] | None = None,
+    match_existing: bool = True,
+) -> List[Dict[str, Any]]:
+    """
+    apply_auto_fields para muchas fichas sobre la misma hoja (carga masiva): las
+    cabeceras, el índice de filas y la siguiente fila libre se calculan una sola vez
+    y se mantienen al día, en lugar de recorrer la hoja por cada ficha.
+    Una ficha repetida en la propia lista actualiza la fila que se añadió antes.
+    """
+    headers = _headers_index(ws)
+    index = _build_row_index(ws, headers) if match_existing else {}
+    next_row = _first_empty_row(ws, headers, required_cols)
+    results = []
+    for auto_fields in auto_fields_list:
+        key = _row_key(*(auto_fields.get(c) for c in ROW_KEY_COLS)) if match_existing else None
+        existing = index.get(key) if key else None
+        if existing:
+            results.append(_update_existing(ws, existing, headers, auto_fields))
+            continue
+        res = _write_new_row(ws, next_row, headers, auto_fields)
+        if key:
+            index[key] = next_row
+        next_row = _first_empty_row(ws, headers, required_cols, start=next_row + 1)
+        results.append(res)
+    return results
+
+
+def apply_row_updates(ws, row: int, updates: Dict[str, Any]) -> Dict[str, Any]:
+    """Aplica `updates` a la fila `row` (base 1) de `ws` sin guardar. Mismo formato que apply_auto_fields."""
+    headers = _headers_index(ws)
+    before = _row_values(ws, row, headers)
+    _apply_updates(ws, row, headers, updates or {})
+    return {"row": row, "mode": "update", "changed": list(updates or {}),
+            "before": before, "edits": _row_edits(ws, row, before)}
+
+
+def revert_edits(ws, applied: Dict[str, Any]):
+    """Deshace en memoria lo aplicado por apply_auto_fields/apply_row_updates (previews)."""
+    for c, v in applied["before"].items():
+        ws.cell(row=applied["row"], column=c).value = v
+
+
+def write_auto_fields(
+    excel_bytes: bytes,
+    auto_fields: Dict[str, Any],
+    sheet: str | None = None,
+    required_cols: List[str] | None = None,
+    save: bool = True,
+    match_existing: bool = True,
+) -> Dict[str, Any]:
+    """
+    Escribe `auto_fields` en la primera fila libre detectada, sin generar ningún ID.
+    - sheet=None: la hoja de datos del libro (resolve_data_sheet; sigue al cambio de año).
+    - Respeta el marco/estilos porque no inserta filas ni columnas.
+    - required_cols te permite definir qué columnas marcan que una fila está ocupada.
+    - save=False evita serializar el libro (preview solo necesita hoja/fila).
+    - match_existing: si ya hay una fila con el mismo NOMBRE DE FICHA + VENCIMIENTO
+      se trata como re-envío y solo se escriben las celdas que cambian (mode="update").
+    """
+    sheet = sheet or resolve_data_sheet(excel_bytes)
+    # Solo se parsea la hoja destino; las demás se copian tal cual al guardar
+    wb = load_sheets(excel_bytes, [sheet])
+    ws = wb[sheet]
+    applied = apply_auto_fields(ws, auto_fields, required_cols, match_existing, content_hash(excel_bytes))
+    return _result(excel_bytes, ws.title, applied, save)
+
+
+def write_many_auto_fields(
+    excel_bytes: bytes,
+    auto_fields_list: List[Dict[str, Any]],
+    sheet: str | None = None,
+    required_cols: List[str] | None = None,
+    save: bool = True,
+    match_existing: bool = True,
+) -> Dict[str, Any]:
+    """
+    write_auto_fields para varias fichas (DOCX con varias fichas): una fila por ficha,
+    con una sola carga de la hoja y un solo guardado.
+    Devuelve {sheet, rows: [{row (base 0), mode, changed}], updated_excel, size}.
+    """
+    sheet = sheet or resolve_data_sheet(excel_bytes)
+    wb = load_sheets(excel_bytes, [sheet])
+    ws = wb[sheet]
+    applied = apply_many(ws, auto_fields_list, required_cols, match_existing)
+    edits: Dict[Any, Any] = {}
+    for a in applied:
+        edits.update(a["edits"])
+    result = {
         "sheet": ws.title,
+        "rows": [{"row": a["row"] - 1, "mode": a["mode"], "changed": a["changed"]} for a in applied],
+        "updated_excel": None,
+        "size": 0,
+    }
+    if save:
+        result["updated_excel"], result["size"] = save_edits(excel_bytes, ws.title, edits)
+        logger.info("Guardado. Hoja=%s, %d fichas", ws.title, len(applied))
+    return result
+
+
+def _result(excel_bytes: bytes, sheet: str, applied: Dict[str, Any], save: bool) -> Dict[str, Any]:
+    base0 = applied["row"] - 1
+    result = {
+        "sheet": sheet,
         "row": base0,  # índice base 0 de la fila escrita
-        "updated_excel_bytes": out.getvalue(),
+        "mode": applied["mode"],  # "append" (fila nueva) | "update" (re-envío de una ficha existente)
+        "changed": applied["changed"],
+        "updated_excel": None,
+        "size": 0,
     }
+    if save:
+        result["updated_excel"], result["size"] = save_edits(excel_bytes, sheet, applied["edits"])
+        logger.info("Guardado. Hoja=%s, fila(base0)=%d", sheet, base0)
+    return result
+
+
+def _apply_updates(ws, row: int, headers: Dict[str, int], updates: Dict[str, Any]):
+    """Escribe `updates` en la fila (base 1) y reaplica la exclusividad de ÁMBITO si se tocó."""
+    for k, v in (updates or {}).items():
+        _set_if(k, v, ws, row, headers)
+
+    if any(k in updates for k in AMBITO_COLS):
+        # El ámbito que llega en `updates` manda sobre los que ya hubiera en la fila
+        payload = {k: updates[k] for k in AMBITO_COLS if updates.get(k)} or {
+            k: ws.cell(row=row, column=headers[_norm(k)]).value if _norm(k) in headers else ""
+            for k in AMBITO_COLS
+        }
+        _apply_ambito_exclusive(ws, row, headers, payload)
 
 
 def update_row_in_excel(
@@ -171,31 +481,19 @@ def update_row_in_excel(
     updates: Dict[str, Any],
 ) -> Dict[str, Any]:
     """Actualiza una fila existente (row_index_base0) con los pares clave/valor de `updates`."""
-    wb = load_workbook(BytesIO(excel_bytes))
+    wb = load_sheets(excel_bytes, [sheet])
     ws = wb[sheet]
-    headers = _headers_index(ws)
     row = row_index_base0 + 1
 
     logger.info("Actualizar fila (base1) %d en hoja '%s'", row, ws.title)
 
-    for k, v in (updates or {}).items():
-        _set_if(k, v, ws, row, headers)
-
-    # Reaplica la exclusividad de ÁMBITO si alguno de ellos se tocó
-    if any(k in updates for k in AMBITO_COLS):
-        payload = {
-            k: ws.cell(row=row, column=headers[_norm(k)]).value if _norm(k) in headers else ""
-            for k in AMBITO_COLS
-        }
-        _apply_ambito_exclusive(ws, row, headers, payload)
-
-    out = BytesIO()
-    wb.save(out)
-    out.seek(0)
+    applied = apply_row_updates(ws, row, updates)
+    out, size = save_edits(excel_bytes, ws.title, applied["edits"])
 
     logger.info("Actualización guardada. Fila(base0)=%d", row_index_base0)
     return {
         "sheet": ws.title,
         "row": row_index_base0,
-        "updated_excel_bytes": out.getvalue(),
+        "updated_excel": out,  # SpooledTemporaryFile, lo cierra quien lo consume
+        "size": size,
     }
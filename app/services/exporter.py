@@ -0,0 +1,121 @@
+# app/services/exporter.py
+"""
+Exportación en streaming de la hoja de datos del maestro a CSV o JSONL.
+
+Se abre el fichero en modo read_only de openpyxl (las filas se leen del XML a
+medida que se piden) y cada fila se serializa y se entrega por bloques, así que
+la memoria no depende del tamaño de la hoja y los primeros bytes salen antes
+de terminar de leerla.
+"""
+import csv
+import io
+import json
+import logging
+from datetime import date, datetime, time
+from typing import Any, BinaryIO, Dict, Iterator, List, Tuple
+
+from app.config import settings
+from app.services.workbook_loader import resolve_data_sheet
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "jsonl": "application/x-ndjson",
+}
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+
+def _plain(v):
+    if isinstance(v, (datetime, date, time)):
+        return v.isoformat()
+    return v
+
+
+def _iter_table(
+    source: str | BinaryIO,
+    sheet: str | None = None,
+    header_row: int | None = None,
+) -> Iterator[Any]:
+    """
+    Primero la lista de cabeceras y después (fila base-1, cabeceras, {cabecera: valor}) por
+    cada fila de datos no vacía: así el CSV lleva cabecera aunque la hoja no tenga fichas.
+    `source` es una ruta o un fichero abierto; el libro se cierra al acabar el generador.
+    """
+    from openpyxl import load_workbook
+    sheet = sheet or resolve_data_sheet(source)
+    header_row = header_row or settings.MASTER_HEADER_ROW
+    wb = load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = wb[sheet].iter_rows(min_row=header_row, values_only=True)
+        header_values = next(rows, ())
+        # (posición, nombre) de las columnas con cabecera
+        cols = [(i, str(h).strip()) for i, h in enumerate(header_values) if h is not None and str(h).strip()]
+        names = [n for _, n in cols]
+        yield names
+        for r, values in enumerate(rows, start=header_row + 1):
+            if all(v in (None, "") for v in values):
+                continue
+            yield r, names, {n: _plain(values[i]) if i < len(values) else None for i, n in cols}
+    finally:
+        wb.close()
+
+
+def iter_rows(
+    source: str | BinaryIO,
+    sheet: str | None = None,
+    header_row: int | None = None,
+) -> Iterator[Tuple[int, List[str], Dict[str, Any]]]:
+    """
+    Genera (fila base-1, cabeceras, {cabecera: valor}) por cada fila de datos no vacía.
+    `source` es una ruta o un fichero abierto; el libro se cierra al acabar el generador.
+    """
+    table = _iter_table(source, sheet, header_row)
+    next(table)
+    yield from table
+
+
+def _serialize(fmt: str, table: Iterator[Any]) -> Iterator[str]:
+    names = next(table)
+    if fmt == "jsonl":
+        for _, _, record in table:
+            yield json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        return
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(names)  # en cuanto se conocen las columnas, haya o no filas
+    for _, _, record in table:
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+        writer.writerow(["" if record[n] is None else record[n] for n in names])
+    yield buf.getvalue()
+
+
+def chunked(lines: Iterator[str], chunk_bytes: int = EXPORT_CHUNK_BYTES) -> Iterator[bytes]:
+    """Agrupa líneas de texto en bloques UTF-8 de ~chunk_bytes (menos escrituras al socket)."""
+    pending: List[bytes] = []
+    size = 0
+    for line in lines:
+        data = line.encode("utf-8")
+        pending.append(data)
+        size += len(data)
+        if size >= chunk_bytes:
+            yield b"".join(pending)
+            pending, size = [], 0
+    if pending:
+        yield b"".join(pending)
+
+
+def iter_export(
+    source: str | BinaryIO,
+    fmt: str = "csv",
+    sheet: str | None = None,
+    header_row: int | None = None,
+    chunk_bytes: int = EXPORT_CHUNK_BYTES,
+) -> Iterator[bytes]:
+    """Bloques de bytes (UTF-8) con la hoja exportada en `fmt` (csv | jsonl)."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato no soportado: {fmt} (usa {', '.join(FORMATS)})")
+    yield from chunked(_serialize(fmt, _iter_table(source, sheet, header_row)), chunk_bytes)
+    logger.info("Exportación %s terminada", fmt)
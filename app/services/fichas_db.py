@@ -0,0 +1,246 @@
+# app/services/fichas_db.py
+"""
+Réplica SQLite de la hoja de datos del Excel maestro.
+
+Las búsquedas (/fichas) van contra la base SQLite, con índices sobre nombre,
+vencimiento, temáticas, ámbitos y portales, sin abrir el xlsx. La réplica se
+refresca cuando cambia el fichero maestro (mtime/tamaño y hash): se recorren
+las filas en streaming (openpyxl read_only) y solo se reescriben las filas cuyo
+hash ha cambiado.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime
+from typing import Any, Dict, List
+
+from app.config import settings
+from app.services.excel_writer import DATA_START_ROW, HEADER_ROW, _headers_index, _norm, norm_header
+from app.services.workbook_loader import load_sheets, resolve_data_sheet
+from app.utils.dates import cell_date
+from app.utils.hashing import content_hash
+
+logger = logging.getLogger(__name__)
+
+# columna SQLite -> cabeceras aceptadas en el Excel (normalizadas con _norm)
+INDEXED_COLUMNS: Dict[str, List[str]] = {
+    "nombre": ["NOMBRE DE FICHA"],
+    "vencimiento": ["VENCIMIENTO"],
+    "tematica_1": ["TEMÁTICA 1"],
+    "tematica_2": ["TEMÁTICA 2"],
+    "tematica_3": ["TEMÁTICA 3"],
+    "ambito_ue": ["AMBITO UE/ESTADO"],
+    "ambito_ccaa": ["AMBITO CC AA"],
+    "ambito_provincial": ["AMBITO PROVINCIAL"],
+    "ambito_municipal": ["AMBITO MUNICIPAL", "AMBITO MUNICPAL"],  # la plantilla trae la errata
+    "portal_mayores": ["MAYORES"],
+    "portal_discapacidad": ["DISCAPACIDAD"],
+    "portal_familia": ["FAMILIA"],
+    "portal_mujer": ["MUJER"],
+    "portal_salud": ["SALUD"],
+}
+# `vencimiento` solo guarda fechas ISO (o NULL) para que los filtros por rango comparen
+# fechas; el texto original ("Sin plazo", "Hasta 30/10/2025 (ampliable)") va aparte
+SCHEMA_VERSION = 2
+TEXT_COLUMNS = ["vencimiento_texto"]
+TEMATICA_COLUMNS = ["tematica_1", "tematica_2", "tematica_3"]
+AMBITO_COLUMNS = ["ambito_ue", "ambito_ccaa", "ambito_provincial", "ambito_municipal"]
+PORTAL_COLUMNS = ["portal_mayores", "portal_discapacidad", "portal_familia", "portal_mujer", "portal_salud"]
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS fichas (
+    row INTEGER PRIMARY KEY,          -- fila del Excel (base-1)
+    row_hash TEXT NOT NULL,
+    nombre_norm TEXT,
+    {", ".join(f"{c} TEXT" for c in [*INDEXED_COLUMNS, *TEXT_COLUMNS])},
+    data TEXT NOT NULL                -- fila completa (JSON, cabecera -> valor)
+);
+{"".join(f"CREATE INDEX IF NOT EXISTS ix_fichas_{c} ON fichas({c});" for c in ["nombre_norm", *INDEXED_COLUMNS])}
+"""
+
+_refresh_lock = threading.Lock()
+
+
+def _connect() -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(settings.FICHAS_DB_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(settings.FICHAS_DB_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")  # lecturas concurrentes mientras otro worker refresca
+    if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+        # réplica de otra versión: se descarta y se reconstruye entera en el próximo refresh
+        conn.executescript("DROP TABLE IF EXISTS fichas; DROP TABLE IF EXISTS meta;")
+        conn.executescript(_SCHEMA)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    else:
+        conn.executescript(_SCHEMA)
+    return conn
+
+
+def _meta(conn: sqlite3.Connection) -> Dict[str, str]:
+    return {r["key"]: r["value"] for r in conn.execute("SELECT key, value FROM meta")}
+
+
+def _jsonable(v):
+    if isinstance(v, (datetime, date)):
+        return v.isoformat()
+    return v
+
+
+def _text(v) -> str | None:
+    if v is None or (isinstance(v, str) and not v.strip()):
+        return None
+    return str(_jsonable(v)).strip()
+
+
+def _column_positions(headers: Dict[str, int]) -> Dict[str, int]:
+    """Columna SQLite -> índice (base-0) en la tupla de valores de la fila."""
+    pos = {}
+    for col, names in INDEXED_COLUMNS.items():
+        for name in names:
+            if _norm(name) in headers:
+                pos[col] = headers[_norm(name)] - 1
+                break
+    return pos
+
+
+def _iter_rows(excel_bytes: bytes, sheet: str):
+    """(fila_base1, {col_sqlite: texto}, data_json) de cada fila con contenido."""
+    wb = load_sheets(excel_bytes, [sheet], read_only=True, data_only=True)
+    try:
+        ws = wb[sheet]
+        headers = _headers_index(ws)
+        names = {c: str(ws.cell(row=HEADER_ROW, column=c).value).strip() for c in headers.values()}
+        pos = _column_positions(headers)
+        for r, values in enumerate(ws.iter_rows(min_row=DATA_START_ROW, values_only=True), start=DATA_START_ROW):
+            if all(v in (None, "") for v in values):
+                continue
+            data = {names[c]: _jsonable(values[c - 1]) for c in names if c - 1 < len(values)}
+            cols = {col: _text(values[i]) if i < len(values) else None for col, i in pos.items()}
+            venc = cell_date(values[pos["vencimiento"]], wb.epoch) if "vencimiento" in pos else None
+            cols["vencimiento_texto"] = cols.get("vencimiento")
+            cols["vencimiento"] = venc.isoformat() if venc else None  # comparable en rangos
+            yield r, cols, json.dumps(data, ensure_ascii=False, default=str)
+    finally:
+        wb.close()
+
+
+def refresh(path: str | None = None, force: bool = False) -> Dict[str, Any]:
+    """
+    Sincroniza la réplica con el maestro. Si el fichero no ha cambiado no lee nada;
+    si ha cambiado, solo escribe las filas nuevas/modificadas y borra las que ya no existen.
+    """
+    path = path or settings.MASTER_EXCEL_PATH
+    sheet = resolve_data_sheet(path)
+    with _refresh_lock:
+        conn = _connect()
+        try:
+            st = os.stat(path)
+            stamp = f"{st.st_mtime_ns}:{st.st_size}:{sheet}"
+            meta = _meta(conn)
+            if not force and meta.get("stamp") == stamp:
+                return {"changed": False, "upserted": 0, "deleted": 0, "source_hash": meta.get("source_hash")}
+
+            with open(path, "rb") as f:
+                excel_bytes = f.read()
+            source_hash = content_hash(excel_bytes)
+            if not force and meta.get("source_hash") == source_hash and meta.get("sheet") == sheet:
+                conn.execute("INSERT OR REPLACE INTO meta VALUES ('stamp', ?)", (stamp,))
+                conn.commit()
+                return {"changed": False, "upserted": 0, "deleted": 0, "source_hash": source_hash}
+
+            t0 = time.perf_counter()
+            known = dict(conn.execute("SELECT row, row_hash FROM fichas"))
+            seen, upserts = set(), []
+            for r, cols, data in _iter_rows(excel_bytes, sheet):
+                seen.add(r)
+                h = content_hash(data.encode("utf-8"))
+                if known.get(r) == h:
+                    continue
+                nombre = cols.get("nombre")
+                upserts.append({
+                    "row": r, "row_hash": h, "nombre_norm": norm_header(nombre) if nombre else None,
+                    **{c: cols.get(c) for c in [*INDEXED_COLUMNS, *TEXT_COLUMNS]}, "data": data,
+                })
+            deleted = [(r,) for r in known if r not in seen]
+
+            names = ["row", "row_hash", "nombre_norm", *INDEXED_COLUMNS, *TEXT_COLUMNS, "data"]
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO fichas ({', '.join(names)}) VALUES ({', '.join(':' + n for n in names)})",
+                    upserts,
+                )
+                conn.executemany("DELETE FROM fichas WHERE row = ?", deleted)
+                conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", [
+                    ("stamp", stamp), ("source_hash", source_hash), ("sheet", sheet),
+                    ("refreshed_at", str(time.time())),
+                ])
+            logger.info(
+                "Réplica de fichas actualizada: %d filas escritas, %d borradas (%.1f ms)",
+                len(upserts), len(deleted), (time.perf_counter() - t0) * 1000,
+            )
+            return {"changed": True, "upserted": len(upserts), "deleted": len(deleted), "source_hash": source_hash}
+        finally:
+            conn.close()
+
+
+def _like(value: str) -> str:
+    return "%" + value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def search(
+    q: str | None = None,
+    tematica: str | None = None,
+    ambito: str | None = None,
+    portal: str | None = None,
+    vence_desde: date | None = None,
+    vence_hasta: date | None = None,
+    limit: int = 50,
+    offset: int = 0,
+) -> Dict[str, Any]:
+    """Búsqueda paginada. `q` busca en el nombre (sin acentos ni mayúsculas)."""
+    where: List[str] = []
+    params: List[Any] = []
+    if q:
+        where.append("nombre_norm LIKE ? ESCAPE '\\'")
+        params.append(_like(norm_header(q)))
+    if tematica:
+        where.append("(" + " OR ".join(f"{c} = ? COLLATE NOCASE" for c in TEMATICA_COLUMNS) + ")")
+        params += [tematica.strip()] * len(TEMATICA_COLUMNS)
+    if ambito:
+        where.append("(" + " OR ".join(f"{c} LIKE ? ESCAPE '\\'" for c in AMBITO_COLUMNS) + ")")
+        params += [_like(ambito.strip())] * len(AMBITO_COLUMNS)
+    if portal:
+        col = f"portal_{norm_header(portal).lower()}"
+        if col not in PORTAL_COLUMNS:
+            raise ValueError(f"Portal desconocido: {portal}")
+        where.append(f"{col} IS NOT NULL")
+    if vence_desde:
+        where.append("vencimiento >= ?")
+        params.append(vence_desde.isoformat())
+    if vence_hasta:
+        where.append("vencimiento <= ?")
+        params.append(vence_hasta.isoformat())
+    sql_where = (" WHERE " + " AND ".join(where)) if where else ""
+
+    conn = _connect()
+    try:
+        total = conn.execute(f"SELECT COUNT(*) FROM fichas{sql_where}", params).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT row, data FROM fichas{sql_where} ORDER BY row LIMIT ? OFFSET ?",
+            [*params, limit, offset],
+        ).fetchall()
+        meta = _meta(conn)
+    finally:
+        conn.close()
+    return {
+        "total": total,
+        "limit": limit,
+        "offset": offset,
+        "source_hash": meta.get("source_hash"),
+        "items": [{"row": r["row"] - 1, **json.loads(r["data"])} for r in rows],  # row base-0
+    }
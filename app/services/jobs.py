@@ -0,0 +1,251 @@
+# app/services/jobs.py
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from app.config import settings
+from app.services.pipeline import STAGES, run_sync_pipeline
+
+logger = logging.getLogger(__name__)
+
+# Estados de un job
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class JobQueueFull(Exception):
+    """Se alcanzó JOBS_MAX_PENDING (jobs en cola + en ejecución)."""
+
+
+_jobs: Dict[str, Dict[str, Any]] = {}
+_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+_heavy_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor(heavy: bool = False) -> ThreadPoolExecutor:
+    """Pool normal o carril pesado (ADMISSION_HEAVY_CONCURRENCY): un fichero enorme no ocupa todo el pool."""
+    global _executor, _heavy_executor
+    if heavy:
+        if _heavy_executor is None:
+            _heavy_executor = ThreadPoolExecutor(
+                max_workers=max(1, settings.ADMISSION_HEAVY_CONCURRENCY),
+                thread_name_prefix="fichasync-job-heavy",
+            )
+        return _heavy_executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=max(1, settings.JOBS_MAX_CONCURRENT),
+            thread_name_prefix="fichasync-job",
+        )
+    return _executor
+
+
+def _result_path(job_id: str) -> str:
+    return os.path.join(settings.JOBS_SPOOL_DIR, f"{job_id}.xlsx")
+
+
+def _status_path(job_id: str) -> str:
+    return os.path.join(settings.JOBS_SPOOL_DIR, f"{job_id}.json")
+
+
+def _persist(job: Dict[str, Any]):
+    """Copia del estado en el spool: con varios workers el polling puede caer en otro proceso."""
+    os.makedirs(settings.JOBS_SPOOL_DIR, exist_ok=True)
+    tmp = _status_path(job["job_id"]) + ".part"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(job, f)
+    os.replace(tmp, _status_path(job["job_id"]))
+
+
+def _load_persisted(job_id: str) -> Optional[Dict[str, Any]]:
+    if not job_id.isalnum():
+        return None
+    try:
+        with open(_status_path(job_id), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _pid_alive(pid: int | None) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # existe, pero es de otro usuario
+        return True
+    except OSError:
+        return False
+    return True
+
+
+def _orphan_reason(job: Dict[str, Any], now: float) -> Optional[str]:
+    """
+    Motivo para dar por fallido un job en cola/en curso que no está en la memoria de este
+    proceso. Solo si su worker ya no existe: mientras viva, el job es suyo aunque tarde.
+    """
+    if job.get("status") not in (QUEUED, RUNNING):
+        return None
+    pid = job.get("pid")
+    if pid == os.getpid() or not _pid_alive(pid):
+        # mismo pid sin el job en memoria: el worker se reinició y reutilizó el pid
+        return "El worker que ejecutaba el job terminó o se reinició"
+    return None
+
+
+def _reap(job: Dict[str, Any], now: float) -> bool:
+    """Marca como fallido (y persiste) un job persistido cuyo worker ya no lo va a terminar."""
+    reason = _orphan_reason(job, now)
+    if not reason:
+        return False
+    job.update(status=FAILED, error=reason, finished_at=now)
+    try:
+        _persist(job)
+    except OSError:
+        logger.warning("No se pudo marcar como fallido el job %s", job["job_id"], exc_info=True)
+    logger.warning("Job %s marcado como fallido: %s", job["job_id"], reason)
+    return True
+
+
+def recover_orphans(now: float | None = None) -> int:
+    """
+    Al arrancar: jobs del spool que siguen en cola/en curso pero cuyo worker murió (pid)
+    pasan a fallidos; si no, el polling vería "running" siempre.
+    """
+    now = now or time.time()
+    if not os.path.isdir(settings.JOBS_SPOOL_DIR):
+        return 0
+    reaped = 0
+    for fn in os.listdir(settings.JOBS_SPOOL_DIR):
+        if not fn.endswith(".json"):
+            continue
+        job_id = fn[: -len(".json")]
+        with _lock:
+            if job_id in _jobs:
+                continue
+        job = _load_persisted(job_id)
+        if job and _reap(job, now):
+            reaped += 1
+    return reaped
+
+
+def _update(job_id: str, **kw):
+    with _lock:
+        job = _jobs.get(job_id)
+        if job:
+            job.update(kw)
+            _persist(job)
+
+
+def _run(job_id: str, docx_bytes: bytes, excel_bytes: bytes):
+    def on_stage(name: str):
+        _update(job_id, stage=name, progress=round(STAGES.index(name) / len(STAGES), 2))
+
+    _update(job_id, status=RUNNING, started_at=time.time())
+    try:
+        res = run_sync_pipeline(docx_bytes, excel_bytes, on_stage=on_stage)
+        written = res["written"]
+        os.makedirs(settings.JOBS_SPOOL_DIR, exist_ok=True)
+        tmp = _result_path(job_id) + ".part"
+        with written["updated_excel"] as src, open(tmp, "wb") as f:
+            shutil.copyfileobj(src, f)
+        os.replace(tmp, _result_path(job_id))
+        _update(
+            job_id, status=DONE, stage="done", progress=1.0, finished_at=time.time(),
+            sheet=written["sheet"], row=written["row"], mode=written["mode"],
+        )
+        logger.info("Job %s terminado (hoja=%s, fila=%s)", job_id, written["sheet"], written["row"])
+    except Exception as e:
+        logger.exception("Job %s falló", job_id)
+        _update(job_id, status=FAILED, error=str(e), finished_at=time.time())
+
+
+def cleanup_expired(now: float | None = None) -> int:
+    """Elimina jobs terminados (y su fichero en el spool) más antiguos que JOBS_TTL_SECONDS."""
+    now = now or time.time()
+    expired = []
+    with _lock:
+        for job_id, job in list(_jobs.items()):
+            fin = job.get("finished_at")
+            if fin and now - fin > settings.JOBS_TTL_SECONDS:
+                expired.append(job_id)
+                del _jobs[job_id]
+    # restos de ejecuciones anteriores (reinicios) y jobs de otros workers que ya no están
+    # en memoria; los que siguen en cola/en curso no se tocan (pueden ser de un worker vivo)
+    active: Dict[str, bool] = {}
+    if os.path.isdir(settings.JOBS_SPOOL_DIR):
+        for fn in os.listdir(settings.JOBS_SPOOL_DIR):
+            path = os.path.join(settings.JOBS_SPOOL_DIR, fn)
+            job_id = fn.split(".", 1)[0]
+            try:
+                stale = now - os.path.getmtime(path) > settings.JOBS_TTL_SECONDS
+            except OSError:
+                continue
+            if stale and job_id not in _jobs and job_id not in expired:
+                if job_id not in active:
+                    job = _load_persisted(job_id)
+                    active[job_id] = bool(job) and job.get("status") in (QUEUED, RUNNING)
+                if active[job_id]:
+                    continue
+            if job_id in expired or (stale and job_id not in _jobs):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+    return len(expired)
+
+
+def submit_job(docx_bytes: bytes, excel_bytes: bytes, filename: str | None = None, heavy: bool = False) -> str:
+    cleanup_expired()
+    with _lock:
+        active = sum(1 for j in _jobs.values() if j["status"] in (QUEUED, RUNNING))
+        if active >= settings.JOBS_MAX_PENDING:
+            raise JobQueueFull(f"Hay {active} jobs en curso (máx {settings.JOBS_MAX_PENDING})")
+        job_id = uuid.uuid4().hex
+        _jobs[job_id] = {
+            "job_id": job_id,
+            "status": QUEUED,
+            "stage": "queued",
+            "progress": 0.0,
+            "filename": filename or "temporal.xlsx",
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "sheet": None,
+            "row": None,
+            "mode": None,
+            "error": None,
+            "lane": "heavy" if heavy else "light",
+            "pid": os.getpid(),  # para detectar jobs huérfanos si el worker muere
+        }
+        _persist(_jobs[job_id])
+    _get_executor(heavy).submit(_run, job_id, docx_bytes, excel_bytes)
+    return job_id
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    cleanup_expired()
+    with _lock:
+        job = _jobs.get(job_id)
+        if job:
+            return dict(job)
+    job = _load_persisted(job_id)
+    if job:
+        _reap(job, time.time())  # otro worker lo tenía y murió: fallido en vez de "running" para siempre
+    return job
+
+
+def get_result_path(job_id: str) -> Optional[str]:
+    job = get_job(job_id)
+    if not job or job["status"] != DONE:
+        return None
+    path = _result_path(job_id)
+    return path if os.path.exists(path) else None
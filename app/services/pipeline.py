@@ -0,0 +1,78 @@
+# app/services/pipeline.py
+from contextlib import contextmanager
+from typing import Any, Callable, Dict
+
+from app.schema.enums import from_excel_bytes
+from app.services.transformer import suggest_tematicas, transform_from_docx
+from app.services.excel_writer import write_auto_fields, write_many_auto_fields
+from app.services.docx_reader import extract_fichas_from_docx, extract_fields_from_docx
+from app.utils import memprofile
+from app.utils.logging import log_stage
+
+# Etapas del flujo DOCX -> Excel, en orden
+STAGES = ["enums", "extract", "transform", "write"]
+
+
+@contextmanager
+def _stage(name: str, on_stage: Callable[[str], None] | None):
+    if on_stage:
+        on_stage(name)
+    # duración por etapa en el log de acceso y, si se pidió, memoria por etapa
+    with log_stage(name), memprofile.stage(name):
+        yield
+
+
+def run_sync_pipeline(
+    docx_bytes: bytes,
+    excel_bytes: bytes,
+    on_stage: Callable[[str], None] | None = None,
+    save: bool = True,
+) -> Dict[str, Any]:
+    """
+    Ejecuta extract -> transform -> write sobre los bytes recibidos.
+    `on_stage(nombre)` se invoca al empezar cada etapa (progreso de jobs, métricas...).
+    Con save=False no se serializa el xlsx (written["updated_excel"] es None).
+    Devuelve {"enums", "fields", "tematicas", "auto_fields", "written"}.
+    """
+    with _stage("enums", on_stage):
+        enums = from_excel_bytes(excel_bytes)
+    with _stage("extract", on_stage):
+        fields = extract_fields_from_docx(docx_bytes)
+    with _stage("transform", on_stage):
+        tematicas = suggest_tematicas(fields, enums)
+        auto_fields = transform_from_docx(fields, enums, tematicas)
+    with _stage("write", on_stage):
+        written = write_auto_fields(excel_bytes, auto_fields, save=save)  # {sheet,row,updated_excel,size}
+
+    return {"enums": enums, "fields": fields, "tematicas": tematicas, "auto_fields": auto_fields, "written": written}
+
+
+def run_multi_pipeline(
+    docx_bytes: bytes,
+    excel_bytes: bytes,
+    on_stage: Callable[[str], None] | None = None,
+    save: bool = True,
+) -> Dict[str, Any]:
+    """
+    Igual que run_sync_pipeline para un DOCX con varias fichas: cada ficha va a su
+    propia fila, todas en una sola escritura del libro.
+    Devuelve {"enums", "fichas": [{"fields", "tematicas", "auto_fields"}], "written"}
+    con written = {sheet, rows, updated_excel, size} (una entrada de rows por ficha).
+    """
+    with _stage("enums", on_stage):
+        enums = from_excel_bytes(excel_bytes)
+    with _stage("extract", on_stage):
+        all_fields = extract_fichas_from_docx(docx_bytes)
+    with _stage("transform", on_stage):
+        fichas = []
+        for fields in all_fields:
+            tematicas = suggest_tematicas(fields, enums)
+            fichas.append({
+                "fields": fields,
+                "tematicas": tematicas,
+                "auto_fields": transform_from_docx(fields, enums, tematicas),
+            })
+    with _stage("write", on_stage):
+        written = write_many_auto_fields(excel_bytes, [f["auto_fields"] for f in fichas], save=save)
+
+    return {"enums": enums, "fichas": fichas, "written": written}
@@ -0,0 +1,203 @@
+# app/services/response_cache.py
+"""
+Caché de respuestas idempotentes en disco.
+
+Clave = hash(endpoint + parámetros + hash de cada upload + huella del código y la
+configuración que deciden la respuesta). Si el front-end repite
+un preview/process/finalize con los mismos ficheros, se devuelve la respuesta
+guardada sin volver a parsear nada. Con la cabecera `Idempotency-Key` además se
+garantiza que la misma clave siempre devuelve la misma respuesta (y se rechaza
+si llega con otro contenido).
+
+Cada entrada son dos ficheros en RESPONSE_CACHE_DIR:
+  <clave>.json  metadatos (tipo, cabeceras, media_type y, si es JSON, el cuerpo)
+  <clave>.bin   cuerpo binario (xlsx), escrito mientras se envía al cliente
+Tamaño acotado por RESPONSE_CACHE_MAX_MB con expulsión LRU (mtime).
+"""
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Any, Dict, Iterator, Optional
+
+from app.config import settings
+from app.utils.disk_cache import evict_dir
+from app.utils.hashing import content_hash
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyConflict(Exception):
+    """La Idempotency-Key ya se usó con otros ficheros/parámetros."""
+
+
+# módulos cuyo código decide la respuesta (el del parser DOCX va en PARSER_FINGERPRINT)
+_FINGERPRINT_MODULES = (
+    "app.services.pipeline", "app.services.transformer", "app.services.tematicas",
+    "app.services.excel_writer", "app.services.workbook_loader", "app.services.enums_loader",
+    "app.schema.enums", "app.schema.mapping", "app.utils.dates",
+)
+_fingerprint: str | None = None
+
+
+def _file_hash(path: str) -> str:
+    try:
+        with open(path, "rb") as f:
+            return content_hash(f.read())
+    except OSError:
+        return ""
+
+
+def fingerprint() -> str:
+    """
+    Huella del código (pipeline, transformer, writer, parser DOCX...) y de los ajustes que
+    cambian la salida (hoja/cabecera del maestro, sinónimos y umbral de TEMÁTICAS).
+    Tras un despliegue con otra huella las respuestas guardadas dejan de coincidir.
+    """
+    global _fingerprint
+    if _fingerprint is None:
+        import importlib
+        from app.services.docx_reader import PARSER_FINGERPRINT
+
+        parts = [PARSER_FINGERPRINT]
+        parts += [_file_hash(importlib.import_module(m).__file__) for m in _FINGERPRINT_MODULES]
+        parts += [
+            settings.MASTER_DATA_SHEET, str(settings.MASTER_HEADER_ROW), settings.ROLLOVER_SHEET_TEMPLATE,
+            repr(settings.TEMATICAS_MIN_SCORE), settings.TEMATICAS_SYNONYMS_PATH,
+            _file_hash(settings.TEMATICAS_SYNONYMS_PATH) if settings.TEMATICAS_SYNONYMS_PATH else "",
+        ]
+        _fingerprint = content_hash("|".join(parts).encode())[:16]
+    return _fingerprint
+
+
+def request_key(endpoint: str, params: Dict[str, Any], *blobs: bytes) -> str:
+    parts = [endpoint, fingerprint(), json.dumps(params, sort_keys=True, default=str)]
+    parts += [content_hash(b) for b in blobs]
+    return content_hash("|".join(parts).encode())
+
+
+def _path(key: str, ext: str) -> str:
+    return os.path.join(settings.RESPONSE_CACHE_DIR, f"{key}.{ext}")
+
+
+def _alias_key(endpoint: str, idempotency_key: str) -> str:
+    return "idem-" + content_hash(f"{endpoint}|{idempotency_key}".encode())
+
+
+def _write_json(path: str, data: Dict[str, Any]):
+    os.makedirs(settings.RESPONSE_CACHE_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=settings.RESPONSE_CACHE_DIR, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, default=str)
+    os.replace(tmp, path)
+
+
+def _read_json(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        os.utime(path)  # LRU
+        return data
+    except (OSError, ValueError):
+        return None
+
+
+def lookup(key: str, endpoint: str, idempotency_key: str | None = None) -> Optional[Dict[str, Any]]:
+    """
+    Devuelve los metadatos de la respuesta guardada (con "path" si el cuerpo es un fichero)
+    o None. Lanza IdempotencyConflict si la Idempotency-Key apunta a otra petición.
+    """
+    if not settings.RESPONSE_CACHE_ENABLED:
+        return None
+    if idempotency_key:
+        alias = _read_json(_path(_alias_key(endpoint, idempotency_key), "json"))
+        if alias and alias.get("target") != key:
+            raise IdempotencyConflict(
+                "Idempotency-Key reutilizada con otros ficheros o parámetros"
+            )
+    meta = _read_json(_path(key, "json"))
+    if not meta:
+        return None
+    if meta["kind"] == "file":
+        path = _path(key, "bin")
+        if not os.path.exists(path):
+            return None
+        os.utime(path)
+        meta["path"] = path
+    return meta
+
+
+def _evict():
+    # los .tmp son escrituras en curso: no cuentan ni se expulsan
+    evict_dir(settings.RESPONSE_CACHE_DIR, settings.RESPONSE_CACHE_MAX_MB * 1024 * 1024,
+              suffixes=(".json", ".bin"))
+
+
+def _remember_alias(key: str, endpoint: str, idempotency_key: str | None):
+    if idempotency_key:
+        _write_json(_path(_alias_key(endpoint, idempotency_key), "json"),
+                    {"target": key, "created_at": time.time()})
+
+
+def store_json(key: str, endpoint: str, body: Any, idempotency_key: str | None = None):
+    if not settings.RESPONSE_CACHE_ENABLED:
+        return
+    try:
+        _write_json(_path(key, "json"), {
+            "kind": "json", "endpoint": endpoint, "body": body, "headers": {}, "created_at": time.time(),
+        })
+        _remember_alias(key, endpoint, idempotency_key)
+    except OSError:
+        logger.warning("No se pudo guardar la respuesta en caché", exc_info=True)
+        return
+    _evict()
+
+
+def tee_file(
+    key: str,
+    endpoint: str,
+    chunks: Iterator[bytes],
+    media_type: str,
+    headers: Dict[str, str],
+    idempotency_key: str | None = None,
+) -> Iterator[bytes]:
+    """
+    Reenvía `chunks` al cliente y, a la vez, los copia a la caché. La entrada solo se
+    publica si el envío termina completo (si el cliente corta, se descarta).
+    """
+    if not settings.RESPONSE_CACHE_ENABLED:
+        yield from chunks
+        return
+    tmp = None
+    f = None
+    try:
+        os.makedirs(settings.RESPONSE_CACHE_DIR, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=settings.RESPONSE_CACHE_DIR, suffix=".tmp")
+        f = os.fdopen(fd, "wb")
+    except OSError:
+        logger.warning("Caché de respuestas no disponible", exc_info=True)
+        f = None
+    completed = False
+    try:
+        for chunk in chunks:
+            if f is not None:
+                f.write(chunk)
+            yield chunk
+        completed = True
+    finally:
+        if f is not None:
+            f.close()
+            if completed:
+                os.replace(tmp, _path(key, "bin"))
+                _write_json(_path(key, "json"), {
+                    "kind": "file", "endpoint": endpoint, "media_type": media_type,
+                    "headers": headers, "created_at": time.time(),
+                })
+                _remember_alias(key, endpoint, idempotency_key)
+                _evict()
+            else:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
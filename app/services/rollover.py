@@ -0,0 +1,549 @@
+# app/services/rollover.py
+"""
+Cambio de año del maestro: las fichas viejas pasan a un libro de archivo y la hoja
+de datos del libro activo se queda solo con lo vigente, para que cada carga
+(enums_loader, excel_writer, fichas_db) parsee una hoja de tamaño acotado.
+
+- Año completo (`new_sheet` sin `cutoff`): todas las fichas van al archivo y la hoja
+  pasa a llamarse como la del año nuevo ("Fichas 2026"), solo con las cabeceras.
+- Con `cutoff`: van al archivo las fichas cuya ROLLOVER_DATE_COLUMN (VENCIMIENTO) es
+  anterior; las demás se quedan (en la hoja del año nuevo si hay `new_sheet`). Las
+  filas sin fecha reconocible se quedan en el libro activo.
+
+Como compactor, trabaja sobre el XML: la hoja del año nuevo es la misma parte
+renombrada, así que conserva cabeceras, anchos, estilos, validaciones, formatos
+condicionales y tablas. Las filas que se quedan se renumeran seguidas bajo la
+cabecera (con sus fórmulas trasladadas), seguidas de `spare_rows` filas vacías con
+formato. Las fórmulas y nombres definidos que apuntaban a la hoja pasan a apuntar a
+la nueva. El archivo es una copia del libro con la hoja original (mismo nombre)
+reducida a las cabeceras y las filas archivadas.
+Los dos libros se comprueban con openpyxl antes de devolverlos (RolloverError si no cuadran).
+"""
+import logging
+import os
+import re
+import zipfile
+from collections import Counter
+from datetime import date
+from io import BytesIO
+from typing import Any, Dict, List, Tuple
+
+from app.config import settings
+from app.services.compactor import MAX_ROW, NS_XM, _col_letter, _fmt_range, _last_row_present, _parse_range
+from app.services.excel_writer import _norm
+from app.services.workbook_loader import (
+    NS_MAIN,
+    WORKBOOK_PART,
+    _SHEET_REF_RE,
+    _drop_calc_chain,
+    _fromstring,
+    _q,
+    _rels_path,
+    _resolve,
+    _sheet_parts,
+    _split_ref,
+    _tostring,
+    resolve_data_sheet,
+)
+from app.utils.dates import cell_date
+
+logger = logging.getLogger(__name__)
+
+# celda con un valor escrito (no fórmula): las filas con alguna son fichas; las que
+# solo tienen fórmulas (MES/AÑO precalculados) son el marco de las próximas fichas
+_LITERAL_CELL = "m:c[not(m:f) and (m:is or string-length(m:v) > 0)]"
+_FORMULA_TAGS = {"f", "formula", "formula1", "formula2"}
+_PLAIN_SHEET_NAME = re.compile(r"[A-Za-z_][\w.]*")
+
+
+class RolloverError(Exception):
+    """No se puede hacer el cambio de año, o los libros resultantes no conservan las fichas."""
+
+
+def archive_path(sheet: str, cutoff: date | None = None) -> str:
+    """Ruta por defecto del libro de archivo en ROLLOVER_ARCHIVE_DIR."""
+    name = f"{sheet} hasta {cutoff.isoformat()}" if cutoff else sheet
+    return os.path.join(settings.ROLLOVER_ARCHIVE_DIR, f"{name}.xlsx")
+
+
+# ---------- lectura de la hoja ----------
+
+def _shared_strings(zf: zipfile.ZipFile) -> List[str]:
+    if "xl/sharedStrings.xml" not in zf.namelist():
+        return []
+    return ["".join(t.text or "" for t in si.iter(_q("t"))) for si in _fromstring(zf.read("xl/sharedStrings.xml"))]
+
+
+def _cell_value(c, sst: List[str]):
+    t = c.get("t")
+    if t == "inlineStr":
+        is_ = c.find(_q("is"))
+        return "".join(x.text or "" for x in is_.iter(_q("t"))) if is_ is not None else None
+    v = c.find(_q("v"))
+    if v is None or not v.text:
+        return None
+    if t == "s":
+        return sst[int(v.text)]
+    if t in ("str", "e", "b"):
+        return v.text
+    try:
+        return float(v.text)
+    except ValueError:
+        return v.text
+
+
+def _number_rows(sheet_data):
+    prev = 0
+    for row in sheet_data:
+        if row.get("r") is None:  # r es opcional: fila siguiente a la anterior
+            row.set("r", str(prev + 1))
+        prev = int(row.get("r"))
+
+
+def _date_column(sheet_data, header_row: int, sst: List[str]) -> int | None:
+    wanted = _norm(settings.ROLLOVER_DATE_COLUMN)
+    for row in sheet_data:
+        if int(row.get("r")) != header_row:
+            continue
+        for j, c in enumerate(row):
+            value = _cell_value(c, sst)
+            if value is not None and _norm(str(value)) == wanted:
+                return _split_ref(c.get("r"))[1] if c.get("r") else j + 1
+    return None
+
+
+def _classify(sheet_data, data_start: int, date_col: int | None, cutoff: date | None, sst, epoch):
+    """(fichas que van al archivo, fichas que se quedan, filas de marco tras la última ficha, sin fecha)."""
+    archived: List[int] = []
+    kept: List[int] = []
+    undated = 0
+    literal = {int(r.get("r")) for r in sheet_data.xpath(f"m:row[{_LITERAL_CELL}]", namespaces={"m": NS_MAIN})}
+    last_data = max((r for r in literal if r >= data_start), default=data_start - 1)
+    template: List[int] = []
+    for row in sheet_data:
+        r = int(row.get("r"))
+        if r < data_start:
+            continue
+        if r not in literal:
+            if r > last_data:
+                template.append(r)
+            continue
+        if cutoff is None:
+            archived.append(r)
+            continue
+        when = None
+        for j, c in enumerate(row):
+            col = _split_ref(c.get("r"))[1] if c.get("r") else j + 1
+            if col == date_col:
+                when = cell_date(_cell_value(c, sst), epoch)
+                break
+        if when is None:
+            undated += 1
+            kept.append(r)
+        elif when < cutoff:
+            archived.append(r)
+        else:
+            kept.append(r)
+    return archived, kept, template, undated
+
+
+# ---------- reconstrucción de la hoja ----------
+
+def _translate(formula: str, origin: str, dest: str) -> str:
+    from openpyxl.formula.translate import Translator
+    return Translator("=" + formula, origin=origin).translate_formula(dest)[1:]
+
+
+def _expand_shared_formulas(root):
+    """Las fórmulas compartidas dependen de la celda maestra: se escriben completas en cada celda."""
+    masters = {}
+    for c in root.iter(_q("c")):
+        f = c.find(_q("f"))
+        if f is not None and f.get("t") == "shared" and f.get("ref") and f.text:
+            masters[f.get("si")] = (c.get("r"), f.text)
+    if not masters:
+        return
+    for c in root.iter(_q("c")):
+        f = c.find(_q("f"))
+        if f is None or f.get("t") != "shared" or f.get("si") not in masters:
+            continue
+        origin, text = masters[f.get("si")]
+        if not f.text:
+            f.text = _translate(text, origin, c.get("r"))
+        for attr in ("t", "si", "ref"):
+            f.attrib.pop(attr, None)
+
+
+def _shift_range(ref: str, delta: int) -> str:
+    rng = _parse_range(ref)
+    if rng is None:
+        return ref
+    c1, r1, c2, r2 = rng
+    return _fmt_range(c1, r1 + delta, c2, r2 + delta)
+
+
+def _move_row(row, old: int, new: int):
+    row.set("r", str(new))
+    for j, c in enumerate(row):
+        col = _split_ref(c.get("r"))[1] if c.get("r") else j + 1
+        origin, dest = f"{_col_letter(col)}{old}", f"{_col_letter(col)}{new}"
+        if c.get("r"):
+            c.set("r", dest)
+        f = c.find(_q("f"))
+        if f is not None:
+            if f.text:
+                f.text = _translate(f.text, origin, dest)
+            if f.get("ref"):  # fórmula matricial de una fila
+                f.set("ref", _shift_range(f.get("ref"), new - old))
+
+
+def _moved_range(ref: str, plan: Dict[int, int]) -> str | None:
+    """Rango de filas que se mueven juntas (celdas combinadas, hipervínculos); None si se parte."""
+    rng = _parse_range(ref)
+    if rng is None:
+        return None
+    c1, r1, c2, r2 = rng
+    if r1 not in plan or r2 not in plan or plan[r2] - plan[r1] != r2 - r1:
+        return None
+    return _fmt_range(c1, plan[r1], c2, plan[r2])
+
+
+def _remap_sqref(sqref: str, data_start: int, last_row: int) -> str:
+    """
+    Rangos de validaciones/formatos: los de la cabecera y los que llegan al final de la
+    hoja no cambian; los acotados a la zona de datos pasan a cubrir las filas que quedan.
+    """
+    out = []
+    for token in sqref.split():
+        rng = _parse_range(token)
+        if rng is None or rng[3] < data_start or rng[3] >= MAX_ROW:
+            out.append(token)
+            continue
+        c1, r1, c2, _r2 = rng
+        r1 = min(r1, data_start)
+        if last_row >= r1:
+            out.append(_fmt_range(c1, r1, c2, last_row))
+    return " ".join(out)
+
+
+def _rebuild_sheet(root, plan: Dict[int, int], data_start: int) -> int:
+    """
+    Deja en la hoja solo las filas de `plan` ({fila original: fila nueva}, en orden),
+    renumeradas, y ajusta los rangos que dependen de ellas. Devuelve la última fila.
+    """
+    _expand_shared_formulas(root)
+    sheet_data = root.find(_q("sheetData"))
+    _number_rows(sheet_data)
+    max_c = 1
+    for row in list(sheet_data):
+        old = int(row.get("r"))
+        if old not in plan:
+            sheet_data.remove(row)
+            continue
+        if plan[old] != old:
+            _move_row(row, old, plan[old])
+        if len(row) and row[-1].get("r"):
+            max_c = max(max_c, _split_ref(row[-1].get("r"))[1])
+    last_row = max(_last_row_present(root), data_start - 1)
+
+    for tag in ("mergeCells", "hyperlinks"):
+        parent = root.find(_q(tag))
+        if parent is None:
+            continue
+        for el in list(parent):
+            moved = _moved_range(el.get("ref", ""), plan)
+            if moved is None:
+                parent.remove(el)
+            else:
+                el.set("ref", moved)
+        if not len(parent):
+            root.remove(parent)
+        elif parent.get("count") is not None:
+            parent.set("count", str(len(parent)))
+
+    for tag in ("dataValidation", "conditionalFormatting"):
+        for el in list(root.iter(_q(tag))):
+            el.set("sqref", _remap_sqref(el.get("sqref", ""), data_start, last_row))
+            if not el.get("sqref"):
+                el.getparent().remove(el)
+    for sq in root.iter(_q("sqref", NS_XM)):
+        sq.text = _remap_sqref(sq.text or "", data_start, last_row)
+    dvs = root.find(_q("dataValidations"))
+    if dvs is not None:
+        if len(dvs):
+            dvs.set("count", str(len(dvs)))
+        else:
+            root.remove(dvs)
+
+    af = root.find(_q("autoFilter"))
+    if af is not None:
+        af.set("ref", _resized(af.get("ref", ""), last_row))
+    breaks = root.find(_q("rowBreaks"))
+    if breaks is not None:
+        root.remove(breaks)  # los saltos de página por fila ya no caen donde estaban
+    for view in root.iter(_q("sheetView")):
+        view.attrib.pop("topLeftCell", None)
+        for sel in view.iter(_q("selection")):
+            sel.set("activeCell", f"A{data_start}")
+            sel.set("sqref", f"A{data_start}")
+    dim = root.find(_q("dimension"))
+    if dim is not None:
+        dim.set("ref", _fmt_range(1, 1, max_c, max(1, last_row)))
+    return last_row
+
+
+def _resized(ref: str, last_row: int) -> str:
+    """Tabla/autofiltro (cabecera en r1): hasta last_row, con al menos una fila de datos."""
+    rng = _parse_range(ref)
+    if rng is None:
+        return ref
+    c1, r1, c2, _r2 = rng
+    return _fmt_range(c1, r1, c2, max(last_row, r1 + 1))
+
+
+# ---------- renombrado ----------
+
+def _sheet_ref(name: str) -> str:
+    return name if _PLAIN_SHEET_NAME.fullmatch(name) else "'" + name.replace("'", "''") + "'"
+
+
+def _retarget(text: str, old: str, new: str) -> str:
+    def sub(m):
+        name = m.group(1).replace("''", "'") if m.group(1) is not None else m.group(2)
+        return _sheet_ref(new) + "!" if name == old else m.group(0)
+    return _SHEET_REF_RE.sub(sub, text)
+
+
+def _retarget_formulas(root, old: str, new: str) -> int:
+    """Fórmulas (celdas, validaciones, gráficos) que apuntaban a `old`; sin el valor en caché."""
+    changed = 0
+    # se recogen antes: quitar el <v> de la celda durante root.iter() corta el recorrido
+    for el in list(root.iter(*(f"{{*}}{t}" for t in _FORMULA_TAGS))):
+        if not el.text:
+            continue
+        text = _retarget(el.text, old, new)
+        if text == el.text:
+            continue
+        el.text = text
+        changed += 1
+        parent = el.getparent()
+        if parent is not None and parent.tag == _q("c"):
+            v = parent.find(_q("v"))
+            if v is not None:
+                parent.remove(v)  # Excel lo recalcula al abrir (fullCalcOnLoad)
+    return changed
+
+
+# ---------- paquete ----------
+
+def _write_package(zf: zipfile.ZipFile, replaced: Dict[str, bytes | None]) -> bytes:
+    out = BytesIO()
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zout:
+        for info in zf.infolist():
+            data = replaced[info.filename] if info.filename in replaced else zf.read(info.filename)
+            if data is not None:
+                zout.writestr(info.filename, data)
+    return out.getvalue()
+
+
+def _build(zf: zipfile.ZipFile, data_part: str, plan: Dict[int, int], data_start: int,
+           rename: Tuple[str, str] | None, stats: Counter) -> bytes:
+    """Copia del paquete con la hoja de datos reducida a `plan` (y renombrada si `rename`)."""
+    names = set(zf.namelist())
+    replaced: Dict[str, bytes | None] = {}
+    sheet = _fromstring(zf.read(data_part))
+    last_row = _rebuild_sheet(sheet, plan, data_start)
+
+    rp = _rels_path(data_part)
+    for r in (_fromstring(zf.read(rp)) if rp in names else []):
+        tpart = _resolve(data_part.rsplit("/", 1)[0], r.get("Target"))
+        if r.get("Type", "").endswith("/table") and tpart in names:
+            tbl = _fromstring(zf.read(tpart))
+            tbl.set("ref", _resized(tbl.get("ref", ""), last_row))
+            af = tbl.find(_q("autoFilter"))
+            if af is not None:
+                af.set("ref", tbl.get("ref"))
+            replaced[tpart] = _tostring(tbl)
+
+    wb = _fromstring(zf.read(WORKBOOK_PART))
+    if rename:
+        old, new = rename
+        for s in wb.iter(_q("sheet")):
+            if s.get("name") == old:
+                s.set("name", new)
+        for dn in wb.iter(_q("definedName")):
+            if dn.text and _retarget(dn.text, old, new) != dn.text:
+                dn.text = _retarget(dn.text, old, new)
+                stats["defined_names_retargeted"] += 1
+        stats["formulas_retargeted"] += _retarget_formulas(sheet, old, new)
+        for part in names:
+            if part == data_part or not part.endswith(".xml"):
+                continue
+            if part.startswith(("xl/worksheets/", "xl/charts/")):
+                root = _fromstring(zf.read(part))
+                n = _retarget_formulas(root, old, new)
+                if n:
+                    stats["formulas_retargeted"] += n
+                    replaced[part] = _tostring(root)
+            elif part.startswith("xl/pivotCache/"):
+                root = _fromstring(zf.read(part))
+                sources = [ws for ws in root.iter(_q("worksheetSource")) if ws.get("sheet") == old]
+                for ws in sources:
+                    ws.set("sheet", new)
+                if sources:
+                    replaced[part] = _tostring(root)
+        if "docProps/app.xml" in names:
+            app = _fromstring(zf.read("docProps/app.xml"))
+            for el in app.iter("{*}lpstr"):
+                if el.text == old:
+                    el.text = new
+            replaced["docProps/app.xml"] = _tostring(app)
+    # las filas han cambiado de sitio: Excel recalcula al abrir y la calcChain se descarta
+    calc = wb.find(_q("calcPr"))
+    if calc is None:
+        calc = wb.makeelement(_q("calcPr"), {})
+        wb.append(calc)
+    calc.set("fullCalcOnLoad", "1")
+    replaced[WORKBOOK_PART] = _tostring(wb)
+    if "xl/calcChain.xml" in names:
+        replaced.update(_drop_calc_chain(zf))
+        replaced["xl/calcChain.xml"] = None
+    replaced[data_part] = _tostring(sheet)
+    return _write_package(zf, replaced)
+
+
+def rollover(
+    excel_bytes: bytes,
+    new_sheet: str | None = None,
+    cutoff: date | None = None,
+    spare_rows: int | None = None,
+    verify: bool = True,
+) -> Tuple[bytes, bytes, Dict[str, Any]]:
+    """
+    Devuelve (libro activo, libro de archivo, informe). `new_sheet` renombra la hoja de
+    datos (cambio de año); `cutoff` archiva solo las fichas con fecha anterior. Bajo las
+    fichas que se quedan se conservan `spare_rows` filas de marco (por defecto
+    WORKBOOK_COMPACT_SPARE_ROWS).
+    """
+    if new_sheet is None and cutoff is None:
+        raise RolloverError("Hace falta la hoja del año nuevo o una fecha de corte")
+    spare = settings.WORKBOOK_COMPACT_SPARE_ROWS if spare_rows is None else max(0, spare_rows)
+    header_row = settings.MASTER_HEADER_ROW
+    data_start = header_row + 1
+    stats: Counter = Counter()
+    with zipfile.ZipFile(BytesIO(excel_bytes)) as zf:
+        parts = dict(_sheet_parts(zf))
+        old = resolve_data_sheet(excel_bytes)
+        if old not in parts:
+            raise RolloverError(f"El libro no tiene la hoja de datos '{old}'")
+        rename = (old, new_sheet) if new_sheet and new_sheet != old else None
+        if rename and new_sheet in parts:
+            raise RolloverError(f"La hoja '{new_sheet}' ya existe en el libro")
+
+        from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900
+        pr = _fromstring(zf.read(WORKBOOK_PART)).find(_q("workbookPr"))
+        epoch = CALENDAR_MAC_1904 if pr is not None and pr.get("date1904") in ("1", "true") else CALENDAR_WINDOWS_1900
+        sst = _shared_strings(zf)
+        sheet_data = _fromstring(zf.read(parts[old])).find(_q("sheetData"))
+        _number_rows(sheet_data)
+        date_col = _date_column(sheet_data, header_row, sst)
+        if cutoff is not None and date_col is None:
+            raise RolloverError(f"La hoja '{old}' no tiene la columna {settings.ROLLOVER_DATE_COLUMN}")
+        archived, kept, template, undated = _classify(sheet_data, data_start, date_col, cutoff, sst, epoch)
+        if not archived and not rename:
+            raise RolloverError(f"Ninguna ficha con {settings.ROLLOVER_DATE_COLUMN} anterior a {cutoff}")
+
+        headers = {r: r for r in range(1, data_start)}
+        plan_active = dict(headers)
+        for r in kept + template[:spare]:
+            plan_active[r] = data_start + len(plan_active) - len(headers)
+        plan_archive = dict(headers)
+        for r in archived:
+            plan_archive[r] = data_start + len(plan_archive) - len(headers)
+
+        active = _build(zf, parts[old], plan_active, data_start, rename, stats)
+        archive = _build(zf, parts[old], plan_archive, data_start, None, Counter())
+
+    new_name = rename[1] if rename else old
+    if verify:
+        _verify(excel_bytes, active, archive, old, new_name, data_start)
+    report: Dict[str, Any] = {
+        "sheet_from": old,
+        "sheet_to": new_name,
+        "cutoff": cutoff.isoformat() if cutoff else None,
+        "archived": len(archived),
+        "kept": len(kept),
+        "undated_kept": undated,
+        "spare_rows": min(spare, len(template)),
+        "size_before": len(excel_bytes),
+        "size_after": len(active),
+        "archive_size": len(archive),
+        **{k: v for k, v in sorted(stats.items()) if v},
+    }
+    logger.info("Cambio de año %s -> %s: %d fichas archivadas, %d se quedan", old, new_name, len(archived), len(kept))
+    return active, archive, report
+
+
+# ---------- comprobación ----------
+
+def _data_rows(excel_bytes: bytes, sheet: str, data_start: int) -> Tuple[List[tuple], Counter]:
+    """(filas de cabecera, fichas) con los valores escritos; las fórmulas cuentan como vacías."""
+    from app.services.workbook_loader import load_sheets
+    wb = load_sheets(excel_bytes, [sheet], read_only=True)
+    try:
+        headers, rows = [], Counter()
+        for r, values in enumerate(wb[sheet].iter_rows(values_only=True), start=1):
+            literal = tuple(None if isinstance(v, str) and v.startswith("=") or v == "" else v for v in values)
+            while literal and literal[-1] is None:
+                literal = literal[:-1]
+            if r < data_start:
+                headers.append(literal)
+            elif literal:
+                rows[literal] += 1
+    finally:
+        wb.close()
+    return headers, rows
+
+
+def _verify(before: bytes, active: bytes, archive: bytes, old: str, new: str, data_start: int):
+    from app.services.enums_loader import load_enums_from_bytes
+    h0, rows0 = _data_rows(before, old, data_start)
+    h1, rows1 = _data_rows(active, new, data_start)
+    h2, rows2 = _data_rows(archive, old, data_start)
+    if not (h0 == h1 == h2):
+        raise RolloverError("Las cabeceras no coinciden tras el cambio de año")
+    if rows0 != rows1 + rows2:
+        lost = sum((rows0 - (rows1 + rows2)).values()) + sum(((rows1 + rows2) - rows0).values())
+        raise RolloverError(f"{lost} fichas no cuadran entre el libro activo y el archivo")
+    # validaciones de lista y TABLES: los enums del libro activo y del archivo son los de antes
+    header_row = data_start - 1
+    enums = load_enums_from_bytes(before, data_sheet=old, header_row=header_row)
+    if load_enums_from_bytes(active, data_sheet=new, header_row=header_row) != enums:
+        raise RolloverError("Los enums (validaciones/tablas) del libro activo cambian tras el cambio de año")
+    if load_enums_from_bytes(archive, data_sheet=old, header_row=header_row) != enums:
+        raise RolloverError("Los enums (validaciones/tablas) del archivo cambian tras el cambio de año")
+
+
+def rollover_with_report(
+    excel_bytes: bytes,
+    new_sheet: str | None = None,
+    cutoff: date | None = None,
+    spare_rows: int | None = None,
+    repeat: int = 3,
+) -> Tuple[bytes, bytes, Dict[str, Any]]:
+    """rollover() + tiempo de parseo del libro activo antes/después en el informe."""
+    from app.services.compactor import parse_ms
+    active, archive, report = rollover(excel_bytes, new_sheet, cutoff, spare_rows)
+    report["parse_ms_before"] = parse_ms(excel_bytes, repeat)
+    report["parse_ms_after"] = parse_ms(active, repeat)
+    return active, archive, report
+
+
+def refresh_caches(master_path: str) -> Dict[str, Any]:
+    """
+    Tras reescribir el maestro: réplica SQLite de /fichas al día. Los enums del libro
+    nuevo ya quedaron en la caché compartida al comprobarlo; las demás cachés van por
+    hash de contenido, así que ningún worker puede servir datos del libro anterior.
+    """
+    from app.services import fichas_db
+    return fichas_db.refresh(master_path, force=True)
@@ -0,0 +1,290 @@
+# app/services/sessions.py
+"""
+Sesiones de edición con materialización diferida.
+
+Una sesión guarda el Excel original (base.xlsx) y un log de cambios compacto
+(deltas.jsonl, una línea por paso: filas añadidas por write_auto_fields o
+celdas cambiadas por update_row_in_excel). Los pasos intermedios no serializan
+el libro: trabajan sobre la hoja ya parseada en memoria y añaden una línea al log.
+El xlsx solo se genera al descargar, aplicando todos los cambios de una vez
+sobre el original.
+
+Si la petición cae en otro worker, la hoja se reconstruye desde base.xlsx
+reproduciendo el log. Los pasos de una sesión se serializan entre hilos y entre
+workers (flock sobre <sesión>/.lock), así que el log nunca se intercala.
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import date, datetime
+from tempfile import SpooledTemporaryFile
+from typing import Any, Dict, Iterator, List, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo el lock del proceso
+    fcntl = None
+
+from app.config import settings
+from app.schema.enums import from_excel_bytes
+from app.services.docx_reader import extract_fields_from_docx
+from app.services.excel_writer import (
+    apply_auto_fields, apply_row_updates, revert_edits, save_edits,
+)
+from app.services.transformer import suggest_tematicas, transform_from_docx
+from app.services.workbook_loader import load_sheets, resolve_data_sheet
+from app.utils.hashing import content_hash
+
+logger = logging.getLogger(__name__)
+
+
+class SessionNotFound(Exception):
+    pass
+
+
+# session_id -> {"wb", "applied" (nº de deltas aplicados), "enums"}
+_parsed: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_locks: Dict[str, threading.Lock] = {}
+_global_lock = threading.Lock()
+
+
+def _dir(session_id: str) -> str:
+    if not session_id.isalnum():
+        raise SessionNotFound(session_id)
+    return os.path.join(settings.SESSIONS_DIR, session_id)
+
+
+def _lock(session_id: str) -> threading.Lock:
+    with _global_lock:
+        return _locks.setdefault(session_id, threading.Lock())
+
+
+@contextmanager
+def _locked(session_id: str) -> Iterator[None]:
+    """Lock de la sesión entre hilos y entre workers (flock, se suelta al cerrar el fd)."""
+    with _lock(session_id):
+        if fcntl is None:
+            yield
+            return
+        try:
+            fd = os.open(os.path.join(_dir(session_id), ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        except FileNotFoundError:
+            raise SessionNotFound(session_id)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+
+def _encode(v):
+    if isinstance(v, datetime):
+        return {"__datetime__": v.isoformat()}
+    if isinstance(v, date):
+        return {"__date__": v.isoformat()}
+    return v
+
+
+def _decode(v):
+    if isinstance(v, dict):
+        if "__datetime__" in v:
+            return datetime.fromisoformat(v["__datetime__"])
+        if "__date__" in v:
+            return date.fromisoformat(v["__date__"])
+    return v
+
+
+def _read_meta(session_id: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(_dir(session_id), "meta.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except OSError:
+        raise SessionNotFound(session_id)
+
+
+def _read_deltas(session_id: str) -> List[Dict[str, Any]]:
+    path = os.path.join(_dir(session_id), "deltas.jsonl")
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _base_bytes(session_id: str) -> bytes:
+    with open(os.path.join(_dir(session_id), "base.xlsx"), "rb") as f:
+        return f.read()
+
+
+def _replay(ws, deltas: List[Dict[str, Any]]):
+    # se decodifica todo antes de tocar la hoja: un paso ilegible no la deja a medias
+    cells = [(r, c, _decode(v)) for d in deltas for r, c, v in d["cells"]]
+    for r, c, v in cells:
+        ws.cell(row=r, column=c).value = v
+
+
+def _state(session_id: str, meta: Dict[str, Any]) -> Dict[str, Any]:
+    """Hoja de la sesión en memoria con todos los deltas aplicados (llamar con `_locked`)."""
+    deltas = _read_deltas(session_id)
+    with _global_lock:
+        st = _parsed.get(session_id)
+        if st is not None:
+            _parsed.move_to_end(session_id)
+    if st is None:
+        base = _base_bytes(session_id)
+        st = {"wb": load_sheets(base, [meta["sheet"]]), "applied": 0, "enums": from_excel_bytes(base)}
+        _replay(st["wb"][meta["sheet"]], deltas)  # se cachea solo si se aplicaron todos los pasos
+        st["applied"] = len(deltas)
+        with _global_lock:
+            _parsed[session_id] = st
+            while len(_parsed) > max(1, settings.SESSIONS_PARSED_MAX):
+                _parsed.popitem(last=False)
+    elif st["applied"] < len(deltas):
+        try:
+            _replay(st["wb"][meta["sheet"]], deltas[st["applied"]:])
+        except Exception:
+            # hoja a medias respecto al log: fuera de la caché, la próxima vez se reconstruye
+            with _global_lock:
+                _parsed.pop(session_id, None)
+            raise
+        st["applied"] = len(deltas)
+    return st
+
+
+def _append_delta(session_id: str, st: Dict[str, Any], op: str, applied: Dict[str, Any]) -> int:
+    """Añade el paso al log (con `_locked`); la hoja de `st` ya lo tiene aplicado."""
+    line = {
+        "op": op,
+        "row": applied["row"],
+        "cells": [[r, c, _encode(v)] for (r, c), v in sorted(applied["edits"].items())],
+        "ts": time.time(),
+    }
+    with open(os.path.join(_dir(session_id), "deltas.jsonl"), "a", encoding="utf-8") as f:
+        f.write(json.dumps(line, ensure_ascii=False) + "\n")
+    # se relee el log: lo que cuenta es su longitud, no lo que este worker crea haber aplicado
+    st["applied"] = len(_read_deltas(session_id))
+    return st["applied"]
+
+
+def _summary(meta: Dict[str, Any], applied: Dict[str, Any], deltas: int) -> Dict[str, Any]:
+    return {
+        "sheet": meta["sheet"],
+        "row": applied["row"] - 1,  # base-0
+        "mode": applied["mode"],
+        "changed": applied["changed"],
+        "cells": len(applied["edits"]),
+        "deltas": deltas,
+    }
+
+
+# ------------------------
+# API pública
+# ------------------------
+
+def create_session(excel_bytes: bytes, sheet: str | None = None) -> Dict[str, Any]:
+    cleanup_expired()
+    sheet = sheet or resolve_data_sheet(excel_bytes)
+    session_id = uuid.uuid4().hex
+    folder = _dir(session_id)
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, "base.xlsx"), "wb") as f:
+        f.write(excel_bytes)
+    meta = {
+        "session_id": session_id,
+        "sheet": sheet,
+        "base_hash": content_hash(excel_bytes),
+        "created_at": time.time(),
+    }
+    with open(os.path.join(folder, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    return meta
+
+
+def get_session(session_id: str) -> Dict[str, Any]:
+    meta = _read_meta(session_id)
+    deltas = _read_deltas(session_id)
+    last_row = deltas[-1]["row"] - 1 if deltas else None  # base-0
+    return {**meta, "deltas": len(deltas), "last_row": last_row}
+
+
+def run_docx(session_id: str, docx_bytes: bytes, record: bool = True) -> Dict[str, Any]:
+    """
+    extract -> transform -> write sobre la hoja de la sesión. Con record=False (preview)
+    los cambios se deshacen y no se registran.
+    """
+    meta = _read_meta(session_id)
+    with _locked(session_id):
+        st = _state(session_id, meta)
+        fields = extract_fields_from_docx(docx_bytes)
+        tematicas = suggest_tematicas(fields, st["enums"])
+        auto_fields = transform_from_docx(fields, st["enums"], tematicas)
+        ws = st["wb"][meta["sheet"]]
+        applied = apply_auto_fields(ws, auto_fields)
+        if record:
+            n = _append_delta(session_id, st, applied["mode"], applied)
+        else:
+            revert_edits(ws, applied)
+            n = st["applied"]
+    return {
+        **_summary(meta, applied, n),
+        "detected_fields": fields,
+        "tematicas": tematicas,
+        "auto_fields": auto_fields,
+    }
+
+
+def update_row(session_id: str, row_index_base0: int, updates: Dict[str, Any]) -> Dict[str, Any]:
+    meta = _read_meta(session_id)
+    with _locked(session_id):
+        st = _state(session_id, meta)
+        applied = apply_row_updates(st["wb"][meta["sheet"]], row_index_base0 + 1, updates)
+        n = _append_delta(session_id, st, "update", applied)
+    return _summary(meta, applied, n)
+
+
+def materialize(session_id: str) -> Tuple[SpooledTemporaryFile, int]:
+    """Genera el xlsx final: todos los deltas (el último gana) en una sola escritura sobre el original."""
+    meta = _read_meta(session_id)
+    with _locked(session_id):  # el log completo, sin un paso a medio escribir
+        deltas = _read_deltas(session_id)
+    edits: Dict[Tuple[int, int], Any] = {}
+    for d in deltas:
+        for r, c, v in d["cells"]:
+            edits[(r, c)] = _decode(v)
+    return save_edits(_base_bytes(session_id), meta["sheet"], edits)
+
+
+def delete_session(session_id: str):
+    folder = _dir(session_id)
+    if not os.path.isdir(folder):
+        raise SessionNotFound(session_id)
+    with _global_lock:
+        _parsed.pop(session_id, None)
+        _locks.pop(session_id, None)
+    shutil.rmtree(folder, ignore_errors=True)
+
+
+def cleanup_expired(now: float | None = None) -> int:
+    """Borra sesiones sin actividad (mtime de la carpeta/log) durante SESSIONS_TTL_SECONDS."""
+    now = now or time.time()
+    if not os.path.isdir(settings.SESSIONS_DIR):
+        return 0
+    removed = 0
+    for session_id in os.listdir(settings.SESSIONS_DIR):
+        folder = os.path.join(settings.SESSIONS_DIR, session_id)
+        try:
+            last = max(os.path.getmtime(os.path.join(folder, fn)) for fn in os.listdir(folder))
+        except (OSError, ValueError):
+            continue
+        if now - last > settings.SESSIONS_TTL_SECONDS:
+            with _global_lock:
+                _parsed.pop(session_id, None)
+                _locks.pop(session_id, None)
+            shutil.rmtree(folder, ignore_errors=True)
+            removed += 1
+    return removed
@@ -0,0 +1,240 @@
+# app/services/tematicas.py
+"""
+"Tipo de ayuda" (texto libre de la ficha) -> TEMÁTICAS del enum.
+
+Índice invertido por token sobre las temáticas: tokens sin tildes, en minúsculas,
+sin palabras vacías y con un stemming ligero de sufijos en español, más una tabla
+de sinónimos (DEFAULT_SYNONYMS + TEMATICAS_SYNONYMS_PATH) que apunta tokens o
+frases a temáticas concretas. El índice se construye una vez por lista de temáticas
+y puntuar una ficha es buscar unos pocos tokens en un dict.
+
+La puntuación es el coseno entre los tokens de la consulta y los de la temática,
+ponderados por idf (un token que aparece en muchas temáticas pesa menos); una
+coincidencia literal vale 1.0.
+"""
+import json
+import logging
+import math
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Tuple
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+_STOPWORDS = {
+    "a", "al", "con", "de", "del", "e", "el", "en", "la", "las", "lo", "los", "o", "para",
+    "por", "u", "un", "una", "y", "sus", "su",
+    # genéricas en las fichas: no ayudan a distinguir temáticas
+    "ayuda", "ayudas", "subvencion", "subvenciones", "prestacion", "prestaciones",
+    "programa", "convocatoria", "linea", "lineas", "otras", "otros",
+}
+
+# de más largo a más corto (tras quitar el plural); el tronco queda con al menos 4 letras
+_SUFFIXES = (
+    "amiento", "imiento", "acion", "idad", "cion", "ismo", "ista",
+    "ivo", "iva", "ico", "ica", "al", "a", "o", "e",
+)
+
+# token o frase (se normaliza igual que las temáticas) -> temática(s)
+DEFAULT_SYNONYMS: Dict[str, List[str]] = {
+    "empleo": ["Trabajo - Emprendimiento"],
+    "trabajo": ["Trabajo - Emprendimiento"],
+    "contratacion": ["Trabajo - Emprendimiento"],
+    "autonomos": ["Trabajo - Emprendimiento"],
+    "empresa": ["Trabajo - Emprendimiento"],
+    "formacion": ["Estudios"],
+    "educacion": ["Estudios"],
+    "becas": ["Estudios"],
+    "universidad": ["Estudios"],
+    "escolar": ["Estudios"],
+    "alquiler": ["Vivienda"],
+    "rehabilitacion": ["Vivienda"],
+    "hogar": ["Vivienda"],
+    "eficiencia energetica": ["Energía"],
+    "energetica": ["Energía"],
+    "renovables": ["Energía"],
+    "autoconsumo": ["Energía"],
+    "electricidad": ["Energía"],
+    "bono social": ["Energía"],
+    "sanidad": ["Salud"],
+    "sanitaria": ["Salud"],
+    "medicamentos": ["Salud"],
+    "ocio": ["Cultura - Ocio"],
+    "deporte": ["Cultura - Ocio"],
+    "vacaciones": ["Viajes"],
+    "turismo": ["Viajes"],
+    "movilidad": ["Transporte"],
+    "vehiculo": ["Transporte"],
+    "digital": ["Tecnología"],
+    "digitalizacion": ["Tecnología"],
+    "internet": ["Tecnología"],
+    "nacimiento": ["Natalidad"],
+    "maternidad": ["Natalidad"],
+    "paternidad": ["Natalidad"],
+    "hijos": ["Familia"],
+    "crianza": ["Familia"],
+    "impuestos": ["Bonificación impuestos"],
+    "fiscal": ["Bonificación impuestos"],
+    "deducciones": ["Bonificación impuestos"],
+    "irpf": ["Bonificación impuestos"],
+    "ingreso minimo": ["Ingreso Mínimo Vital"],
+    "imv": ["Ingreso Mínimo Vital"],
+    "renta": ["Rentas"],
+    "pension": ["Rentas"],
+    "violencia machista": ["Violencia de Género"],
+    "mujeres victimas": ["Violencia de Género"],
+    "comedor": ["Alimentación"],
+    "alimentos": ["Alimentación"],
+    "cuidados": ["Dependencia"],
+    "cuidador": ["Dependencia"],
+    "balneario": ["Termalismo"],
+    "emergencia": ["Catástrofes"],
+    "dana": ["Catástrofes"],
+    "inundaciones": ["Catástrofes"],
+    "adaptacion vivienda": ["Accesibilidad"],
+    "barreras": ["Accesibilidad"],
+    "acogida": ["Acogimiento"],
+    "permiso conducir": ["Carnet de conducir"],
+}
+
+_CONJUNCTIONS = re.compile(r"\s+(?:y|e|o|u)\s+|[/;+]", re.IGNORECASE)
+
+# peso de un token que solo llega por sinónimo (frente a 1.0 de un token propio)
+SYNONYM_WEIGHT = 0.9
+
+
+def fold(s: str) -> str:
+    """Minúsculas y sin tildes (la ñ también se pliega: n)."""
+    s = unicodedata.normalize("NFD", s or "")
+    return "".join(c for c in s if unicodedata.category(c) != "Mn").lower()
+
+
+def _strip_suffix(token: str, suffixes: Iterable[str]) -> str:
+    for suf in suffixes:
+        if token.endswith(suf) and len(token) - len(suf) >= 4:
+            return token[: -len(suf)]
+    return token
+
+
+def stem(token: str) -> str:
+    """Stemming ligero: plural y un sufijo (vivienda/viviendas -> viviend, formación -> form)."""
+    return _strip_suffix(_strip_suffix(token, ("es", "s")), _SUFFIXES)
+
+
+def tokens(text: str) -> List[str]:
+    """Tokens normalizados (sin tildes, sin palabras vacías, con stemming), sin repetir."""
+    out: List[str] = []
+    for t in re.findall(r"\w+", fold(text)):
+        if t in _STOPWORDS or t.isdigit():
+            continue
+        s = stem(t)
+        if s not in out:
+            out.append(s)
+    return out
+
+
+def _load_synonyms() -> Dict[str, List[str]]:
+    syn = {k: list(v) for k, v in DEFAULT_SYNONYMS.items()}
+    path = settings.TEMATICAS_SYNONYMS_PATH
+    if not path:
+        return syn
+    try:
+        with open(path, encoding="utf-8") as f:
+            extra = json.load(f)
+    except (OSError, ValueError):
+        logger.warning("No se pudo leer la tabla de sinónimos %s", path, exc_info=True)
+        return syn
+    for k, v in extra.items():
+        syn[k] = [v] if isinstance(v, str) else list(v)
+    return syn
+
+
+class TematicasIndex:
+    """Índice invertido token -> {temática: peso}, con los pesos ya ponderados por idf."""
+
+    def __init__(self, tematicas: Iterable[str], synonyms: Dict[str, List[str]]):
+        self.tematicas = list(dict.fromkeys(t for t in tematicas if t))
+        self.by_fold = {fold(t).strip(): t for t in self.tematicas}
+        raw: Dict[str, Dict[str, float]] = defaultdict(dict)   # token -> {temática: peso}
+        own: Dict[str, List[str]] = {}                          # temática -> sus propios tokens
+        for t in self.tematicas:
+            own[t] = tokens(t)
+            for tok in own[t]:
+                raw[tok][t] = 1.0
+        for phrase, targets in synonyms.items():
+            # una frase ("eficiencia energetica") es un único término: sus tokens unidos
+            term = " ".join(tokens(phrase))
+            for t in targets:
+                if term and t in own:  # se ignoran sinónimos hacia temáticas que no están en este enum
+                    raw[term].setdefault(t, SYNONYM_WEIGHT)
+        n = max(1, len(self.tematicas))
+        self.postings: Dict[str, Dict[str, float]] = {
+            tok: {t: w * math.log(1 + n / len(per_tema)) for t, w in per_tema.items()}
+            for tok, per_tema in raw.items()
+        }
+        # la "longitud" de una temática la dan solo sus propios tokens (no los sinónimos)
+        self.norms = {
+            t: math.sqrt(sum(self.postings[tok][t] ** 2 for tok in toks)) or 1.0
+            for t, toks in own.items()
+        }
+
+    def score(self, text: str) -> List[Tuple[str, float, List[str]]]:
+        """[(temática, puntuación 0..1, tokens que coinciden)] de mayor a menor."""
+        exact = self.by_fold.get(fold(text).strip())
+        if exact:
+            return [(exact, 1.0, tokens(text))]
+        toks = tokens(text)
+        # términos de la consulta: tokens y pares de tokens consecutivos (frases de sinónimos)
+        q = [t for t in toks + [f"{a} {b}" for a, b in zip(toks, toks[1:])] if t in self.postings]
+        if not q:
+            return []
+        acc: Dict[str, float] = defaultdict(float)
+        hits: Dict[str, List[str]] = defaultdict(list)
+        q_norm = 0.0
+        for tok in q:
+            posting = self.postings[tok]
+            q_w = max(posting.values())
+            q_norm += q_w * q_w
+            for t, w in posting.items():
+                acc[t] += q_w * w
+                hits[t].append(tok)
+        q_norm = math.sqrt(q_norm) or 1.0
+        scored = [(t, min(1.0, s / (q_norm * self.norms.get(t, 1.0))), hits[t]) for t, s in acc.items()]
+        scored.sort(key=lambda x: (-x[1], x[0]))
+        return scored
+
+
+_indexes: Dict[Tuple[str, ...], TematicasIndex] = {}
+
+
+def get_index(tematicas: List[str]) -> TematicasIndex:
+    """Índice para esta lista de temáticas (se construye una vez por lista)."""
+    key = tuple(tematicas)
+    idx = _indexes.get(key)
+    if idx is None:
+        if len(_indexes) >= 8:
+            _indexes.pop(next(iter(_indexes)))
+        idx = _indexes[key] = TematicasIndex(tematicas, _load_synonyms())
+    return idx
+
+
+def suggest(values: List[str], tematicas: List[str], top: int = 3) -> List[Dict[str, Any]]:
+    """
+    Mejores `top` temáticas para los valores de "Tipo de ayuda" (se queda con la mejor
+    puntuación de cada temática entre todos los valores).
+    """
+    if not values or not tematicas:
+        return []
+    idx = get_index(tematicas)
+    best: Dict[str, Dict[str, Any]] = {}
+    for v in values:
+        # "Empleo y formación" son dos temas: se puntúa el valor entero y cada parte
+        parts = [v] + [p for p in _CONJUNCTIONS.split(v) if p.strip() and p != v]
+        for part in parts:
+            for t, s, matched in idx.score(part):
+                if t not in best or s > best[t]["score"]:
+                    best[t] = {"tematica": t, "score": round(s, 3), "source": v, "matched": matched}
+    return sorted(best.values(), key=lambda c: (-c["score"], c["tematica"]))[:top]
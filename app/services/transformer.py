@@ -2,6 +2,9 @@ from typing import Dict, Any, List, Tuple
 import re
 import unicodedata
 
+from app.config import settings
+from app.services import tematicas as tematicas_index
+
 # ==== Normalización / helpers ====
 
 def _strip_accents(s: str) -> str:
@@ -113,10 +116,19 @@ def tramites_electronicos_flag(lugar_y_forma: str | None) -> str:
         return "Sí"
     return "No"
 
-def transform_from_docx(docx_fields: Dict[str, Any], enums: Dict[str, List[str]]) -> Dict[str, Any]:
+def suggest_tematicas(docx_fields: Dict[str, Any], enums: Dict[str, List[str]]) -> List[Dict[str, Any]]:
+    """Top 3 TEMÁTICAS para el "Tipo de ayuda" de la ficha: [{tematica, score, source, matched}]."""
+    return tematicas_index.suggest(coerce_list(docx_fields.get("Tipo de ayuda")), enums.get("TEMATICAS", []))
+
+def transform_from_docx(
+    docx_fields: Dict[str, Any],
+    enums: Dict[str, List[str]],
+    tematicas: List[Dict[str, Any]] | None = None,
+) -> Dict[str, Any]:
     """
     Recibe los campos ya extraídos del DOCX (dict) y devuelve auto_fields (dict)
     listo para escribir en la fila nueva del Excel (el resto queda vacío para edición manual).
+    `tematicas`: sugerencias ya calculadas con suggest_tematicas (si no, se calculan aquí).
     """
     out: Dict[str, Any] = {}
 
@@ -134,7 +146,8 @@ def transform_from_docx(docx_fields: Dict[str, Any], enums: Dict[str, List[str]]
     for col in PORTAL_COLUMNS:
         out[col] = col if col.lower() in [p.lower() for p in portals if p.lower() in allowed] else ""
 
-    # Temáticas desde "Tipo de ayuda" (máx 3, validar contra enum)
+    # Temáticas desde "Tipo de ayuda" (máx 3, validar contra enum): primero las exactas,
+    # en el orden de la ficha, y después las sugerencias del índice con score suficiente
     tipo_vals = coerce_list(docx_fields.get("Tipo de ayuda"))
     valid_temas = []
     allowed_temas = {t.lower(): t for t in enums.get("TEMATICAS", [])}
@@ -144,6 +157,13 @@ def transform_from_docx(docx_fields: Dict[str, Any], enums: Dict[str, List[str]]
             valid_temas.append(allowed_temas[key])
         if len(valid_temas) == 3:
             break
+    if tematicas is None:
+        tematicas = suggest_tematicas(docx_fields, enums)
+    for cand in tematicas:
+        if len(valid_temas) == 3:
+            break
+        if cand["score"] >= settings.TEMATICAS_MIN_SCORE and cand["tematica"] not in valid_temas:
+            valid_temas.append(cand["tematica"])
     for i, col in enumerate(TEMATICA_COLS):
         out[col] = valid_temas[i] if i < len(valid_temas) else ""
 
@@ -0,0 +1,91 @@
+# app/services/vencimientos.py
+"""
+Índice ordenado de VENCIMIENTO por libro.
+
+Para cada hash de Excel se guarda una lista de (fecha ISO, fila, nombre) ordenada
+por fecha; las consultas por rango ("qué vence en los próximos N días") son dos
+búsquedas binarias sobre esa lista. El índice se cachea en memoria del proceso y
+en la caché de disco compartida entre workers.
+"""
+import logging
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Dict, List, Tuple
+
+from app.services.excel_writer import DATA_START_ROW, _headers_index, _norm
+from app.services.workbook_loader import load_sheets
+from app.utils import disk_cache
+from app.utils.dates import cell_date
+from app.utils.hashing import content_hash
+
+logger = logging.getLogger(__name__)
+
+INDEX_CACHE_SIZE = 8
+INDEX_VERSION = 2  # entra en la clave de la caché en disco: subir si cambia cómo se construye
+
+# (fecha ISO, fila base-1, nombre de la ficha), ordenado
+Index = List[Tuple[str, int, str]]
+
+_cache: "OrderedDict[Tuple[str, str], Index]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def _build(excel_bytes: bytes, sheet: str) -> Index:
+    wb = load_sheets(excel_bytes, [sheet], read_only=True, data_only=True)
+    try:
+        ws = wb[sheet]
+        headers = _headers_index(ws)
+        c_venc, c_name = headers.get(_norm("VENCIMIENTO")), headers.get(_norm("NOMBRE DE FICHA"))
+        if not c_venc:
+            return []
+        cols = [c for c in (c_venc, c_name) if c]
+        lo, hi = min(cols), max(cols)
+        out: Index = []
+        rows = ws.iter_rows(min_row=DATA_START_ROW, min_col=lo, max_col=hi, values_only=True)
+        for r, values in enumerate(rows, start=DATA_START_ROW):
+            d = cell_date(values[c_venc - lo], wb.epoch)  # texto, fecha o número de serie
+            if d:
+                name = values[c_name - lo] if c_name else None
+                out.append((d.isoformat(), r, str(name or "").strip()))
+        out.sort()
+        return out
+    finally:
+        wb.close()
+
+
+def get_index(excel_bytes: bytes, sheet: str) -> Index:
+    workbook_hash = content_hash(excel_bytes)
+    key = (workbook_hash, sheet)
+    with _lock:
+        idx = _cache.get(key)
+        if idx is not None:
+            _cache.move_to_end(key)
+            return idx
+    disk_key = content_hash(f"{workbook_hash}|{sheet}|{INDEX_VERSION}".encode())
+    idx = disk_cache.get("vencimientos", disk_key)
+    if idx is None:
+        idx = _build(excel_bytes, sheet)
+        disk_cache.put("vencimientos", disk_key, idx)
+        logger.info("Índice de vencimientos construido: %d fichas con fecha", len(idx))
+    with _lock:
+        _cache[key] = idx
+        while len(_cache) > INDEX_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return idx
+
+
+def between(index: Index, desde: date | None, hasta: date | None) -> Index:
+    """Entradas con desde <= fecha <= hasta (extremos opcionales)."""
+    lo = bisect_left(index, (desde.isoformat(),)) if desde else 0
+    # (fecha, inf) ordena detrás de todas las filas de esa fecha
+    hi = bisect_right(index, (hasta.isoformat(), float("inf"))) if hasta else len(index)
+    return index[lo:hi]
+
+
+def query(excel_bytes: bytes, sheet: str, desde: date | None, hasta: date | None) -> List[Dict[str, Any]]:
+    return [
+        {"vencimiento": d, "row": r - 1, "nombre": name}  # row base-0
+        for d, r, name in between(get_index(excel_bytes, sheet), desde, hasta)
+    ]
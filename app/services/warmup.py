@@ -0,0 +1,61 @@
+# app/services/warmup.py
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+_ready = threading.Event()
+_state: Dict[str, Any] = {"started": False, "duration_ms": None, "error": None}
+_lock = threading.Lock()
+
+
+def warm_up() -> None:
+    """
+    Carga las librerías pesadas (openpyxl, python-docx/lxml) y, si está activado,
+    recorre una vez el Excel maestro para dejar calientes los caminos de código.
+    Al terminar marca el servicio como listo (ver `is_ready`).
+    """
+    with _lock:
+        if _state["started"]:
+            return
+        _state["started"] = True
+
+    t0 = time.perf_counter()
+    try:
+        import openpyxl  # noqa: F401
+        import docx  # noqa: F401
+        from app.services import docx_reader, excel_writer, transformer  # noqa: F401
+
+        if settings.WARMUP_PARSE_MASTER and os.path.exists(settings.MASTER_EXCEL_PATH):
+            from app.services.enums_loader import load_enums_from_bytes
+            with open(settings.MASTER_EXCEL_PATH, "rb") as f:
+                load_enums_from_bytes(f.read(), header_row=settings.MASTER_HEADER_ROW)
+            from app.services import fichas_db
+            fichas_db.refresh()
+    except Exception as e:  # el maestro puede faltar o estar corrupto: no bloquea el arranque
+        logger.exception("Warm-up con errores")
+        _state["error"] = str(e)
+    finally:
+        _state["duration_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        logger.info("Warm-up terminado en %.1f ms", _state["duration_ms"])
+        _ready.set()
+
+
+def start_background_warm_up() -> threading.Thread:
+    """Lanza el warm-up en un hilo para no retrasar la aceptación de conexiones."""
+    t = threading.Thread(target=warm_up, name="fichasync-warmup", daemon=True)
+    t.start()
+    return t
+
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+
+def status() -> Dict[str, Any]:
+    return {"ready": is_ready(), **{k: v for k, v in _state.items() if k != "started"}}
@@ -0,0 +1,505 @@
+# app/services/workbook_loader.py
+"""
+Carga selectiva de hojas del Excel maestro.
+
+openpyxl siempre materializa todas las hojas. Aquí:
+- `load_sheets` construye un paquete recortado (solo las hojas pedidas) y lo
+  abre con openpyxl, de modo que el coste escala con las hojas usadas.
+- `enum_sheets` calcula el mínimo de hojas que necesita el cargador de enums
+  (hoja de datos + hojas a las que apuntan sus validaciones y las TABLES).
+- `patch_cells` aplica las celdas editadas directamente sobre el XML de la hoja
+  tocada y copia el resto del paquete tal cual: las hojas no tocadas (y estilos,
+  tablas, validaciones...) salen sin cambios al guardar.
+- `resolve_data_sheet` decide cuál es la hoja de datos de un libro (la
+  configurada o, tras un cambio de año, la "Fichas AAAA" más reciente).
+"""
+import logging
+import posixpath
+import re
+import zipfile
+from copy import deepcopy
+from datetime import date, datetime, time
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+from typing import Any, BinaryIO, Dict, Iterable, List, Tuple
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+
+WORKBOOK_PART = "xl/workbook.xml"
+WORKBOOK_RELS = "xl/_rels/workbook.xml.rels"
+CONTENT_TYPES = "[Content_Types].xml"
+
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+# Caracteres de control no admitidos en XML (openpyxl lanza IllegalCharacterError)
+_ILLEGAL_XML_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+_FORMULA1_RE = re.compile(rb"<(?:\w+:)?formula1>(.*?)</(?:\w+:)?formula1>", re.S)
+_SHEET_REF_RE = re.compile(r"(?:'((?:[^']|'')+)'|([A-Za-z_][\w.]*))!")
+_TABLE_REF_RE = re.compile(r"([A-Za-z_][\w.]*)\[")
+
+
+def _q(tag: str, ns: str = NS_MAIN) -> str:
+    return f"{{{ns}}}{tag}"
+
+
+def _resolve(base_dir: str, target: str) -> str:
+    """Ruta de una relación: absoluta (/xl/...) o relativa a la carpeta del part origen."""
+    if target.startswith("/"):
+        return target.lstrip("/")
+    return posixpath.normpath(posixpath.join(base_dir, target))
+
+
+def _rels_path(part: str) -> str:
+    d, fn = posixpath.split(part)
+    return posixpath.join(d, "_rels", fn + ".rels")
+
+
+def _fromstring(data: bytes):
+    from lxml import etree
+    return etree.fromstring(data, parser=etree.XMLParser(huge_tree=True, remove_blank_text=False))
+
+
+def _tostring(root) -> bytes:
+    from lxml import etree
+    return etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=True)
+
+
+# ------------------------
+# Estructura del paquete
+# ------------------------
+
+def _sheet_parts(zf: zipfile.ZipFile) -> List[Tuple[str, str]]:
+    """[(nombre_hoja, part)] en el orden del libro."""
+    rels = _fromstring(zf.read(WORKBOOK_RELS))
+    targets = {r.get("Id"): _resolve("xl", r.get("Target")) for r in rels}
+    wb = _fromstring(zf.read(WORKBOOK_PART))
+    out = []
+    sheets = wb.find(_q("sheets"))
+    for s in (sheets if sheets is not None else []):
+        part = targets.get(s.get(_q("id", NS_REL)))
+        if part:
+            out.append((s.get("name"), part))
+    return out
+
+
+def sheet_map(excel_bytes: bytes) -> Dict[str, str]:
+    """Nombre de hoja -> part XML dentro del zip."""
+    with zipfile.ZipFile(BytesIO(excel_bytes)) as zf:
+        return dict(_sheet_parts(zf))
+
+
+def year_sheet_pattern() -> re.Pattern:
+    """Regex de los nombres de hoja de datos por año (ROLLOVER_SHEET_TEMPLATE, grupo 1 = año)."""
+    return re.compile("^" + re.escape(settings.ROLLOVER_SHEET_TEMPLATE).replace(r"\{year\}", r"(\d{4})") + "$")
+
+
+def resolve_data_sheet(source: bytes | str | BinaryIO, preferred: str | None = None) -> str:
+    """
+    Hoja de datos del libro: `preferred` (por defecto MASTER_DATA_SHEET) si existe; si no,
+    la hoja de año más reciente según ROLLOVER_SHEET_TEMPLATE ("Fichas 2026" tras el cambio
+    de año). Si no hay ninguna se devuelve `preferred` y el llamante dará el error de siempre.
+    Solo lee workbook.xml: no descomprime ninguna hoja.
+    """
+    preferred = preferred or settings.MASTER_DATA_SHEET
+    pos = source.tell() if hasattr(source, "seek") else None
+    try:
+        with zipfile.ZipFile(BytesIO(source) if isinstance(source, bytes) else source) as zf:
+            names = [n for n, _ in _sheet_parts(zf)]
+    except (KeyError, zipfile.BadZipFile, ValueError, OSError):
+        return preferred
+    finally:
+        if pos is not None:
+            source.seek(pos)
+    if preferred in names:
+        return preferred
+    pattern = year_sheet_pattern()
+    by_year = {int(m.group(1)): n for n in names if (m := pattern.match(n))}
+    return by_year[max(by_year)] if by_year else preferred
+
+
+def _tables_by_sheet(zf: zipfile.ZipFile, parts: List[Tuple[str, str]]) -> Dict[str, str]:
+    """Nombre de tabla (name y displayName, en mayúsculas) -> hoja que la contiene."""
+    names = set(zf.namelist())
+    out: Dict[str, str] = {}
+    for sheet, part in parts:
+        rp = _rels_path(part)
+        if rp not in names:
+            continue
+        for r in _fromstring(zf.read(rp)):
+            if not r.get("Type", "").endswith("/table"):
+                continue
+            tpart = _resolve(posixpath.dirname(part), r.get("Target"))
+            if tpart not in names:
+                continue
+            t = _fromstring(zf.read(tpart))
+            for attr in ("name", "displayName"):
+                if t.get(attr):
+                    out[t.get(attr).upper()] = sheet
+    return out
+
+
+def _sheets_in_formula(formula: str, defined: Dict[str, str], tables: Dict[str, str], depth: int = 0) -> set:
+    """Hojas a las que apunta una fórmula de validación (rangos, nombres definidos, tablas)."""
+    f = formula.strip().lstrip("=")
+    found = set()
+    for quoted, plain in _SHEET_REF_RE.findall(f):
+        found.add(quoted.replace("''", "'") if quoted else plain)
+    for tname in _TABLE_REF_RE.findall(f):
+        if tname.upper() in tables:
+            found.add(tables[tname.upper()])
+    if f.upper() in tables:
+        found.add(tables[f.upper()])
+    if depth < 3 and f in defined:
+        found |= _sheets_in_formula(defined[f], defined, tables, depth + 1)
+    return found
+
+
+def enum_sheets(excel_bytes: bytes, data_sheet: str, table_names: Iterable[str] = ()) -> List[str] | None:
+    """
+    Hojas mínimas para `load_enums_from_bytes`: la hoja de datos, las hojas a las que
+    apuntan sus validaciones de lista y las que contienen las tablas `table_names`.
+    Devuelve None si no se puede determinar con seguridad (el llamante carga todo).
+    """
+    try:
+        with zipfile.ZipFile(BytesIO(excel_bytes)) as zf:
+            parts = _sheet_parts(zf)
+            by_name = dict(parts)
+            if data_sheet not in by_name:
+                return None
+            tables = _tables_by_sheet(zf, parts)
+            wb = _fromstring(zf.read(WORKBOOK_PART))
+            defined = {}
+            dns = wb.find(_q("definedNames"))
+            for dn in (dns if dns is not None else []):
+                if dn.get("localSheetId") is None and dn.text:
+                    defined[dn.get("name")] = dn.text
+            needed = {data_sheet}
+            for raw in _FORMULA1_RE.findall(zf.read(by_name[data_sheet])):
+                needed |= _sheets_in_formula(raw.decode("utf-8", "replace"), defined, tables)
+            for t in table_names:
+                if t.upper() in tables:
+                    needed.add(tables[t.upper()])
+    except (KeyError, zipfile.BadZipFile, ValueError):
+        logger.warning("No se pudo analizar el paquete; se cargarán todas las hojas", exc_info=True)
+        return None
+    # respeta el orden del libro y descarta nombres que no son hojas
+    return [name for name, _ in parts if name in needed]
+
+
+# ------------------------
+# Lectura recortada
+# ------------------------
+
+def _trimmed_package(excel_bytes: bytes, sheets: Iterable[str]) -> BytesIO:
+    keep = set(sheets)
+    with zipfile.ZipFile(BytesIO(excel_bytes)) as zf:
+        parts = _sheet_parts(zf)
+        missing = keep - {n for n, _ in parts}
+        if missing:
+            raise KeyError(f"Worksheet {sorted(missing)[0]} does not exist.")
+        drop = {p for n, p in parts if n not in keep}
+        drop |= {_rels_path(p) for p in drop}
+
+        # workbook.xml sin las hojas descartadas (y nombres locales reindexados)
+        wb = _fromstring(zf.read(WORKBOOK_PART))
+        sheets_el = wb.find(_q("sheets"))
+        old_index = {}
+        for i, s in enumerate(list(sheets_el)):
+            if s.get("name") in keep:
+                old_index[i] = len(old_index)
+            else:
+                sheets_el.remove(s)
+        dns = wb.find(_q("definedNames"))
+        for dn in (list(dns) if dns is not None else []):
+            local = dn.get("localSheetId")
+            if local is None:
+                continue
+            if int(local) in old_index:
+                dn.set("localSheetId", str(old_index[int(local)]))
+            else:
+                dns.remove(dn)
+        for view in wb.iter(_q("workbookView")):
+            for attr in ("activeTab", "firstSheet"):
+                if view.get(attr) is not None:
+                    view.set(attr, "0")
+
+        out = BytesIO()
+        with zipfile.ZipFile(out, "w", zipfile.ZIP_STORED) as zout:
+            for info in zf.infolist():
+                if info.filename in drop:
+                    continue
+                data = _tostring(wb) if info.filename == WORKBOOK_PART else zf.read(info.filename)
+                zout.writestr(info.filename, data)
+    out.seek(0)
+    return out
+
+
+def load_sheets(excel_bytes: bytes, sheets: Iterable[str] | None = None, **kwargs):
+    """
+    `openpyxl.load_workbook` limitado a `sheets` (None = todas).
+    Las hojas que no se piden ni se descomprimen ni se parsean.
+    """
+    from openpyxl import load_workbook
+    if sheets is None:
+        return load_workbook(BytesIO(excel_bytes), **kwargs)
+    return load_workbook(_trimmed_package(excel_bytes, sheets), **kwargs)
+
+
+# ------------------------
+# Escritura: parche de celdas sobre el XML
+# ------------------------
+
+def _col_letter_to_index(letters: str) -> int:
+    n = 0
+    for ch in letters:
+        n = n * 26 + (ord(ch) - 64)
+    return n
+
+
+def _split_ref(ref: str) -> Tuple[int, int]:
+    m = re.match(r"([A-Z]+)(\d+)$", ref)
+    return int(m.group(2)), _col_letter_to_index(m.group(1))
+
+
+def _col_styles(root) -> Dict[int, str]:
+    out: Dict[int, str] = {}
+    cols = root.find(_q("cols"))
+    for c in (cols if cols is not None else []):
+        if c.get("style"):
+            for i in range(int(c.get("min")), int(c.get("max")) + 1):
+                out[i] = c.get("style")
+    return out
+
+
+STYLES_PART = "xl/styles.xml"
+# numFmtId integrados de fecha/hora (ECMA-376 18.8.30) y el que se pone al escribir cada tipo
+_BUILTIN_DATE_FMTS = set(range(14, 23)) | {45, 46, 47}
+_DATE_NUMFMT = ((datetime, 22), (date, 14), (time, 21))  # datetime antes que date (es subclase)
+
+
+class _DateStyles:
+    """
+    cellXfs de xl/styles.xml, leído solo si se escribe alguna fecha: una fecha se guarda
+    como número de serie, así que si el estilo de la celda no tiene formato de fecha se le
+    asigna una copia de ese estilo con formato de fecha (si no, Excel mostraría 45960).
+    """
+
+    def __init__(self, zf: zipfile.ZipFile):
+        self.zf = zf
+        self.root = None
+        self.changed = False
+        self._derived: Dict[Tuple[int, int], int] = {}
+
+    def _load(self):
+        if self.root is None:
+            if STYLES_PART not in self.zf.namelist():
+                raise ValueError("El libro no tiene xl/styles.xml")  # save_edits recurre a openpyxl
+            self.root = _fromstring(self.zf.read(STYLES_PART))
+            self.xfs = self.root.find(_q("cellXfs"))
+            self.formats = {int(n.get("numFmtId")): n.get("formatCode") or "" for n in self.root.iter(_q("numFmt"))}
+
+    def _is_date_fmt(self, fmt_id: int) -> bool:
+        from openpyxl.styles.numbers import is_date_format
+        return fmt_id in _BUILTIN_DATE_FMTS or (fmt_id in self.formats and is_date_format(self.formats[fmt_id]))
+
+    def date_style(self, style: str | None, value) -> str | None:
+        """Índice de estilo para escribir la fecha `value` en una celda con estilo `style` (None = el mismo)."""
+        self._load()
+        s = int(style or 0)
+        xfs = list(self.xfs)
+        base = xfs[s] if s < len(xfs) else (xfs[0] if xfs else None)
+        if base is not None and self._is_date_fmt(int(base.get("numFmtId") or 0)):
+            return None
+        fmt_id = next(fid for cls, fid in _DATE_NUMFMT if isinstance(value, cls))
+        if (s, fmt_id) not in self._derived:
+            if base is not None:
+                xf = deepcopy(base)
+            else:
+                xf = self.xfs.makeelement(_q("xf"), {"fontId": "0", "fillId": "0", "borderId": "0", "xfId": "0"})
+            xf.set("numFmtId", str(fmt_id))
+            xf.set("applyNumberFormat", "1")
+            self.xfs.append(xf)
+            self.xfs.set("count", str(len(self.xfs)))
+            self._derived[(s, fmt_id)] = len(self.xfs) - 1
+            self.changed = True
+        return str(self._derived[(s, fmt_id)])
+
+    def tostring(self) -> bytes:
+        return _tostring(self.root)
+
+
+def _set_cell_value(c, value, epoch, styles: _DateStyles | None = None) -> bool:
+    """
+    Escribe `value` en el elemento <c> conservando su estilo (a las fechas, si el estilo no
+    tiene formato de fecha, se les pone uno vía `styles`). Devuelve True si quitó una fórmula.
+    """
+    from openpyxl.utils.datetime import to_excel
+    had_formula = c.find(_q("f")) is not None
+    for child in list(c):
+        c.remove(child)
+    if "t" in c.attrib:
+        del c.attrib["t"]
+    if value is None or value == "":
+        return had_formula
+    if isinstance(value, bool):
+        c.set("t", "b")
+        v = c.makeelement(_q("v"), {}); v.text = "1" if value else "0"; c.append(v)
+    elif isinstance(value, (int, float)):
+        v = c.makeelement(_q("v"), {}); v.text = repr(value); c.append(v)
+    elif isinstance(value, (datetime, date, time)):
+        v = c.makeelement(_q("v"), {}); v.text = repr(to_excel(value, epoch)); c.append(v)
+        style = styles.date_style(c.get("s"), value) if styles is not None else None
+        if style is not None:
+            c.set("s", style)
+    else:
+        text = _ILLEGAL_XML_RE.sub("", str(value))
+        if text.startswith("=") and len(text) > 1:
+            f = c.makeelement(_q("f"), {}); f.text = text[1:]; c.append(f)
+            return had_formula
+        c.set("t", "inlineStr")
+        is_ = c.makeelement(_q("is"), {})
+        t = is_.makeelement(_q("t"), {})
+        t.text = text
+        if text != text.strip() or "\n" in text:
+            t.set("{http://www.w3.org/XML/1998/namespace}space", "preserve")
+        is_.append(t)
+        c.append(is_)
+    return had_formula
+
+
+def _patch_sheet_xml(
+    data: bytes, edits: Dict[Tuple[int, int], Any], epoch, styles: _DateStyles | None = None,
+) -> Tuple[bytes, bool]:
+    from openpyxl.utils import get_column_letter
+    root = _fromstring(data)
+    sheet_data = root.find(_q("sheetData"))
+    col_styles = _col_styles(root)
+    rows: Dict[int, Any] = {}
+    for i, r in enumerate(sheet_data):
+        rows[int(r.get("r") or i + 1)] = r
+
+    removed_formula = False
+    by_row: Dict[int, Dict[int, Any]] = {}
+    for (r, c), v in edits.items():
+        by_row.setdefault(r, {})[c] = v
+
+    for r, cells in sorted(by_row.items()):
+        row_el = rows.get(r)
+        if row_el is None:
+            row_el = sheet_data.makeelement(_q("row"), {"r": str(r)})
+            after = [k for k in rows if k < r]
+            if after:
+                rows[max(after)].addnext(row_el)
+            else:
+                sheet_data.insert(0, row_el)
+            rows[r] = row_el
+        existing: Dict[int, Any] = {}
+        for j, c_el in enumerate(row_el):
+            ref = c_el.get("r")
+            existing[_split_ref(ref)[1] if ref else j + 1] = c_el
+        for col, value in sorted(cells.items()):
+            c_el = existing.get(col)
+            if c_el is None:
+                attrs = {"r": f"{get_column_letter(col)}{r}"}
+                style = row_el.get("s") if row_el.get("customFormat") in ("1", "true") else col_styles.get(col)
+                if style:
+                    attrs["s"] = style
+                c_el = row_el.makeelement(_q("c"), attrs)
+                before = [k for k in existing if k < col]
+                if before:
+                    existing[max(before)].addnext(c_el)
+                else:
+                    row_el.insert(0, c_el)
+                existing[col] = c_el
+            removed_formula |= _set_cell_value(c_el, value, epoch, styles)
+
+    dim = root.find(_q("dimension"))
+    if dim is not None and edits:
+        ref = dim.get("ref", "A1")
+        last = ref.split(":")[-1]
+        max_r, max_c = _split_ref(last) if re.match(r"[A-Z]+\d+$", last) else (1, 1)
+        new_r = max(max_r, max(r for r, _ in edits))
+        new_c = max(max_c, max(c for _, c in edits))
+        first = ref.split(":")[0] if ":" in ref else "A1"
+        dim.set("ref", f"{first}:{get_column_letter(new_c)}{new_r}")
+
+    return _tostring(root), removed_formula
+
+
+def _drop_calc_chain(zf: zipfile.ZipFile) -> Dict[str, bytes]:
+    """Sin calcChain Excel lo reconstruye al abrir (openpyxl también lo descarta al guardar)."""
+    out = {}
+    rels = _fromstring(zf.read(WORKBOOK_RELS))
+    for r in list(rels):
+        if r.get("Type", "").endswith("/calcChain"):
+            rels.remove(r)
+    out[WORKBOOK_RELS] = _tostring(rels)
+    ct = _fromstring(zf.read(CONTENT_TYPES))
+    for o in list(ct):
+        if (o.get("PartName") or "").lstrip("/") == "xl/calcChain.xml":
+            ct.remove(o)
+    out[CONTENT_TYPES] = _tostring(ct)
+    return out
+
+
+def patch_cells(
+    excel_bytes: bytes,
+    sheet: str,
+    edits: Dict[Tuple[int, int], Any],
+) -> Tuple[SpooledTemporaryFile, int]:
+    """
+    Devuelve una copia del libro con `edits` ({(fila, col) base 1: valor}) aplicadas en `sheet`.
+    Solo se reescribe el XML de esa hoja; el resto de partes se copian sin modificar.
+    Los textos se escriben como inlineStr (no se toca sharedStrings) y se conserva el estilo de la celda
+    (salvo en fechas sobre celdas sin formato de fecha: estilo derivado con formato de fecha).
+    """
+    return patch_workbook(excel_bytes, {sheet: edits})
+
+
+def patch_workbook(
+    excel_bytes: bytes,
+    edits_by_sheet: Dict[str, Dict[Tuple[int, int], Any]],
+) -> Tuple[SpooledTemporaryFile, int]:
+    """Como `patch_cells` pero para varias hojas en una sola reescritura del paquete."""
+    from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900
+    with zipfile.ZipFile(BytesIO(excel_bytes)) as zf:
+        parts = dict(_sheet_parts(zf))
+        for sheet in edits_by_sheet:
+            if sheet not in parts:
+                raise KeyError(f"Worksheet {sheet} does not exist.")
+        wb = _fromstring(zf.read(WORKBOOK_PART))
+        pr = wb.find(_q("workbookPr"))
+        epoch = CALENDAR_MAC_1904 if pr is not None and pr.get("date1904") in ("1", "true") else CALENDAR_WINDOWS_1900
+
+        replaced: Dict[str, bytes | None] = {}
+        removed_formula = False
+        styles = _DateStyles(zf)
+        for sheet, edits in edits_by_sheet.items():
+            if edits:
+                part = parts[sheet]
+                replaced[part], removed = _patch_sheet_xml(zf.read(part), edits, epoch, styles)
+                removed_formula |= removed
+        if styles.changed:
+            replaced[STYLES_PART] = styles.tostring()
+        if removed_formula and "xl/calcChain.xml" in zf.namelist():
+            replaced.update(_drop_calc_chain(zf))
+            replaced["xl/calcChain.xml"] = None
+
+        out = SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES, mode="w+b")
+        with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zout:
+            for info in zf.infolist():
+                if info.filename in replaced:
+                    data = replaced[info.filename]
+                    if data is None:
+                        continue
+                    zout.writestr(info, data, compress_type=zipfile.ZIP_DEFLATED)
+                else:
+                    zout.writestr(info, zf.read(info.filename))
+    size = out.tell()
+    out.seek(0)
+    return out, size
@@ -0,0 +1,46 @@
+from datetime import date, datetime
+import re
+
+# Formatos habituales en las fichas DOCX y en el Excel maestro
+_DATE_FORMATS = ("%d/%m/%Y", "%d/%m/%y", "%d-%m-%Y", "%Y-%m-%d", "%d.%m.%Y")
+_DATE_RE = re.compile(r"\b(\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}|\d{4}-\d{1,2}-\d{1,2})\b")
+
+
+def parse_date(value, strict: bool = False) -> date | None:
+    """
+    Convierte un valor de celda o texto de la ficha a `date`.
+    Acepta date/datetime y textos tipo "30/10/2025" o "Hasta 30/10/2025".
+    Con strict=True el texto entero tiene que ser la fecha ("Hasta 30/10/2025" -> None):
+    para escribir celdas sin perder lo que acompaña a la fecha.
+    Devuelve None si no hay una fecha reconocible.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    m = _DATE_RE.fullmatch(str(value).strip()) if strict else _DATE_RE.search(str(value))
+    if not m:
+        return None
+    raw = m.group(1)
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(raw, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def cell_date(value, epoch=None) -> date | None:
+    """
+    Fecha de una celda de una columna de fecha: como parse_date, pero un número es un
+    número de serie de Excel (celda sin formato de fecha). `epoch` es el del libro
+    (wb.epoch; por defecto el de Windows, 1900).
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        from openpyxl.utils.datetime import CALENDAR_WINDOWS_1900, from_excel
+        if not 0 < value < 2958466:  # hasta el 31/12/9999
+            return None
+        return from_excel(value, epoch or CALENDAR_WINDOWS_1900).date()
+    return parse_date(value)
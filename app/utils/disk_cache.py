@@ -0,0 +1,190 @@
+"""
+Caché en disco compartida entre procesos (workers de gunicorn/uvicorn).
+
+Cada entrada es un pickle en SHARED_CACHE_DIR/<namespace>/<clave>.pkl escrito de
+forma atómica (fichero temporal + os.replace), así que un worker nunca lee una
+entrada a medias. El tamaño total se acota expulsando las entradas menos usadas
+(mtime, que se refresca en cada lectura).
+
+Las entradas son pickles, y cargar un pickle ajeno ejecuta código: el directorio
+se crea con permisos 0700 y, si es de otro usuario, es un enlace simbólico o no se
+puede dejar privado, la caché queda desactivada (se calcula todo sin ella).
+"""
+import logging
+import os
+import pickle
+import stat
+import tempfile
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+_checked: Dict[str, bool] = {}  # SHARED_CACHE_DIR -> si es utilizable (se comprueba una vez por ruta)
+
+
+def ensure_private_dir(root: str) -> bool:
+    """Crea `root` (0700) y comprueba que es un directorio propio y privado; si no, False."""
+    try:
+        os.makedirs(root, mode=0o700, exist_ok=True)
+        st = os.lstat(root)
+    except OSError:
+        logger.warning("No se pudo crear la caché compartida %s; se desactiva", root, exc_info=True)
+        return False
+    if not stat.S_ISDIR(st.st_mode):
+        logger.error("La caché compartida %s no es un directorio (¿enlace simbólico?); se desactiva", root)
+        return False
+    if hasattr(os, "getuid"):  # en Windows no hay uid ni modos POSIX
+        if st.st_uid != os.getuid():
+            logger.error("La caché compartida %s es de otro usuario (uid %d); se desactiva", root, st.st_uid)
+            return False
+        if st.st_mode & 0o077:
+            try:
+                os.chmod(root, 0o700)
+            except OSError:
+                logger.error("No se pudo dejar privada la caché compartida %s; se desactiva", root)
+                return False
+    return True
+
+
+def _enabled() -> bool:
+    if not settings.SHARED_CACHE_ENABLED:
+        return False
+    root = settings.SHARED_CACHE_DIR
+    if root not in _checked:
+        _checked[root] = ensure_private_dir(root)
+    return _checked[root]
+
+
+def _path(namespace: str, key: str) -> str:
+    return os.path.join(settings.SHARED_CACHE_DIR, namespace, f"{key}.pkl")
+
+
+def get(namespace: str, key: str, default: Any = None) -> Any:
+    if not _enabled():
+        return default
+    path = _path(namespace, key)
+    try:
+        with open(path, "rb") as f:
+            value = pickle.load(f)
+        os.utime(path)  # LRU aproximado
+        return value
+    except FileNotFoundError:
+        return default
+    except Exception:
+        logger.warning("Entrada de caché corrupta, se descarta: %s", path)
+        _remove(path)
+        return default
+
+
+def put(namespace: str, key: str, value: Any) -> None:
+    if not _enabled():
+        return
+    folder = os.path.join(settings.SHARED_CACHE_DIR, namespace)
+    try:
+        os.makedirs(folder, mode=0o700, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, _path(namespace, key))
+    except OSError:
+        logger.warning("No se pudo escribir en la caché compartida (%s)", folder, exc_info=True)
+        return
+    _evict()
+
+
+# candados por franjas: un número fijo de ficheros por namespace (no uno por clave)
+LOCK_STRIPES = 64
+
+
+@contextmanager
+def lock(namespace: str, key: str, timeout: float | None = None) -> Iterator[bool]:
+    """
+    Candado entre procesos (flock) para calcular una entrada una sola vez: el resto de
+    workers espera aquí y, al entrar, encuentra la entrada ya escrita con get().
+    Si no se consigue en `timeout` segundos (SINGLEFLIGHT_LOCK_TIMEOUT_SECONDS) se
+    sigue sin candado (devuelve False): mejor calcular dos veces que bloquearse.
+    """
+    if not _enabled() or fcntl is None:
+        yield False
+        return
+    timeout = settings.SINGLEFLIGHT_LOCK_TIMEOUT_SECONDS if timeout is None else timeout
+    folder = os.path.join(settings.SHARED_CACHE_DIR, namespace)
+    path = os.path.join(folder, f".lock-{zlib.crc32(key.encode()) % LOCK_STRIPES}")
+    try:
+        os.makedirs(folder, mode=0o700, exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    except OSError:
+        logger.warning("No se pudo abrir el candado %s", path, exc_info=True)
+        yield False
+        return
+    acquired = False
+    try:
+        deadline = time.monotonic() + timeout
+        delay = 0.005
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                acquired = True
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    logger.warning("Candado %s/%s ocupado más de %.0f s; se calcula igualmente", namespace, key, timeout)
+                    break
+                time.sleep(delay)
+                delay = min(delay * 2, 0.1)
+        yield acquired
+    finally:
+        if acquired:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _evict():
+    evict_dir(settings.SHARED_CACHE_DIR, settings.SHARED_CACHE_MAX_MB * 1024 * 1024, suffixes=(".pkl",))
+
+
+def evict_dir(folder: str, max_bytes: int, suffixes: tuple[str, ...] | None = None) -> int:
+    """
+    Mantiene `folder` por debajo de `max_bytes` borrando los ficheros más antiguos (mtime)
+    hasta quedar en el 90 % del límite. Devuelve cuántos se borraron.
+    """
+    entries = []
+    total = 0
+    for root, _, files in os.walk(folder):
+        for fn in files:
+            if suffixes and not fn.endswith(suffixes):
+                continue
+            path = os.path.join(root, fn)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+    if total <= max_bytes:
+        return 0
+    removed = 0
+    for _, size, path in sorted(entries):
+        _remove(path)
+        removed += 1
+        total -= size
+        if total <= max_bytes * 0.9:
+            break
+    return removed
@@ -0,0 +1,6 @@
+import hashlib
+
+
+def content_hash(data: bytes) -> str:
+    """Hash de contenido (sha256 hex) para claves de caché."""
+    return hashlib.sha256(data).hexdigest()
@@ -1,13 +1,151 @@
-import logging, sys
+"""
+Logging estructurado y no bloqueante.
 
-def setup_logging():
-    logger = logging.getLogger("fichasync")
-    handler = logging.StreamHandler(sys.stdout)
-    fmt = logging.Formatter("[%(asctime)s] %(levelname)s in %(name)s: %(message)s")
-    handler.setFormatter(fmt)
-    logger.addHandler(handler)
-    logger.setLevel(logging.INFO)
-    return logger
+- Los handlers de la app solo encolan el registro (QueueHandler); un hilo aparte
+  (QueueListener) los formatea como JSON y los escribe en stdout, así la E/S de
+  logs no suma latencia a las peticiones.
+- Cada registro lleva el `request_id` de la petición en curso (ContextVar) y,
+  en el registro de acceso, la duración de cada etapa del pipeline.
+- `setup_logging()` es idempotente: llamarlo varias veces no duplica handlers.
+"""
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Optional
 
-logger = setup_logging()
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+# etapa -> ms de la petición en curso (None fuera de una petición)
+stages_var: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("stages", default=None)
 
+_listener: Optional[logging.handlers.QueueListener] = None
+
+# atributos estándar de LogRecord: el resto son `extra=` y se vuelcan al JSON
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+
+class RequestContextFilter(logging.Filter):
+    """Copia el request_id del contexto al registro (en el hilo que loguea, antes de encolar)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "request_id"):
+            record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for k, v in record.__dict__.items():
+            if k not in _RESERVED and v is not None:
+                data[k] = v
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def setup_logging(level: str | int = "INFO", json_format: bool = True) -> logging.Logger:
+    """Configura el logger raíz con QueueHandler -> QueueListener(stdout). Idempotente."""
+    global _listener
+    root = logging.getLogger()
+    root.setLevel(level)
+    if _listener is not None:
+        return root
+
+    out = logging.StreamHandler(sys.stdout)
+    out.setFormatter(JsonFormatter() if json_format else logging.Formatter(
+        "[%(asctime)s] %(levelname)s in %(name)s [%(request_id)s]: %(message)s"
+    ))
+    q: queue.Queue = queue.SimpleQueue()
+    qh = logging.handlers.QueueHandler(q)
+    qh.addFilter(RequestContextFilter())
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(qh)
+    _listener = logging.handlers.QueueListener(q, out, respect_handler_level=True)
+    _listener.start()
+    return root
+
+
+def shutdown_logging():
+    """Vacía la cola y para el hilo del listener (al apagar el servicio)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def record_stage(name: str, ms: float):
+    stages = stages_var.get()
+    if stages is not None:
+        stages[name] = round(stages.get(name, 0.0) + ms, 1)
+
+
+@contextmanager
+def log_stage(name: str):
+    """Mide un bloque y lo añade a las etapas de la petición en curso."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, (time.perf_counter() - t0) * 1000)
+
+
+class RequestContextMiddleware:
+    """
+    Middleware ASGI: asigna un request_id (o respeta X-Request-ID), lo devuelve en la
+    respuesta y al terminar emite un registro de acceso con estado, duración y etapas.
+    """
+
+    def __init__(self, app, logger_name: str = "fichasync.access"):
+        self.app = app
+        self.logger = logging.getLogger(logger_name)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        rid = None
+        for k, v in scope.get("headers", []):
+            if k == b"x-request-id":
+                rid = v.decode("latin-1")[:64]
+                break
+        rid = rid or uuid.uuid4().hex
+        rid_token = request_id_var.set(rid)
+        stages: Dict[str, float] = {}
+        stages_token = stages_var.set(stages)
+        status = {"code": 500}
+        t0 = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", rid.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.logger.info(
+                "%s %s %d", scope["method"], scope["path"], status["code"],
+                extra={
+                    "status": status["code"],
+                    "duration_ms": round((time.perf_counter() - t0) * 1000, 1),
+                    "stages": stages or None,
+                },
+            )
+            stages_var.reset(stages_token)
+            request_id_var.reset(rid_token)
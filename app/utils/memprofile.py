@@ -0,0 +1,132 @@
+"""
+Perfil de memoria por petición (opcional): pico de tracemalloc y delta de RSS por etapa.
+
+Se activa con MEMPROFILE_ENABLED (todas las peticiones de preview/process/finalize)
+o por petición con la cabecera `X-Memory-Profile: 1` si MEMPROFILE_ALLOW_HEADER
+(el router además exige `X-Admin-Token`, como el perfil de CPU).
+tracemalloc es global al proceso, así que solo se perfila una petición a la vez
+(las demás siguen sin perfil y lo indican en la cabecera); el pico puede incluir
+memoria de otras peticiones concurrentes no perfiladas.
+
+Si el pico de una etapa supera MEMPROFILE_DUMP_THRESHOLD_MB se vuelcan al log las
+líneas con más memoria viva al terminar esa etapa.
+"""
+import contextvars
+import logging
+import os
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from app.config import settings
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+_current: contextvars.ContextVar[Optional["MemoryProfile"]] = contextvars.ContextVar("memprofile", default=None)
+_busy = threading.Lock()
+
+
+def rss_bytes() -> int:
+    """RSS actual del proceso (Linux: /proc; resto: 0, solo se informa tracemalloc)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class MemoryProfile:
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.peak = 0
+
+    def headers(self) -> Dict[str, str]:
+        return {
+            "X-Memory-Profile": "on",
+            "X-Mem-Peak-MB": f"{self.peak / MB:.1f}",
+            # etapa=pico_tracemalloc_MB/delta_rss_MB
+            "X-Mem-Stages": ";".join(
+                f"{k}={v['peak_mb']:.1f}/{v['rss_delta_mb']:+.1f}" for k, v in self.stages.items()
+            ),
+        }
+
+
+def _dump_top(stage: str, endpoint: str):
+    snap = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+    ))
+    top = snap.statistics("lineno")[: settings.MEMPROFILE_TOP_N]
+    logger.warning(
+        "Memoria por encima del umbral en %s/%s", endpoint, stage,
+        extra={"top_allocations": [
+            {"site": f"{s.traceback[0].filename}:{s.traceback[0].lineno}", "size_kb": round(s.size / 1024, 1), "count": s.count}
+            for s in top
+        ]},
+    )
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Mide una etapa si la petición en curso se está perfilando (si no, no hace nada)."""
+    prof = _current.get()
+    if prof is None:
+        yield
+        return
+    tracemalloc.reset_peak()
+    start, _ = tracemalloc.get_traced_memory()
+    rss0 = rss_bytes()
+    try:
+        yield
+    finally:
+        _, peak = tracemalloc.get_traced_memory()
+        rss_delta = rss_bytes() - rss0
+        used = max(0, peak - start)
+        prof.peak = max(prof.peak, peak)
+        prof.stages[name] = {"peak_mb": round(used / MB, 2), "rss_delta_mb": round(rss_delta / MB, 2)}
+        metrics.observe(f"mem.{prof.endpoint}.{name}.peak_mb", round(used / MB, 2))
+        metrics.observe(f"mem.{prof.endpoint}.{name}.rss_delta_mb", round(rss_delta / MB, 2))
+        if used > settings.MEMPROFILE_DUMP_THRESHOLD_MB * MB:
+            _dump_top(name, prof.endpoint)
+
+
+def wanted(header_value: str | None) -> bool:
+    if settings.MEMPROFILE_ENABLED:
+        return True
+    return settings.MEMPROFILE_ALLOW_HEADER and (header_value or "").strip() in ("1", "true", "on")
+
+
+@contextmanager
+def request(endpoint: str, enabled: bool) -> Iterator[Optional[MemoryProfile]]:
+    """
+    Perfila el bloque si `enabled` y no hay otra petición perfilándose.
+    Devuelve el MemoryProfile (o None); sus `headers()` van a la respuesta.
+    """
+    if not enabled or not _busy.acquire(blocking=False):
+        yield None
+        return
+    prof = MemoryProfile(endpoint)
+    token = _current.set(prof)
+    started_here = not tracemalloc.is_tracing()
+    if started_here:
+        tracemalloc.start(settings.MEMPROFILE_FRAMES)
+    try:
+        yield prof
+    finally:
+        if started_here:
+            tracemalloc.stop()
+        _current.reset(token)
+        _busy.release()
+        metrics.observe(f"mem.{endpoint}.peak_mb", round(prof.peak / MB, 2))
+
+
+def response_headers(enabled: bool, prof: Optional[MemoryProfile]) -> Dict[str, str]:
+    """Cabeceras de perfil para la respuesta (vacío si no se pidió)."""
+    if prof is not None:
+        return prof.headers()
+    return {"X-Memory-Profile": "busy"} if enabled else {}
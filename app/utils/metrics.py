@@ -0,0 +1,65 @@
+# app/utils/metrics.py
+"""
+Métricas en memoria del proceso (contadores y observaciones), expuestas en /metrics.
+
+Con varios workers cada proceso tiene las suyas: el endpoint devuelve las del
+worker que atiende la petición (incluye el pid).
+"""
+import os
+import threading
+import time
+from typing import Any, Dict
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = {}
+# nombre -> {"count", "sum", "max", "last"}
+_observations: Dict[str, Dict[str, float]] = {}
+_started = time.time()
+
+
+def incr(name: str, value: float = 1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name: str, value: float):
+    with _lock:
+        o = _observations.get(name)
+        if o is None:
+            o = _observations[name] = {"count": 0, "sum": 0.0, "max": value, "last": value}
+        o["count"] += 1
+        o["sum"] += value
+        o["max"] = max(o["max"], value)
+        o["last"] = value
+
+
+def _hit_rates() -> Dict[str, float]:
+    """`<x>.hit_rate` para cada par de contadores `<x>.hit` / `<x>.miss` (llamar con _lock)."""
+    rates = {}
+    for name, hits in _counters.items():
+        if name.endswith(".hit"):
+            prefix = name[: -len(".hit")]
+            total = hits + _counters.get(prefix + ".miss", 0)
+            rates[prefix + ".hit_rate"] = round(hits / total, 4) if total else 0.0
+    return rates
+
+
+def snapshot() -> Dict[str, Any]:
+    with _lock:
+        obs = {
+            k: {**v, "avg": round(v["sum"] / v["count"], 3) if v["count"] else 0.0}
+            for k, v in _observations.items()
+        }
+        return {
+            "pid": os.getpid(),
+            "uptime_s": round(time.time() - _started, 1),
+            "counters": dict(_counters),
+            "observations": obs,
+            "hit_rates": _hit_rates(),
+        }
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _observations.clear()
@@ -0,0 +1,124 @@
+"""
+Perfil de CPU de una petición concreta (bajo demanda, protegido por token de admin).
+
+Mientras dura el bloque:
+- cProfile perfila solo el hilo que atiende la petición (sys.setprofile es por hilo),
+- un hilo muestreador toma la pila de ese mismo hilo cada PROFILE_SAMPLE_INTERVAL_MS.
+Al terminar se guardan en PROFILE_DIR:
+  <id>.pstats     para `python -m pstats`, snakeviz...
+  <id>.collapsed  pilas "a;b;c N" para flamegraph.pl / speedscope
+Solo se perfila una petición a la vez; el resto de peticiones no se ven afectadas.
+"""
+import cProfile
+import hmac
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from app.config import settings
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+_busy = threading.Lock()
+
+
+class _StackSampler(threading.Thread):
+    """Muestrea la pila de `thread_id` y acumula pilas colapsadas (raíz primero)."""
+
+    def __init__(self, thread_id: int, interval_s: float):
+        super().__init__(name="fichasync-profiler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval_s
+        self.stacks: Counter = Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            parts = []
+            while frame is not None:
+                code = frame.f_code
+                parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            if parts:
+                self.stacks[";".join(reversed(parts))] += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+class ProfileResult:
+    def __init__(self, endpoint: str):
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{endpoint}-{uuid.uuid4().hex[:8]}"
+        self.files: Dict[str, str] = {}
+        self.duration_ms = 0.0
+
+    def headers(self) -> Dict[str, str]:
+        return {
+            "X-Profile-Id": self.id,
+            "X-Profile-Files": ",".join(os.path.basename(p) for p in self.files.values()),
+            "X-Profile-Duration-Ms": f"{self.duration_ms:.1f}",
+        }
+
+
+@contextmanager
+def request(endpoint: str, enabled: bool) -> Iterator[Optional[ProfileResult]]:
+    """Perfila el bloque si `enabled` y no hay otro perfil en curso (si no, devuelve None)."""
+    if not enabled or not _busy.acquire(blocking=False):
+        yield None
+        return
+    result = ProfileResult(endpoint)
+    prof = cProfile.Profile()
+    sampler = _StackSampler(threading.get_ident(), settings.PROFILE_SAMPLE_INTERVAL_MS / 1000)
+    t0 = time.perf_counter()
+    sampler.start()
+    prof.enable()
+    try:
+        yield result
+    finally:
+        prof.disable()
+        sampler.stop()
+        result.duration_ms = (time.perf_counter() - t0) * 1000
+        try:
+            _save(result, prof, sampler)
+        except OSError:
+            logger.warning("No se pudo guardar el perfil %s", result.id, exc_info=True)
+        finally:
+            _busy.release()
+        metrics.incr(f"profile.{endpoint}.count")
+
+
+def _save(result: ProfileResult, prof: cProfile.Profile, sampler: _StackSampler):
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    base = os.path.join(settings.PROFILE_DIR, result.id)
+    prof.dump_stats(base + ".pstats")
+    result.files["pstats"] = base + ".pstats"
+    with open(base + ".collapsed", "w", encoding="utf-8") as f:
+        for stack, n in sampler.stacks.most_common():
+            f.write(f"{stack} {n}\n")
+    result.files["collapsed"] = base + ".collapsed"
+    logger.info(
+        "Perfil guardado: %s (%.1f ms, %d muestras)", result.id, result.duration_ms,
+        sum(sampler.stacks.values()),
+    )
+
+
+def token_ok(token: str | None) -> bool:
+    """Token de admin válido (comparación en tiempo constante); sin PROFILE_ADMIN_TOKEN nunca."""
+    expected = settings.PROFILE_ADMIN_TOKEN
+    return bool(expected) and hmac.compare_digest((token or "").encode(), expected.encode())
+
+
+def response_headers(enabled: bool, result: Optional[ProfileResult]) -> Dict[str, str]:
+    """Cabeceras de perfil para la respuesta (vacío si no se pidió)."""
+    if result is not None:
+        return result.headers()
+    return {"X-Profile": "busy"} if enabled else {}
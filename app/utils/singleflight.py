@@ -0,0 +1,62 @@
+"""
+Single-flight: llamadas concurrentes con la misma clave comparten un único cálculo.
+
+El primero que llega (líder) ejecuta la función; el resto espera a que termine y
+recibe el mismo resultado (o la misma excepción). Al acabar la clave se libera:
+no es una caché, solo evita que N peticiones idénticas simultáneas hagan N veces
+el mismo parseo. Es por proceso; entre workers lo complementa disk_cache.lock.
+"""
+import threading
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+from app.utils import metrics
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+
+
+class Group:
+    """Un grupo por tipo de cálculo (las métricas van por nombre: singleflight.<name>.*)."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Ejecuta fn() una sola vez por clave entre las llamadas concurrentes.
+        Devuelve (resultado, compartido): compartido=True si lo calculó otro hilo,
+        en cuyo caso el resultado es el mismo objeto y no debe modificarse.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            metrics.incr(f"singleflight.{self.name}.shared")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        metrics.incr(f"singleflight.{self.name}.leader")
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
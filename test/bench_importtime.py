@@ -0,0 +1,65 @@
+"""
+Mide el coste de importar la app con `python -X importtime`.
+
+Uso:
+    python test/bench_importtime.py                 # import de app.main
+    python test/bench_importtime.py --module app.routers.sync --top 15 --runs 5
+
+Imprime un JSON con la mediana del tiempo acumulado (ms), los módulos más caros
+y si openpyxl / docx / lxml se han cargado durante el import (no deberían).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ("openpyxl", "docx", "lxml")
+
+
+def _run_once(module: str):
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cum_us, name = [p.strip() for p in line.split(":", 1)[1].split("|")]
+        rows.append((name, int(self_us), int(cum_us)))
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--module", default="app.main")
+    ap.add_argument("--runs", type=int, default=3)
+    ap.add_argument("--top", type=int, default=10)
+    args = ap.parse_args()
+
+    totals, last = [], []
+    for _ in range(args.runs):
+        last = _run_once(args.module)
+        top_level = next((r for r in last if r[0] == args.module), None)
+        totals.append(top_level[2] / 1000 if top_level else 0.0)
+
+    loaded = {r[0].split(".")[0] for r in last}
+    report = {
+        "module": args.module,
+        "runs": args.runs,
+        "cumulative_ms_median": round(statistics.median(totals), 1),
+        "cumulative_ms_all": [round(t, 1) for t in totals],
+        "heavy_loaded": sorted(h for h in HEAVY if h in loaded),
+        "top_self_ms": [
+            {"module": n, "self_ms": round(s / 1000, 2), "cumulative_ms": round(c / 1000, 2)}
+            for n, s, c in sorted(last, key=lambda r: r[1], reverse=True)[: args.top]
+        ],
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
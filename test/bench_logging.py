@@ -0,0 +1,129 @@
+"""
+Coste del logging en el camino caliente de escritura (apply_auto_fields + revert).
+
+Uso:
+    python test/bench_logging.py                    # 300 iteraciones por configuración
+    python test/bench_logging.py --iterations 1000 --excel samples/anexo.xlsx
+    python test/bench_logging.py --sink-latency-us 0    # destino de logs sin latencia
+
+Compara, sobre la misma hoja ya cargada:
+  off          logging desactivado (referencia)
+  sync_info    StreamHandler síncrono a fichero, nivel INFO (configuración antigua)
+  queue_info   setup_logging(): QueueHandler + QueueListener, nivel INFO
+  sync_debug   StreamHandler síncrono, nivel DEBUG (coste de los mensajes por celda)
+  queue_debug  QueueHandler, nivel DEBUG
+El destino de los logs simula un stdout lento (pipe del contenedor, driver de logs)
+con --sink-latency-us por escritura; con el handler síncrono esa espera la paga la
+petición, con la cola la paga el hilo del listener.
+Imprime un JSON con la mediana (µs por iteración) y la sobrecarga respecto a `off`.
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.excel_writer import DEFAULT_SHEET, apply_auto_fields, revert_edits  # noqa: E402
+from app.services.workbook_loader import load_sheets  # noqa: E402
+from app.utils import logging as app_logging  # noqa: E402
+
+AUTO_FIELDS = {
+    "AMBITO CC AA": "Castilla-La Mancha",
+    "Mayores": "Mayores", "Discapacidad": "Discapacidad", "Familia": "", "Mujer": "", "Salud": "",
+    "TEMÁTICA 1": "Energía", "TEMÁTICA 2": "", "TEMÁTICA 3": "",
+    "NOMBRE DE FICHA": "Ficha de prueba (benchmark)",
+    "VENCIMIENTO": "30/10/2025",
+    "FECHA DE REDACCIÓN": "05/08/2025",
+    "TRAMITE ELECTRONICO": "Sí",
+}
+
+
+class SlowStream:
+    """Fichero cuyo write tarda `latency_us` (como un stdout bloqueado)."""
+
+    def __init__(self, path: str, latency_us: int):
+        self.f = open(path, "a", encoding="utf-8")
+        self.latency = latency_us / 1e6
+
+    def write(self, s):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.f.write(s)
+
+    def flush(self):
+        self.f.flush()
+
+
+def _reset_root():
+    app_logging.shutdown_logging()
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+        h.close()
+    logging.disable(logging.NOTSET)
+
+
+def _configure(name: str, log_path: str, latency_us: int):
+    _reset_root()
+    if name == "off":
+        logging.disable(logging.CRITICAL)
+        return
+    level = logging.DEBUG if name.endswith("debug") else logging.INFO
+    if name.startswith("sync"):
+        h = logging.StreamHandler(SlowStream(log_path, latency_us))
+        h.setFormatter(logging.Formatter("[%(asctime)s] %(levelname)s in %(name)s: %(message)s"))
+        root = logging.getLogger()
+        root.addHandler(h)
+        root.setLevel(level)
+    else:
+        app_logging.setup_logging(level, json_format=True)
+        # el listener escribe en stdout: se redirige al fichero para no ensuciar la salida
+        app_logging._listener.handlers[0].setStream(SlowStream(log_path, latency_us))
+
+
+def _bench(ws, iterations: int) -> float:
+    times = []
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        applied = apply_auto_fields(ws, AUTO_FIELDS, match_existing=False)
+        logging.getLogger("app.services.excel_writer").info("Guardado. Hoja=%s, fila(base0)=%d", ws.title, applied["row"] - 1)
+        revert_edits(ws, applied)
+        times.append((time.perf_counter() - t0) * 1e6)
+    return statistics.median(times)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--excel", default="samples/anexo.xlsx")
+    ap.add_argument("--iterations", type=int, default=300)
+    ap.add_argument("--sink-latency-us", type=int, default=200)
+    args = ap.parse_args()
+
+    with open(args.excel, "rb") as f:
+        ws = load_sheets(f.read(), [DEFAULT_SHEET])[DEFAULT_SHEET]
+
+    log_path = os.path.join(tempfile.gettempdir(), "fichasync-bench-logging.log")
+    results = {}
+    for name in ("off", "sync_info", "queue_info", "sync_debug", "queue_debug"):
+        _configure(name, log_path, args.sink_latency_us)
+        _bench(ws, 20)  # calentamiento
+        results[name] = round(_bench(ws, args.iterations), 1)
+    _reset_root()
+    os.remove(log_path)
+
+    base = results["off"]
+    print(json.dumps({
+        "iterations": args.iterations,
+        "sink_latency_us": args.sink_latency_us,
+        "median_us": results,
+        "overhead_pct": {k: round((v - base) / base * 100, 1) for k, v in results.items() if k != "off"},
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
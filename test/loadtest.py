@@ -0,0 +1,171 @@
+"""
+Prueba de carga en proceso: ejecuta `app.main:app` a través de httpx.ASGITransport
+(sin red ni servidor) y mide cómo escala cada endpoint con la concurrencia.
+
+Uso:
+    python test/loadtest.py                                   # preview,process,finalize,enums @ 1,4,16
+    python test/loadtest.py --endpoints preview,process --concurrency 1,2,4,8 --requests 80
+    python test/loadtest.py --synthetic 0 --response-cache    # solo la ficha de samples/, con caché
+
+Las peticiones usan samples/ficha.docx y samples/anexo.xlsx. Con --synthetic N se generan
+N variantes de la ficha (cambia el nombre de la ayuda) para que cada petición sea una ficha
+distinta y no la resuelva la caché de respuestas. La caché está desactivada por defecto
+para medir el trabajo real (--response-cache la activa).
+
+Imprime un JSON con, por endpoint y nivel de concurrencia: peticiones/s, latencias
+p50/p95/p99 (ms) y tasa de errores (respuestas no 2xx o excepciones).
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from io import BytesIO
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+
+from app.config import settings  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENDPOINTS = ("preview", "process", "finalize", "enums")
+
+
+def synthetic_docx(base: bytes, i: int) -> bytes:
+    """Copia de la ficha con el nombre de la ayuda cambiado (otra ficha a efectos de caché/índice)."""
+    from docx import Document
+    doc = Document(BytesIO(base))
+    for p in doc.paragraphs:
+        if p.text.strip().lower().startswith("nombre de la ayuda") and p.runs:
+            p.runs[-1].text += f" (sintética {i})"
+            break
+    out = BytesIO()
+    doc.save(out)
+    return out.getvalue()
+
+
+def _percentile(sorted_ms: List[float], q: float) -> float:
+    if not sorted_ms:
+        return 0.0
+    k = min(len(sorted_ms) - 1, max(0, round(q / 100 * (len(sorted_ms) - 1))))
+    return round(sorted_ms[k], 1)
+
+
+class Workload:
+    def __init__(self, docx_variants: List[bytes], excel: bytes):
+        self.docx = docx_variants
+        self.excel = excel
+        self.finalize_payload = json.dumps({
+            "sheet": settings.MASTER_DATA_SHEET,
+            "row_index": 10,
+            "updates": {"ID": "123"},
+        }).encode()
+
+    def request(self, endpoint: str, i: int) -> Dict:
+        docx = self.docx[i % len(self.docx)]
+        if endpoint == "preview":
+            return {"method": "POST", "url": "/sync/preview",
+                    "files": {"docx": ("f.docx", docx), "excel": ("a.xlsx", self.excel)}}
+        if endpoint == "process":
+            return {"method": "POST", "url": "/sync/process",
+                    "files": {"docx": ("f.docx", docx), "excel": ("a.xlsx", self.excel)}}
+        if endpoint == "finalize":
+            payload = json.dumps({**json.loads(self.finalize_payload), "updates": {"ID": str(i)}}).encode()
+            return {"method": "PUT", "url": "/sync/finalize",
+                    "files": {"excel": ("a.xlsx", self.excel), "payload": ("p.json", payload)}}
+        if endpoint == "enums":
+            return {"method": "GET", "url": "/sync/enums"}
+        raise ValueError(endpoint)
+
+
+async def run_level(client: httpx.AsyncClient, work: Workload, endpoint: str, concurrency: int, total: int) -> Dict:
+    sem = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def one(i: int):
+        nonlocal errors
+        async with sem:
+            t0 = time.perf_counter()
+            try:
+                r = await client.request(**work.request(endpoint, i))
+                await r.aread()
+                if not 200 <= r.status_code < 300:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append((time.perf_counter() - t0) * 1000)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    wall = time.perf_counter() - t0
+    ms = sorted(latencies)
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "throughput_rps": round(total / wall, 2),
+        "p50_ms": _percentile(ms, 50),
+        "p95_ms": _percentile(ms, 95),
+        "p99_ms": _percentile(ms, 99),
+        "mean_ms": round(statistics.fmean(ms), 1) if ms else 0.0,
+        "error_rate": round(errors / total, 4) if total else 0.0,
+    }
+
+
+async def main_async(args) -> Dict:
+    from app.main import app
+
+    with open(args.docx, "rb") as f:
+        base_docx = f.read()
+    with open(args.excel, "rb") as f:
+        excel = f.read()
+    variants = [base_docx] + [synthetic_docx(base_docx, i) for i in range(1, args.synthetic + 1)]
+    work = Workload(variants, excel)
+
+    report = {
+        "config": {
+            "endpoints": args.endpoints, "concurrency": args.concurrency, "requests": args.requests,
+            "docx_variants": len(variants), "response_cache": args.response_cache,
+        },
+        "results": {},
+    }
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=None) as client:
+            for endpoint in args.endpoints:
+                # una petición de calentamiento por endpoint (enums/índices en caché, imports)
+                await client.request(**work.request(endpoint, 0))
+                report["results"][endpoint] = [
+                    await run_level(client, work, endpoint, c, args.requests) for c in args.concurrency
+                ]
+    return report
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Prueba de carga en proceso (httpx.ASGITransport)")
+    ap.add_argument("--endpoints", default=",".join(ENDPOINTS),
+                    type=lambda s: [e.strip() for e in s.split(",") if e.strip()])
+    ap.add_argument("--concurrency", default="1,4,16", type=lambda s: [int(x) for x in s.split(",")])
+    ap.add_argument("--requests", type=int, default=40, help="peticiones por endpoint y nivel")
+    ap.add_argument("--synthetic", type=int, default=8, help="variantes sintéticas de la ficha")
+    ap.add_argument("--docx", default=os.path.join(ROOT, "samples", "ficha.docx"))
+    ap.add_argument("--excel", default=os.path.join(ROOT, "samples", "anexo.xlsx"))
+    ap.add_argument("--response-cache", action="store_true", help="deja activa la caché de respuestas")
+    ap.add_argument("--log-level", default="WARNING")
+    args = ap.parse_args()
+
+    unknown = set(args.endpoints) - set(ENDPOINTS)
+    if unknown:
+        ap.error(f"endpoints desconocidos: {', '.join(sorted(unknown))}")
+    settings.RESPONSE_CACHE_ENABLED = args.response_cache
+    settings.LOG_LEVEL = args.log_level
+
+    print(json.dumps(asyncio.run(main_async(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()